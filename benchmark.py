@@ -0,0 +1,408 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+import click
+
+from data_utils import collect_log_files, load_logs_to_dataframe, parse_log_bytes, orjson
+from features import preprocess_logs, build_feature_matrix, compute_reference_stats, window_nunique, SOURCE_COLUMNS, FEATURE_COLUMNS
+from model_utils import (
+    train_anomaly_model,
+    load_anomaly_model,
+    infer_anomalies,
+    analyze_anomalies,
+    save_anomaly_model,
+    make_isolation_forest,
+    CompiledForest
+)
+from report_generator import generate_html_report
+from metrics import MemorySampler
+
+COMMON_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_2) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0",
+    "okhttp/4.12.0",
+]
+ANOMALY_ENDPOINTS = ['/phpmyadmin', '/admin', '/shell', '/wp-login.php']
+
+
+def generate_synthetic_logs(
+    output_path: str,
+    rows: int,
+    endpoints: int = 200,
+    rare_user_agents: int = 500,
+    rare_ua_share: float = 0.02,
+    anomaly_share: float = 0.005,
+    start: str = "2025-01-24T00:00:00",
+    seed: int = 42
+) -> None:
+    """
+    Генерирует синтетический access-лог nginx в формате, который ожидает parse_log_line.
+
+    :param output_path: Путь к создаваемому файлу.
+    :param rows: Количество строк.
+    :param endpoints: Количество различных endpoint'ов.
+    :param rare_user_agents: Количество различных редких User-Agent'ов.
+    :param rare_ua_share: Доля запросов с редкими User-Agent'ами.
+    :param anomaly_share: Доля аномальных запросов (подозрительные endpoint'ы, ошибки, долгие ответы, всплески с одного IP).
+    :param start: Время первой записи, записи равномерно распределяются по суткам.
+    :param seed: Зерно генератора случайных чисел.
+    """
+    rnd = random.Random(seed)
+    start_dt = datetime.fromisoformat(start)
+    step = 86400 / max(rows, 1)
+    endpoint_paths = [f"/api/v1/resource{i}/data" for i in range(endpoints)]
+    rare_uas = [f"python-requests/2.{i}" for i in range(rare_user_agents)]
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for i in range(rows):
+            ts = start_dt + timedelta(seconds=i * step)
+            remote_addr = f"10.{rnd.randint(0, 3)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+            endpoint = endpoint_paths[min(int(rnd.paretovariate(1.2)) - 1, endpoints - 1)]
+            status = rnd.choices([200, 201, 304, 301, 404, 500], weights=[80, 5, 8, 2, 4, 1])[0]
+            request_time = rnd.expovariate(20)
+            user_agent = rnd.choice(rare_uas) if rnd.random() < rare_ua_share else rnd.choice(COMMON_USER_AGENTS)
+
+            if rnd.random() < anomaly_share:
+                kind = rnd.randrange(3)
+                if kind == 0:
+                    endpoint = rnd.choice(ANOMALY_ENDPOINTS)
+                    status = 404
+                elif kind == 1:
+                    status = 502
+                    request_time = rnd.uniform(5, 60)
+                else:
+                    remote_addr = "203.0.113.66"
+                    user_agent = "sqlmap/1.7"
+
+            record = {
+                "timestamp": ts.strftime('%Y-%m-%dT%H:%M:%S+03:00'),
+                "remote_addr": remote_addr,
+                "body_bytes_sent": str(rnd.randint(100, 50000)),
+                "request_time": f"{request_time:.3f}",
+                "response_status": str(status),
+                "request": f"GET {endpoint} HTTP/1.1",
+                "request_method": "GET",
+                "upstream_addr": f"10.10.0.{rnd.randint(1, 8)}:8080",
+                "http_x_real_ip": remote_addr,
+                "http_x_forwarded_for": remote_addr,
+                "http_referrer": "",
+                "http_user_agent": user_agent,
+                "http_version": "HTTP/1.1",
+                "nginx_access": True,
+            }
+            f.write(f"{ts.strftime('%b %d %H:%M:%S')} api-gateway nginx: {json.dumps(record)}\n")
+
+
+def measure_stage(name: str, rows: int, func: Callable, *args, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Выполняет этап пайплайна, измеряя время и пиковый RSS процесса.
+
+    Память опрашивается фоновым потоком MemorySampler, а не через tracemalloc:
+    трассировка каждого выделения замедляет этапы в разы и искажает время.
+
+    :return: Результат этапа и словарь с метриками.
+    """
+    with MemorySampler() as sampler:
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+
+    metrics = {
+        "stage": name,
+        "rows": rows,
+        "seconds": round(elapsed, 6),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else None,
+        "peak_rss_bytes": sampler.peak,
+    }
+    return result, metrics
+
+
+def run_benchmark(rows: int, endpoints: int = 200, anomaly_share: float = 0.005, seed: int = 42) -> Dict[str, Any]:
+    """
+    Прогоняет полный пайплайн обучения и детекции на синтетических логах
+    и возвращает метрики по каждому этапу.
+    """
+    stages: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_dir = os.path.join(tmp_dir, "logs", "bench")
+        os.makedirs(log_dir)
+        generate_synthetic_logs(
+            os.path.join(log_dir, "api-gateway2025-01-24.log"),
+            rows,
+            endpoints=endpoints,
+            anomaly_share=anomaly_share,
+            seed=seed
+        )
+
+        files, m = measure_stage("collect_log_files", rows, collect_log_files, os.path.join(tmp_dir, "logs"))
+        stages.append(m)
+        df, m = measure_stage("load_logs_to_dataframe", rows, load_logs_to_dataframe, files)
+        stages.append(m)
+        df, m = measure_stage("preprocess_logs", len(df), preprocess_logs, df)
+        stages.append(m)
+        X, m = measure_stage("build_feature_matrix", len(df), build_feature_matrix, df)
+        stages.append(m)
+        model_path = os.path.join(tmp_dir, "model.pkl")
+        model, m = measure_stage(
+            "train_anomaly_model", len(X), train_anomaly_model,
+            X, model_path=model_path, reference_stats=compute_reference_stats(df)
+        )
+        stages.append(m)
+        (_, scaler, _), m = measure_stage("load_anomaly_model", len(X), load_anomaly_model, model_path)
+        stages.append(m)
+        result_df, m = measure_stage("infer_anomalies", len(df), infer_anomalies, df, model, scaler)
+        stages.append(m)
+        anomalies_df, m = measure_stage("analyze_anomalies", len(result_df), analyze_anomalies, result_df)
+        stages.append(m)
+        _, m = measure_stage(
+            "generate_html_report", len(anomalies_df), generate_html_report,
+            anomalies_df, os.path.join(tmp_dir, "report.html")
+        )
+        stages.append(m)
+
+    return {
+        "rows": rows,
+        "endpoints": endpoints,
+        "anomaly_share": anomaly_share,
+        "seed": seed,
+        "stages": stages,
+    }
+
+
+def parse_log_line_stdlib(log_line: str) -> Dict[str, Any]:
+    """
+    Исходный парсер строки: декодированная str и стандартный json.loads.
+    Используется как точка отсчёта в benchmark_parsers.
+    """
+    json_start = log_line.find('{')
+    if json_start == -1:
+        return {}
+    try:
+        return json.loads(log_line[json_start:].strip())
+    except json.JSONDecodeError:
+        return {}
+
+
+def benchmark_parsers(rows: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Сравнивает скорость разбора строк лога исходным парсером и вариантами parse_log_bytes.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "parser.log")
+        generate_synthetic_logs(path, rows, seed=seed)
+        with open(path, 'rb') as f:
+            byte_lines = f.readlines()
+
+    variants = [
+        ("str+json (исходный)", lambda: [parse_log_line_stdlib(line.decode('utf-8')) for line in byte_lines]),
+        ("bytes+json", lambda: [parse_log_bytes(line, loads=json.loads) for line in byte_lines]),
+        ("bytes+json+projection", lambda: [parse_log_bytes(line, SOURCE_COLUMNS, loads=json.loads) for line in byte_lines]),
+    ]
+    if orjson is not None:
+        variants += [
+            ("bytes+orjson", lambda: [parse_log_bytes(line, loads=orjson.loads) for line in byte_lines]),
+            ("bytes+orjson+projection", lambda: [parse_log_bytes(line, SOURCE_COLUMNS, loads=orjson.loads) for line in byte_lines]),
+        ]
+
+    results = []
+    for name, run in variants:
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        results.append({
+            "parser": name,
+            "rows": rows,
+            "seconds": round(elapsed, 6),
+            "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else None,
+        })
+    return results
+
+
+def benchmark_distinct_counts(rows: int, precisions: Tuple[int, ...] = (10, 12, 14), seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Сравнивает точный и приближённый (HyperLogLog) подсчёт unique_ips_10min на флуде:
+    записи за 6 часов, половина - с постоянных 5000 адресов, половина - с уникальных.
+    Для приближённого подсчёта приводятся средняя и максимальная относительная ошибка
+    по 10-минутным интервалам и теоретическая стандартная ошибка 1.04 / sqrt(2^precision).
+    """
+    import numpy as np
+    import pandas as pd
+    from sketches import hll_error_bound
+
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Timestamp('2025-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 6 * 3600, rows)), unit='s')
+    regular = rng.integers(0, 5000, rows)
+    flood = rng.random(rows) < 0.5
+    addresses = np.where(flood, np.arange(rows) + 5000, regular)
+    df = pd.DataFrame({
+        'remote_addr': pd.Categorical([f"10.{a >> 16 & 255}.{a >> 8 & 255}.{a & 255}" for a in addresses]),
+    }, index=pd.DatetimeIndex(timestamps, name='timestamp'))
+
+    started = time.perf_counter()
+    exact = window_nunique(df, 'remote_addr', '10min').to_numpy()
+    results = [{"method": "exact", "rows": rows, "seconds": round(time.perf_counter() - started, 6)}]
+    for precision in precisions:
+        started = time.perf_counter()
+        approx = window_nunique(df, 'remote_addr', '10min', distinct_precision=precision).to_numpy()
+        elapsed = time.perf_counter() - started
+        # Ошибка по интервалам, а не по строкам, чтобы крупные интервалы не перевешивали
+        bucket_errors = pd.Series(np.abs(approx - exact) / exact).groupby(df.index.floor('10min')).first()
+        results.append({
+            "method": f"hll p={precision}",
+            "rows": rows,
+            "seconds": round(elapsed, 6),
+            "mean_relative_error": round(float(bucket_errors.mean()), 5),
+            "max_relative_error": round(float(bucket_errors.max()), 5),
+            "standard_error_bound": round(float(hll_error_bound(precision)), 5),
+            "sketch_bytes_per_window": 1 << precision,
+        })
+    return results
+
+
+def benchmark_model_load(trees: int = 500, repeats: int = 5, seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Сравнивает время загрузки модели из trees деревьев в прежнем формате (joblib.dump кортежа)
+    и в текущем (save_anomaly_model). Для каждого формата берётся минимальное время из repeats загрузок.
+    """
+    import joblib
+    import numpy as np
+    from sklearn.preprocessing import StandardScaler
+
+    X = np.random.default_rng(seed).normal(size=(10000, len(FEATURE_COLUMNS))).astype(np.float32)
+    model = make_isolation_forest().set_params(n_estimators=trees).fit(X)
+    scaler = StandardScaler().fit(X)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_path = os.path.join(tmp_dir, "legacy.pkl")
+        joblib.dump((model, scaler, None), legacy_path)
+        current_path = os.path.join(tmp_dir, "current.pkl")
+        with redirect_stdout(sys.stderr):
+            save_anomaly_model(model, scaler, current_path)
+        for name, path in (("joblib (прежний)", legacy_path), ("pickle + метаданные", current_path)):
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                load_anomaly_model(path)
+                timings.append(time.perf_counter() - started)
+            results.append({
+                "format": name,
+                "trees": trees,
+                "bytes": os.path.getsize(path),
+                "seconds": round(min(timings), 6),
+            })
+    return results
+
+
+def benchmark_scoring(max_rows: int = 100000, seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Сравнивает оценку IsolationForest из 500 деревьев через sklearn и через CompiledForest
+    на батчах от 1 строки до max_rows. Для каждого размера проверяется максимальное расхождение
+    score_samples и берётся минимальное время из нескольких повторов (на маленьких батчах - больше).
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(50000, len(FEATURE_COLUMNS)))
+    model = make_isolation_forest().fit(X)
+    started = time.perf_counter()
+    compiled = CompiledForest(model)
+    compile_seconds = time.perf_counter() - started
+
+    results = []
+    batch_rows = 1
+    while batch_rows <= max_rows:
+        batch = rng.normal(scale=2.0, size=(batch_rows, len(FEATURE_COLUMNS)))
+        repeats = max(1, min(20, 10000 // batch_rows))
+        timings = {}
+        for name, scorer in (("sklearn", model), ("compiled", compiled)):
+            best = None
+            for _ in range(repeats):
+                started = time.perf_counter()
+                scorer.score_samples(batch)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+        results.append({
+            "rows": batch_rows,
+            "sklearn_seconds": round(timings["sklearn"], 6),
+            "compiled_seconds": round(timings["compiled"], 6),
+            "speedup": round(timings["sklearn"] / timings["compiled"], 2),
+            "max_abs_diff": float(np.abs(model.score_samples(batch) - compiled.score_samples(batch)).max()),
+            "compile_seconds": round(compile_seconds, 6),
+        })
+        batch_rows *= 10
+    return results
+
+
+def benchmark_startup(repeats: int = 3) -> List[Dict[str, Any]]:
+    """
+    Замеряет время запуска CLI отдельными процессами: справка и лёгкая команда
+    против импорта main со всеми тяжёлыми зависимостями, который раньше выполнял каждый запуск.
+    Для каждой команды берётся минимальное время из repeats запусков.
+    """
+    manage_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manage.py")
+    commands = [
+        ("manage.py --help", [sys.executable, manage_path, "--help"]),
+        ("manage.py detect --help", [sys.executable, manage_path, "detect", "--help"]),
+        ("manage.py models list", [sys.executable, manage_path, "models", "list"]),
+        ("import main (все зависимости)", [sys.executable, "-c", "import main"]),
+    ]
+    results = []
+    for name, command in commands:
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            subprocess.run(command, cwd=os.path.dirname(manage_path), capture_output=True, check=True)
+            timings.append(time.perf_counter() - started)
+        results.append({"command": name, "seconds": round(min(timings), 6)})
+    return results
+
+
+@click.command()
+@click.option('--rows', default=100000, help='Number of synthetic log lines')
+@click.option('--endpoints', default=200, help='Number of distinct endpoints')
+@click.option('--anomaly-share', default=0.005, help='Share of injected anomalous requests')
+@click.option('--seed', default=42, help='Random seed')
+@click.option('--parser-rows', default=100000, help='Lines for the parser micro-benchmark, 0 to skip it')
+@click.option('--distinct-rows', default=200000, help='Rows for the exact vs HyperLogLog distinct count benchmark, 0 to skip it')
+@click.option('--load-trees', default=500, help='Trees in the model for the artifact load benchmark, 0 to skip it')
+@click.option('--scoring-rows', default=100000, help='Largest batch for the sklearn vs compiled forest scoring benchmark, 0 to skip it')
+@click.option('--startup-repeats', default=3, help='Runs per command for the CLI startup benchmark, 0 to skip it')
+@click.option('--output', default=None, help='Write JSON results to this file instead of stdout')
+def benchmark(rows: int, endpoints: int, anomaly_share: float, seed: int, parser_rows: int, distinct_rows: int,
+              load_trees: int, scoring_rows: int, startup_repeats: int, output: str):
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    # Этапы пайплайна печатают сообщения в stdout, JSON должен остаться чистым
+    with redirect_stdout(sys.stderr):
+        results = run_benchmark(rows, endpoints=endpoints, anomaly_share=anomaly_share, seed=seed)
+        if parser_rows:
+            results["parsers"] = benchmark_parsers(parser_rows, seed=seed)
+        if distinct_rows:
+            results["distinct_counts"] = benchmark_distinct_counts(distinct_rows, seed=seed)
+        if load_trees:
+            results["model_load"] = benchmark_model_load(load_trees, seed=seed)
+        if scoring_rows:
+            results["scoring"] = benchmark_scoring(scoring_rows, seed=seed)
+        if startup_repeats:
+            results["startup"] = benchmark_startup(startup_repeats)
+    results_json = json.dumps(results, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(results_json)
+    else:
+        click.echo(results_json)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,4 +1,39 @@
 class Settings:
     BASE_LOG_DIR: str = "/Users/katana/Proga/ALD/AI logs"
     MODEL_PATH: str = "/Users/katana/Proga/ALD/model/isolation_forest_model.pkl"
-    ONE_DAY_LOG_PATH: str = "/Users/katana/Proga/ALD/AI logs/RTK/api-gateway2025-01-24.log"
\ No newline at end of file
+    MODEL_REGISTRY_DIR: str = "/Users/katana/Proga/ALD/model/registry"
+    ONE_DAY_LOG_PATH: str = "/Users/katana/Proga/ALD/AI logs/RTK/api-gateway2025-01-24.log"
+    LIVE_LOG_PATH: str = "/var/log/nginx/api-gateway.log"
+    PARSED_CACHE_DIR: str = "/Users/katana/Proga/ALD/cache"
+    INGEST_WORKERS: int = 1
+    INGEST_CHUNK_BYTES: int = 64 * 1024 * 1024
+    STREAM_BATCH_SIZE: int = 1000
+    STREAM_BATCH_SECONDS: float = 2.0
+    STREAM_POLL_SECONDS: float = 0.5
+    TRAIN_CHUNK_ROWS: int = 500_000
+    TRAIN_SAMPLE_ROWS: int = 1_000_000
+    INFER_CHUNK_ROWS: int = 100_000
+    INFER_WORKERS: int = 1
+    SCORING_ENGINE: str = "auto"
+    COMPILED_SCORER_MAX_ROWS: int = 1000
+    REPORT_ROWS_PER_PAGE: int = 5000
+    REPORT_PATH: str = "my_anomalies_report.html"
+    INCIDENTS_OUTPUT: str = "-"
+    INCIDENT_WINDOW: str = "5min"
+    INCIDENT_KEYS: list = ["endpoint", "anomaly_rule_mask"]
+    PRINT_ANOMALY_ROWS: bool = False
+    DETECT_WORKERS: int = 4
+    INCREMENTAL_NEW_TREES: int = 50
+    MODEL_MAX_TREES: int = 500
+    METRICS_OUTPUT: str = None
+    SERVE_HOST: str = "127.0.0.1"
+    SERVE_PORT: int = 8085
+    SERVE_MAX_BATCH_ROWS: int = 5000
+    SERVE_MAX_WAIT_SECONDS: float = 0.01
+    SERVE_MAX_PENDING: int = 64
+    SERVE_MAX_BODY_BYTES: int = 16 * 1024 * 1024
+    WINDOW_FEATURES: str = "buckets"
+    MINUTE_INDEX_DIR: str = "/Users/katana/Proga/ALD/cache/minutes"
+    FEATURE_STORE_DIR: str = "/Users/katana/Proga/ALD/cache/features"
+    HLL_PRECISION: int = 10
+    DISTINCT_COUNT_PRECISION: int = None
@@ -1,28 +1,129 @@
+import io
 import os
+import re
+import bz2
+import gzip
 import json
+import hashlib
 import logging
-from typing import List, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import List, Dict, Any, Tuple, Optional, Iterator, Iterable
+import numpy as np
 import pandas as pd
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s: %(message)s'
-)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def open_zstd(path: str) -> io.BufferedReader:
+    """
+    Открывает .zst файл на потоковое чтение с распаковкой.
+    """
+    reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return io.BufferedReader(reader)
+
+# Расширения сжатых ротированных логов и функции их открытия на чтение в байтах
+COMPRESSED_LOG_OPENERS = {
+    '.gz': lambda path: gzip.open(path, 'rb'),
+    '.bz2': lambda path: bz2.open(path, 'rb'),
+    '.zst': open_zstd,
+}
+
+# api-gateway.log, api-gateway.log.1, api-gateway.log-20250124 и т.п.
+LOG_FILE_PATTERN = re.compile(r'\.(log|txt)([.-][\w-]+)?$')
+
+def compression_suffix(log_file: str) -> Optional[str]:
+    """
+    Возвращает расширение сжатия файла ('.gz', '.bz2', '.zst') или None для несжатого файла.
+    """
+    suffix = os.path.splitext(log_file)[1].lower()
+    return suffix if suffix in COMPRESSED_LOG_OPENERS else None
+
+def open_log_file(log_file: str):
+    """
+    Открывает лог-файл на чтение в байтах. Сжатые файлы распаковываются
+    потоково при чтении, без распаковки на диск.
+    """
+    suffix = compression_suffix(log_file)
+    if suffix is None:
+        return open(log_file, 'rb')
+    return COMPRESSED_LOG_OPENERS[suffix](log_file)
 
 def collect_log_files(base_dir: str) -> List[str]:
     """
-    Рекурсивно находит все файлы с логами в заданной директории.
+    Рекурсивно находит все файлы с логами в заданной директории,
+    включая ротированные и сжатые (.gz, .bz2, .zst).
     
     :param base_dir: Путь к базовой директории с логами (в папках для разных стендов).
     :return: Список путей к лог-файлам.
     """
     log_files = []
+    skipped_zstd = 0
     for root, dirs, files in os.walk(base_dir):
         for file in files:
-            if file.endswith('.log') or file.endswith('.txt'):
-                log_files.append(os.path.join(root, file))
+            suffix = compression_suffix(file)
+            name = file[:-len(suffix)] if suffix else file
+            if not LOG_FILE_PATTERN.search(name):
+                continue
+            if suffix == '.zst' and zstandard is None:
+                skipped_zstd += 1
+                continue
+            log_files.append(os.path.join(root, file))
+    if skipped_zstd:
+        logging.warning(f"Пропущено {skipped_zstd} файлов .zst: не установлен пакет zstandard.")
     return log_files
 
+LOG_DATE_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+def log_file_date(log_file: str) -> Optional[date]:
+    """
+    Дата лог-файла из его имени (например, api-gateway2025-01-24.log) или None, если даты в имени нет.
+    """
+    match = LOG_DATE_PATTERN.search(os.path.basename(log_file))
+    if not match:
+        return None
+    try:
+        return date.fromisoformat(match.group(1))
+    except ValueError:
+        return None
+
+def collect_day_files(
+    base_dir: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None
+) -> List[Tuple[str, date, str]]:
+    """
+    Находит суточные лог-файлы всех стендов за диапазон дат.
+
+    Стенд - папка первого уровня внутри base_dir, дата берётся из имени файла
+    (например, api-gateway2025-01-24.log). Файлы без даты в имени пропускаются.
+
+    :param base_dir: Путь к базовой директории с логами.
+    :param date_from: Первая дата диапазона включительно. None - без ограничения.
+    :param date_to: Последняя дата диапазона включительно. None - без ограничения.
+    :return: Список кортежей (стенд, дата, путь), отсортированный по стенду и дате.
+    """
+    day_files = []
+    for log_file in collect_log_files(base_dir):
+        day = log_file_date(log_file)
+        if day is None:
+            continue
+        if (date_from and day < date_from) or (date_to and day > date_to):
+            continue
+        stand = os.path.relpath(log_file, base_dir).split(os.sep)[0]
+        day_files.append((stand, day, log_file))
+    return sorted(day_files)
+
+# Быстрый JSON-парсер, если установлен orjson, иначе стандартный json
+json_loads = orjson.loads if orjson is not None else json.loads
+
 def parse_log_line(log_line: str) -> Dict[str, Any]:
     """
     Разбирает одну строку лога, предполагая, что полезные данные
@@ -34,21 +135,297 @@ def parse_log_line(log_line: str) -> Dict[str, Any]:
     
     json_part = log_line[json_start:].strip()
     try:
-        data = json.loads(json_part)
-    except json.JSONDecodeError:
+        data = json_loads(json_part)
+    except ValueError:
         return {}
+    return data if isinstance(data, dict) else {}
+
+def parse_log_bytes(log_line: bytes, fields: Optional[List[str]] = None, loads=json_loads) -> Dict[str, Any]:
+    """
+    Аналог parse_log_line для строки в байтах, без предварительного декодирования в str:
+    orjson и json принимают UTF-8 байты напрямую.
+
+    :param log_line: Строка лога в байтах.
+    :param fields: Поля, которые нужно оставить. None - все поля.
+    :param loads: Функция разбора JSON.
+    :return: Словарь полей или пустой словарь, если строку разобрать не удалось.
+    """
+    json_start = log_line.find(b'{')
+    if json_start == -1:
+        return {}
+    try:
+        data = loads(log_line[json_start:].strip())
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    if fields is not None:
+        return {field: data[field] for field in fields if field in data}
     return data
 
-def load_logs_to_dataframe(log_files: List[str]) -> pd.DataFrame:
+
+def split_file_ranges(log_file: str, chunk_bytes: int) -> List[Tuple[str, int, int]]:
+    """
+    Делит файл на байтовые диапазоны примерно по chunk_bytes байт.
+
+    Границы не выравниваются по строкам: строка принадлежит тому диапазону,
+    в котором находится её первый байт (см. parse_file_range).
+    Сжатый файл не делится: он целиком отдаётся одним диапазоном с концом None.
+
+    :param log_file: Путь к лог-файлу.
+    :param chunk_bytes: Желаемый размер одного диапазона в байтах.
+    :return: Список кортежей (путь, начало, конец).
+    """
+    if compression_suffix(log_file):
+        return [(log_file, 0, None)]
+    size = os.path.getsize(log_file)
+    if chunk_bytes <= 0 or size <= chunk_bytes:
+        return [(log_file, 0, size)]
+    return [(log_file, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+def parse_file_range(
+    log_file: str,
+    start: int,
+    end: Optional[int],
+    fields: Optional[List[str]] = None,
+    offsets: bool = False
+) -> Tuple[pd.DataFrame, int]:
+    """
+    Парсит строки файла, начинающиеся в диапазоне байт [start, end).
+    Для end=None файл читается до конца, так читаются сжатые файлы.
+
+    :param offsets: Добавить столбец line_offset - смещение строки записи в файле
+        (для сжатых файлов - в распакованном потоке), по которому её можно перечитать (см. read_log_rows).
+    :return: DataFrame с записями и количество отброшенных непустых строк,
+        которые не удалось разобрать.
+    """
+    rows = []
+    line_offsets = []
+    rejected = 0
+    with open_log_file(log_file) as f:
+        if start > 0:
+            # Дочитываем строку, начавшуюся в предыдущем диапазоне
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while end is None or position < end:
+            line = f.readline()
+            if not line:
+                break
+            data = parse_log_bytes(line, fields)
+            if data:
+                rows.append(data)
+                line_offsets.append(position)
+            elif line.strip():
+                rejected += 1
+            position += len(line)
+    df = pd.DataFrame(rows)
+    if offsets:
+        df['line_offset'] = np.array(line_offsets, dtype=np.int64)
+    return df, rejected
+
+def load_logs_to_dataframe(
+    log_files: List[str],
+    workers: int = 1,
+    chunk_bytes: int = 64 * 1024 * 1024,
+    fields: Optional[List[str]] = None,
+    offsets: bool = False
+) -> pd.DataFrame:
     """
     Считывает все логи из списка файлов, парсит и возвращает единый DataFrame.
+
+    Количество отброшенных строк по каждому файлу пишется в лог
+    и сохраняется в df.attrs['rejected_lines'].
+
+    :param log_files: Список путей к лог-файлам.
+    :param workers: Количество процессов для параллельного парсинга. При 1 файлы читаются последовательно.
+        Сжатые файлы распаковываются в процессах пула параллельно, по одному файлу на процесс.
+    :param chunk_bytes: Размер байтового диапазона, на который делятся большие несжатые файлы в параллельном режиме.
+    :param fields: Поля, которые нужно загрузить. None - все поля.
+    :param offsets: Добавить столбец line_offset со смещением строки каждой записи в её файле.
+    """
+    ranges = [r for log_file in log_files for r in split_file_ranges(log_file, chunk_bytes if workers > 1 else 0)]
+
+    if workers > 1 and ranges:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(parse_file_range, *zip(*ranges), [fields] * len(ranges), [offsets] * len(ranges)))
+    else:
+        results = [parse_file_range(log_file, start, end, fields, offsets) for log_file, start, end in ranges]
+
+    rejected_lines = {log_file: 0 for log_file in log_files}
+    for (log_file, _, _), (_, rejected) in zip(ranges, results):
+        rejected_lines[log_file] += rejected
+    for log_file, rejected in rejected_lines.items():
+        if rejected:
+            logging.warning(f"{log_file}: отброшено {rejected} строк, которые не удалось разобрать.")
+
+    chunks = [chunk for chunk, _ in results if not chunk.empty]
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    df.attrs['rejected_lines'] = rejected_lines
+    return df
+
+def skip_bytes(f, count: int, block_bytes: int = 1024 * 1024) -> None:
+    """
+    Пропускает count байт потока, читая их блоками (для потоков без seek).
+    """
+    while count > 0:
+        block = f.read(min(count, block_bytes))
+        if not block:
+            break
+        count -= len(block)
+
+def read_log_rows(log_file: str, offsets: Iterable[int], fields: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Перечитывает записи файла по смещениям строк (столбец line_offset, см. parse_file_range),
+    не разбирая остальные строки. Смещения обходятся по возрастанию, поэтому сжатые файлы
+    распаковываются за один проход. Поток распаковки .zst не поддерживает seek,
+    в нём байты до следующей строки пропускаются чтением.
+
+    :return: DataFrame с записями и столбцом line_offset в порядке возрастания смещений.
+    """
+    rows = []
+    line_offsets = sorted(set(int(offset) for offset in offsets))
+    with open_log_file(log_file) as f:
+        seekable = f.seekable()
+        position = 0
+        for offset in line_offsets:
+            if seekable:
+                f.seek(offset)
+            else:
+                skip_bytes(f, offset - position)
+            line = f.readline()
+            position = offset + len(line)
+            rows.append(parse_log_bytes(line, fields))
+    df = pd.DataFrame(rows)
+    df['line_offset'] = np.array(line_offsets, dtype=np.int64)
+    return df
+
+def iter_log_chunks(log_files: List[str], chunk_rows: int, fields: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Последовательно читает файлы и отдаёт распарсенные записи порциями
+    не более chunk_rows строк, не загружая файлы в память целиком.
     """
     rows = []
     for log_file in log_files:
-        with open(log_file, 'r', encoding='utf-8') as f:
+        with open_log_file(log_file) as f:
             for line in f:
-                data = parse_log_line(line)
+                data = parse_log_bytes(line, fields)
                 if data:
                     rows.append(data)
-    df = pd.DataFrame(rows)
-    return df
\ No newline at end of file
+                    if len(rows) >= chunk_rows:
+                        yield pd.DataFrame(rows)
+                        rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+
+CATEGORICAL_COLUMNS = ['remote_addr', 'request', 'http_user_agent', 'upstream_addr']
+
+def cache_file_path(log_file: str, cache_dir: str, extension: str = '.parquet') -> str:
+    """
+    Возвращает путь к кэшу распарсенного файла.
+
+    Размер и время модификации входят в имя файла, поэтому
+    изменение исходного лога автоматически инвалидирует кэш.
+    """
+    stat = os.stat(log_file)
+    key = hashlib.sha1(os.path.abspath(log_file).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{key}_{stat.st_size}_{stat.st_mtime_ns}{extension}")
+
+def write_parsed_cache(df: pd.DataFrame, cache_path: str) -> None:
+    """
+    Сохраняет распарсенный DataFrame в Parquet со словарным кодированием
+    строковых столбцов с повторяющимися значениями.
+    """
+    def categorize(frame: pd.DataFrame) -> pd.DataFrame:
+        frame = frame.copy()
+        for col in CATEGORICAL_COLUMNS:
+            if col in frame.columns:
+                frame[col] = frame[col].astype('category')
+        return frame
+
+    tmp_path = cache_path + '.tmp'
+    try:
+        categorize(df).to_parquet(tmp_path, index=False)
+    except (TypeError, ValueError):
+        # Столбец со смешанными типами значений (в том числе категориальный): приводим
+        # к строкам до перевода в категории, сохраняя пропуски
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        categorize(df).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+
+def read_parsed_cache(cache_path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Читает кэш распарсенного файла, загружая только нужные столбцы.
+    """
+    import pyarrow.parquet as pq
+
+    if columns is not None:
+        available = set(pq.read_schema(cache_path).names)
+        columns = [col for col in columns if col in available]
+    return pd.read_parquet(cache_path, columns=columns)
+
+def build_parsed_cache(log_file: str, cache_dir: str, workers: int = 1, chunk_bytes: int = 64 * 1024 * 1024) -> None:
+    """
+    Парсит один лог-файл, записывает его кэш и удаляет устаревшие кэши этого файла.
+    """
+    cache_path = cache_file_path(log_file, cache_dir)
+    df = load_logs_to_dataframe([log_file], workers=workers, chunk_bytes=chunk_bytes)
+    stale_prefix = os.path.basename(cache_path).split('_')[0] + '_'
+    for name in os.listdir(cache_dir):
+        if name.startswith(stale_prefix) and name.endswith('.parquet'):
+            os.remove(os.path.join(cache_dir, name))
+    write_parsed_cache(df, cache_path)
+
+def load_logs_cached(
+    log_files: List[str],
+    cache_dir: str,
+    columns: Optional[List[str]] = None,
+    workers: int = 1,
+    chunk_bytes: int = 64 * 1024 * 1024
+) -> pd.DataFrame:
+    """
+    Аналог load_logs_to_dataframe с постоянным столбцовым кэшем.
+
+    Каждый файл парсится один раз и сохраняется в cache_dir в формате Parquet.
+    Повторные запуски по неизменившимся файлам читают только кэш.
+
+    :param log_files: Список путей к лог-файлам.
+    :param cache_dir: Директория для кэша.
+    :param columns: Столбцы, которые нужно загрузить. None - все столбцы.
+    :param workers: Количество процессов для парсинга файлов без кэша. Если таких файлов
+        несколько, они распаковываются и парсятся параллельно по одному файлу на процесс.
+    :param chunk_bytes: Размер байтового диапазона для параллельного парсинга.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    missing = [log_file for log_file in log_files if not os.path.exists(cache_file_path(log_file, cache_dir))]
+    if workers > 1 and len(missing) > 1:
+        # Много файлов (обычно сжатый архив) - параллелим по файлам, каждый процесс
+        # сам распаковывает, парсит и пишет кэш, DataFrame'ы между процессами не передаются
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(build_parsed_cache, missing, [cache_dir] * len(missing)))
+    else:
+        for log_file in missing:
+            build_parsed_cache(log_file, cache_dir, workers=workers, chunk_bytes=chunk_bytes)
+    parsed = len(missing)
+
+    frames = []
+    for log_file in log_files:
+        df = read_parsed_cache(cache_file_path(log_file, cache_dir), columns)
+        if not df.empty:
+            frames.append(df)
+    logging.info(f"Кэш логов: распарсено {parsed} файлов, из кэша прочитано {len(log_files) - parsed}.")
+
+    if not frames:
+        return pd.DataFrame()
+    # Приводим категории разных файлов к общему набору, иначе concat вернёт object
+    for col in CATEGORICAL_COLUMNS:
+        cats = [df[col].cat.categories for df in frames if col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype)]
+        if len(cats) > 1:
+            union = cats[0].append(cats[1:]).unique()
+            for df in frames:
+                if col in df.columns:
+                    df[col] = df[col].astype(pd.CategoricalDtype(union))
+    return pd.concat(frames, ignore_index=True)
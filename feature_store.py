@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_utils import cache_file_path, read_log_rows
+from features import prepare_base_columns, FEATURE_COLUMNS
+from model_utils import evaluate_anomaly_rules, format_anomaly_reasons, ANOMALY_RULES
+
+# Версия формата хранилища. Меняется, когда меняется расчёт признаков, чтобы старые матрицы не читались
+FEATURE_STORE_VERSION = 1
+
+
+def reference_fingerprint(reference_stats: Optional[Dict[str, Any]]) -> str:
+    """
+    Отпечаток всего, от чего кроме самих логов зависят признаки: статистики обучающей выборки
+    (rare_user_agents - у моделей прежнего формата), режим оконных признаков и точность подсчёта
+    различных значений. Модели с одинаковым отпечатком (например, версии одного дообучения)
+    используют одну сохранённую матрицу.
+    """
+    stats = reference_stats or {}
+    payload = {
+        'version': FEATURE_STORE_VERSION,
+        'columns': FEATURE_COLUMNS,
+        'reference_stats': reference_stats is not None,
+        'frequent_user_agents': sorted(map(str, stats.get('frequent_user_agents', ()))),
+        'rare_user_agents': sorted(map(str, stats.get('rare_user_agents', ()))),
+        'endpoint_mean_rt': sorted((str(k), float(v)) for k, v in stats.get('endpoint_mean_rt', {}).items()),
+        'endpoint_std_rt': sorted((str(k), float(v)) for k, v in stats.get('endpoint_std_rt', {}).items()),
+        'window_features': stats.get('window_features', 'buckets'),
+        'distinct_precision': stats.get('distinct_precision'),
+    }
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+
+
+def feature_store_path(log_file: str, store_dir: str, fingerprint: str) -> str:
+    """
+    Общий префикс файлов матрицы признаков файла логов: <префикс>.features.npy - матрица float32,
+    <префикс>.offsets.npy - смещение строки каждой записи в файле, <префикс>.json - описание.
+    Как и кэш логов, инвалидируется при изменении размера или времени модификации файла.
+    """
+    return cache_file_path(log_file, store_dir, extension=f'.{fingerprint}')
+
+
+def save_feature_store(base_path: str, X: np.ndarray, offsets: np.ndarray, meta: Dict[str, Any]) -> None:
+    """
+    Сохраняет матрицу признаков и смещения строк. Описание записывается последним,
+    поэтому прерванная запись не оставляет хранилище, которое можно открыть.
+    """
+    if len(X) != len(offsets):
+        raise ValueError(f"Строк матрицы признаков ({len(X)}) и смещений ({len(offsets)}) должно быть поровну")
+    os.makedirs(os.path.dirname(base_path) or '.', exist_ok=True)
+    for suffix, array in (('.features.npy', np.ascontiguousarray(X, dtype=np.float32)), ('.offsets.npy', np.asarray(offsets, dtype=np.int64))):
+        tmp_path = base_path + suffix + '.tmp.npy'
+        np.save(tmp_path, array)
+        os.replace(tmp_path, base_path + suffix)
+    meta = {**meta, 'version': FEATURE_STORE_VERSION, 'columns': FEATURE_COLUMNS, 'rows': len(X)}
+    tmp_path = base_path + '.json.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, base_path + '.json')
+
+
+def open_feature_store(base_path: str) -> Optional[Tuple[np.ndarray, np.ndarray, Dict[str, Any]]]:
+    """
+    Открывает сохранённую матрицу признаков отображением в память: данные читаются с диска
+    по мере обращения. Возвращает None, если хранилища нет или оно другой версии.
+
+    :return: Матрица признаков (строки в порядке preprocess_logs, столбцы FEATURE_COLUMNS),
+        смещения строк записей в файле логов и описание.
+    """
+    if not os.path.exists(base_path + '.json'):
+        return None
+    with open(base_path + '.json', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != FEATURE_STORE_VERSION or meta.get('columns') != FEATURE_COLUMNS:
+        return None
+    if meta['rows'] == 0:
+        # Пустой массив нельзя отобразить в память
+        return np.empty((0, len(FEATURE_COLUMNS)), dtype=np.float32), np.empty(0, dtype=np.int64), meta
+    X = np.load(base_path + '.features.npy', mmap_mode='r')
+    offsets = np.load(base_path + '.offsets.npy', mmap_mode='r')
+    return X, offsets, meta
+
+
+def remove_stale_feature_stores(log_file: str, store_dir: str, base_path: str) -> None:
+    """
+    Удаляет матрицы признаков прежних версий файла (до изменения размера или времени модификации).
+    """
+    if not os.path.isdir(store_dir):
+        return
+    file_prefix = os.path.basename(base_path).split('_')[0] + '_'
+    current_prefix = os.path.basename(base_path).rsplit('.', 1)[0]
+    for name in os.listdir(store_dir):
+        if name.startswith(file_prefix) and not name.startswith(current_prefix) and name.endswith(('.features.npy', '.offsets.npy', '.json')):
+            os.remove(os.path.join(store_dir, name))
+
+
+def explain_stored_anomalies(
+    log_file: str,
+    X: np.ndarray,
+    offsets: np.ndarray,
+    scores: np.ndarray,
+    threshold: float = 0.0,
+    rules: list = ANOMALY_RULES
+) -> pd.DataFrame:
+    """
+    То же, что analyze_anomalies, по сохранённой матрице признаков: аномалии - строки с оценкой
+    ниже threshold (0 - порог IsolationForest.predict). Правила проверяются по признакам матрицы,
+    а исходные записи перечитываются из файла логов только для аномалий, объяснённых правилами.
+
+    :return: DataFrame аномалий в формате analyze_anomalies.
+    """
+    empty = pd.DataFrame(columns=[*FEATURE_COLUMNS, 'anomaly', 'anomaly_score', 'anomaly_rule_mask', 'anomaly_reason'])
+    positions = np.flatnonzero(scores < threshold)
+    # Сутки без разобранных записей или без аномалий: перцентильные пороги правил считать не по чему
+    if not len(positions):
+        return empty
+
+    features = pd.DataFrame(X, columns=FEATURE_COLUMNS, copy=False)
+    anomalies_df = features.iloc[positions]
+    mask, thresholds = evaluate_anomaly_rules(features, anomalies_df, rules)
+    explained = mask != 0
+    positions = positions[explained]
+    if not len(positions):
+        return empty
+
+    raw = prepare_base_columns(read_log_rows(log_file, offsets[positions])).set_index('line_offset')
+    result = raw.loc[np.asarray(offsets[positions])].reset_index()
+    for col in FEATURE_COLUMNS:
+        if col not in result.columns:
+            result[col] = X[positions, FEATURE_COLUMNS.index(col)]
+    result['anomaly'] = -1
+    result['anomaly_score'] = scores[positions]
+    result['anomaly_rule_mask'] = mask[explained]
+    result['anomaly_reason'] = format_anomaly_reasons(result, mask[explained], thresholds, rules)
+    return result
@@ -1,84 +1,214 @@
+from typing import Any, Dict, Optional
+
 import pandas as pd
 import numpy as np
 
-def preprocess_logs(df: pd.DataFrame) -> pd.DataFrame:
+from sketches import hash_column, hll_group_counts
+
+SOURCE_COLUMNS = [
+    'timestamp',
+    'remote_addr',
+    'request',
+    'request_time',
+    'body_bytes_sent',
+    'response_status',
+    'http_user_agent'
+]
+
+SUSPICIOUS_ENDPOINTS = ['/phpmyadmin','/admin','/shell','/wp-login.php'] #!!!!
+
+FEATURE_COLUMNS = [
+    'request_time',
+    'body_bytes_sent',
+    'response_status',
+    'requests_per_minute',
+    'error_rate_5min',
+    'endpoint_variance_5min',
+    'is_rare_ua',
+    'endpoint_zscore',
+    'is_suspicious_endpoint',
+    'is_redirect',
+    'redirect_rate_5min',
+    'unique_ips_10min'
+]
+
+# Строковые столбцы с повторяющимися значениями, которые хранятся как category
+CATEGORY_COLUMNS = ['remote_addr', 'http_user_agent', 'upstream_addr', 'request_method', 'http_version']
+
+def prepare_base_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Базовая предобработка и извлечение ключевых признаков.
+    Приводит типы исходных столбцов и выделяет endpoint из строки запроса.
     """
     if 'timestamp' in df.columns:
         df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
     else:
         df['timestamp'] = pd.NaT
 
-    def extract_endpoint(request: str) -> str:
-        try:
-            parts = request.split()
-            return parts[1] if len(parts) > 1 else 'unknown'
-        except:
-            return 'unknown'
-
     if 'request' in df.columns:
-        df['endpoint'] = df['request'].apply(extract_endpoint)
+        # Второе слово строки запроса, как request.split()[1]; нестроковые значения -> 'unknown'.
+        # Разбираем только уникальные строки запросов и раскладываем результат по кодам,
+        # код -1 (пропуск) указывает на добавленный в конец 'unknown'.
+        codes, uniques = pd.factorize(df['request'])
+        endpoints = pd.Series(uniques, dtype=object).str.split(n=2).str[1].fillna('unknown')
+        endpoint_codes, endpoint_names = pd.factorize(np.append(endpoints.to_numpy(), 'unknown').astype(object))
+        df['endpoint'] = pd.Categorical.from_codes(endpoint_codes[codes], endpoint_names)
     else:
-        df['endpoint'] = 'unknown'
+        df['endpoint'] = pd.Categorical(['unknown'] * len(df))
 
     df['request_time'] = pd.to_numeric(df['request_time'], errors='coerce')
     df['body_bytes_sent'] = pd.to_numeric(df['body_bytes_sent'], errors='coerce')
     df['response_status'] = pd.to_numeric(df['response_status'], errors='coerce')
     df.fillna({'request_time': 0, 'body_bytes_sent': 0, 'response_status': 0}, inplace=True)
+    # Целочисленные столбцы хранятся в наименьшем подходящем типе
+    df['body_bytes_sent'] = pd.to_numeric(df['body_bytes_sent'], downcast='integer')
+    df['response_status'] = pd.to_numeric(df['response_status'], downcast='integer')
+    return df
+
+def endpoint_zscore(df: pd.DataFrame) -> np.ndarray:
+    """
+    Z-оценка времени ответа относительно mean_rt/std_rt endpoint'а (0 при нулевом std_rt).
+    """
+    std_rt = df['std_rt'].to_numpy()
+    deviation = df['request_time'].to_numpy() - df['mean_rt'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(std_rt == 0, 0.0, deviation / std_rt)
+
+def compute_reference_stats(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Извлекает из результата preprocess_logs эталонные статистики обучающей выборки:
+    множество частых (не редких) User-Agent'ов и среднее/стандартное отклонение времени ответа по endpoint'ам.
+    Они сохраняются вместе с моделью и используются при детекции.
+
+    Хранятся именно частые User-Agent'ы: при детекции редким считается любой другой,
+    в том числе не встречавшийся при обучении (типичный случай сканеров и ботов).
+    """
+    endpoint_stats = df.groupby('endpoint', observed=True)[['mean_rt', 'std_rt']].first()
+    frequent = df.loc[(df['is_rare_ua'] == 0) & df['http_user_agent'].notna(), 'http_user_agent']
+    return {
+        'frequent_user_agents': set(frequent.unique()),
+        'endpoint_mean_rt': endpoint_stats['mean_rt'].to_dict(),
+        'endpoint_std_rt': endpoint_stats['std_rt'].to_dict(),
+    }
+
+def apply_reference_stats(df: pd.DataFrame, reference_stats: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Считает is_rare_ua, mean_rt, std_rt и endpoint_zscore поиском по сохранённым статистикам.
+    Редкий - любой User-Agent не из частых обучающей выборки, кроме пропуска (как в preprocess_logs).
+    Для endpoint'ов, которых не было в обучающей выборке, z-оценка равна 0.
+    У моделей, сохранённых до появления frequent_user_agents, редкими считаются только
+    редкие User-Agent'ы обучающей выборки.
+    """
+    user_agents = df['http_user_agent']
+    if 'frequent_user_agents' in reference_stats:
+        is_rare = ~user_agents.isin(reference_stats['frequent_user_agents']) & user_agents.notna()
+    else:
+        is_rare = user_agents.isin(reference_stats['rare_user_agents'])
+    df['is_rare_ua'] = is_rare.astype('int8')
+    df['mean_rt'] = df['endpoint'].map(reference_stats['endpoint_mean_rt']).astype('float64').fillna(0)
+    df['std_rt'] = df['endpoint'].map(reference_stats['endpoint_std_rt']).astype('float64').fillna(0)
+    df['endpoint_zscore'] = endpoint_zscore(df)
+    return df
 
-    df = df.sort_values(by='timestamp').set_index('timestamp')
+def model_distinct_precision(reference_stats: Optional[Dict[str, Any]]) -> Optional[int]:
+    """
+    Точность HyperLogLog, с которой при обучении модели считались количества различных значений,
+    или None, если они считались точно (в том числе у моделей без этой отметки).
+    """
+    return (reference_stats or {}).get('distinct_precision')
 
-    df['requests_per_minute'] = (
-        df.groupby(pd.Grouper(freq='1min'))['remote_addr']
-          .transform('count')
-    )
+def window_nunique(df: pd.DataFrame, column: str, freq: str, distinct_precision: Optional[int] = None) -> pd.Series:
+    """
+    Количество различных значений column (пропуск - тоже значение) в интервале freq каждой записи.
+    df должен быть проиндексирован по времени, интервалы выровнены как у pd.Grouper.
 
-    df['is_error'] = df['response_status'].apply(lambda x: 1 if x >= 400 else 0)
-    df['error_rate_5min'] = (
-        df.groupby(pd.Grouper(freq='5min'))['is_error']
-          .transform('mean')
-    )
+    :param distinct_precision: None - точный подсчёт. Иначе приближённый, скетчами HyperLogLog
+        с этой точностью (см. sketches.py): относительная ошибка около 1.04 / sqrt(2^distinct_precision),
+        память - 2^distinct_precision байт на интервал вместо хэш-таблицы значений.
+    """
+    if distinct_precision is None:
+        # Записи без времени не попадают ни в один интервал, для них 0
+        return df.groupby(pd.Grouper(freq=freq))[column].transform('nunique', dropna=False).fillna(0).astype('int32')
+
+    codes, buckets = pd.factorize(df.index.floor(freq))
+    # Записи без времени не попадают ни в один интервал, для них 0
+    valid = codes >= 0
+    counts = hll_group_counts(codes[valid], len(buckets), hash_column(df[column][valid]), distinct_precision)
+    result = np.zeros(len(df), dtype='int32')
+    result[valid] = counts[codes[valid]]
+    return pd.Series(result, index=df.index)
+
+def preprocess_logs(
+    df: pd.DataFrame,
+    reference_stats: Optional[Dict[str, Any]] = None,
+    minute_index: Optional[Dict[str, Any]] = None,
+    distinct_precision: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Базовая предобработка и извлечение ключевых признаков.
 
-    df['endpoint_variance_5min'] = (
-        df.groupby(pd.Grouper(freq='5min'))['endpoint']
-          .transform(lambda x: len(set(x)))
-    )
+    :param df: Распарсенные логи.
+    :param reference_stats: Статистики обучающей выборки (см. compute_reference_stats).
+        Если не заданы, редкие User-Agent'ы и z-оценки считаются по самому df.
+    :param minute_index: Поминутный индекс (см. minute_index.load_minute_index). Если задан,
+        оконные признаки берутся из него по скользящим окнам, заканчивающимся минутой записи,
+        а не считаются по фиксированным интервалам pd.Grouper.
+    :param distinct_precision: Точность HyperLogLog для endpoint_variance_5min и unique_ips_10min
+        по фиксированным интервалам (см. window_nunique). None - точный подсчёт.
+        В поминутном индексе количества различных значений всегда приближённые.
+    """
+    df = prepare_base_columns(df)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = df[col].astype('category')
+
+    df = df.sort_values(by='timestamp')
+    if minute_index is not None:
+        from minute_index import apply_minute_index
+        apply_minute_index(df, minute_index)
+    df = df.set_index('timestamp')
+
+    if minute_index is None:
+        df['requests_per_minute'] = (
+            df.groupby(pd.Grouper(freq='1min'))['remote_addr']
+              .transform('count')
+              .fillna(0)
+              .astype('int32')
+        )
+
+        df['is_error'] = (df['response_status'] >= 400).astype('int8')
+        df['error_rate_5min'] = (
+            df.groupby(pd.Grouper(freq='5min'))['is_error']
+              .transform('mean')
+        )
+
+        df['endpoint_variance_5min'] = window_nunique(df, 'endpoint', '5min', distinct_precision)
 
     if 'http_user_agent' not in df.columns:
-        df['http_user_agent'] = 'unknown'
-    ua_counts = df['http_user_agent'].value_counts()
-    total_ua = len(df)
-    threshold_freq = 0.005 * total_ua
-    rare_ua_set = set(ua_counts[ua_counts < threshold_freq].index)
-    df['is_rare_ua'] = df['http_user_agent'].apply(lambda ua: 1 if ua in rare_ua_set else 0)
-
-    endpoint_stats = df.groupby('endpoint')['request_time'].agg(['mean','std']).rename(columns={'mean':'mean_rt','std':'std_rt'})
-    endpoint_stats.fillna(0, inplace=True)
-    df = df.reset_index().merge(endpoint_stats, how='left', on='endpoint').set_index('timestamp')
-
-    def zscore(row):
-        std_rt = row['std_rt']
-        mean_rt = row['mean_rt']
-        if std_rt == 0:
-            return 0
-        return (row['request_time'] - mean_rt) / std_rt
-
-    df['endpoint_zscore'] = df.apply(zscore, axis=1)
-
-    SUSPICIOUS_ENDPOINTS = {'/phpmyadmin','/admin','/shell','/wp-login.php'} #!!!!
-    df['is_suspicious_endpoint'] = df['endpoint'].apply(lambda ep: 1 if ep.lower() in SUSPICIOUS_ENDPOINTS else 0)
-
-    df['is_redirect'] = df['response_status'].apply(lambda x: 1 if 300 <= x < 400 else 0)
-    df['redirect_rate_5min'] = (
-        df.groupby(pd.Grouper(freq='5min'))['is_redirect']
-          .transform('mean')
-    )
-
-    df['unique_ips_10min'] = (
-        df.groupby(pd.Grouper(freq='10min'))['remote_addr']
-          .transform(lambda x: len(set(x)))
-    )
+        df['http_user_agent'] = pd.Categorical(['unknown'] * len(df))
+    if reference_stats is not None:
+        apply_reference_stats(df, reference_stats)
+    else:
+        ua_counts = df['http_user_agent'].value_counts()
+        total_ua = len(df)
+        threshold_freq = 0.005 * total_ua
+        rare_ua_set = ua_counts[ua_counts < threshold_freq].index
+        df['is_rare_ua'] = df['http_user_agent'].isin(rare_ua_set).astype('int8')
+
+        endpoint_rt = df.groupby('endpoint', observed=True)['request_time']
+        df['mean_rt'] = endpoint_rt.transform('mean')
+        df['std_rt'] = endpoint_rt.transform('std').fillna(0)
+        df['endpoint_zscore'] = endpoint_zscore(df)
+
+    df['is_suspicious_endpoint'] = df['endpoint'].str.lower().isin(SUSPICIOUS_ENDPOINTS).astype('int8')
+
+    df['is_redirect'] = df['response_status'].between(300, 400, inclusive='left').astype('int8')
+    if minute_index is None:
+        df['redirect_rate_5min'] = (
+            df.groupby(pd.Grouper(freq='5min'))['is_redirect']
+              .transform('mean')
+        )
+
+        df['unique_ips_10min'] = window_nunique(df, 'remote_addr', '10min', distinct_precision)
 
     df = df.reset_index()
     df.drop(columns=['is_error'], inplace=True, errors='ignore')
@@ -89,20 +219,13 @@ def preprocess_logs(df: pd.DataFrame) -> pd.DataFrame:
 def build_feature_matrix(df: pd.DataFrame) -> pd.DataFrame:
     """
     Формирует готовую матрицу признаков для обучения модели.
+
+    Матрица собирается в один непрерывный (C-order) массив float32 - тип, с которым
+    работают деревья IsolationForest, - и оборачивается в DataFrame без копирования,
+    так что X.to_numpy() возвращает этот же массив.
     """
-    feature_cols = [
-        'request_time',
-        'body_bytes_sent',
-        'response_status',
-        'requests_per_minute',
-        'error_rate_5min',
-        'endpoint_variance_5min',
-        'is_rare_ua',
-        'endpoint_zscore',
-        'is_suspicious_endpoint',
-        'is_redirect',
-        'redirect_rate_5min',
-        'unique_ips_10min'
-    ]
-    X = df[feature_cols].fillna(0)
-    return X
\ No newline at end of file
+    values = np.empty((len(df), len(FEATURE_COLUMNS)), dtype=np.float32)
+    for i, col in enumerate(FEATURE_COLUMNS):
+        values[:, i] = df[col].to_numpy(dtype=np.float32, na_value=np.nan)
+    np.nan_to_num(values, copy=False, nan=0.0, posinf=np.inf, neginf=-np.inf)
+    return pd.DataFrame(values, columns=FEATURE_COLUMNS, copy=False)
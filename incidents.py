@@ -0,0 +1,133 @@
+import sys
+import json
+import logging
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from model_utils import ANOMALY_RULES
+
+# Признаки, по которым аномалии одного интервала объединяются в инцидент.
+# Вместо текста причины используется маска сработавших правил: в тексте есть значения строки.
+# remote_addr по умолчанию не входит в ключ, чтобы флуд с многих адресов был одним инцидентом;
+# количество адресов инцидента есть в поле remote_addrs.
+INCIDENT_KEYS = ['endpoint', 'anomaly_rule_mask']
+
+# Столбцы примеров записей инцидента
+EXEMPLAR_COLUMNS = [
+    'timestamp', 'remote_addr', 'request', 'response_status', 'request_time',
+    'body_bytes_sent', 'http_user_agent', 'anomaly_score', 'anomaly_reason'
+]
+
+# Размер буфера записи файла инцидентов
+WRITE_BUFFER_BYTES = 1024 * 1024
+
+
+def rule_labels(mask: int, rules: list = ANOMALY_RULES) -> str:
+    """
+    Краткое описание сработавших правил по битовой маске, например 'request_time > p98; is_rare_ua == 1'.
+    """
+    return '; '.join(
+        f"{rule['column']} {rule['op']} {rule['threshold']}"
+        for i, rule in enumerate(rules) if (mask >> i) & 1
+    )
+
+
+def aggregate_incidents(
+    anomalies_df: pd.DataFrame,
+    window: str = '5min',
+    keys: List[str] = INCIDENT_KEYS,
+    exemplars: int = 3,
+    rules: list = ANOMALY_RULES
+) -> pd.DataFrame:
+    """
+    Объединяет аномалии (результат analyze_anomalies) в инциденты: записи одного интервала
+    window с одинаковыми значениями keys.
+
+    :param exemplars: Сколько записей с наименьшей оценкой (самых аномальных) приводить как пример.
+    :return: DataFrame по инциденту на строку: начало интервала, значения keys, количество записей
+        (и различных remote_addr, если он не в keys), время первой и последней, минимум/максимум/среднее
+        anomaly_score, правила и примеры записей.
+        Инциденты упорядочены по интервалу, внутри интервала - по убыванию количества записей.
+    """
+    if anomalies_df.empty:
+        return pd.DataFrame(columns=['window_start', *keys, 'count', 'first_seen', 'last_seen',
+                                     'score_min', 'score_max', 'score_mean', 'remote_addrs', 'rules', 'exemplars'])
+
+    keys = [key for key in keys if key in anomalies_df.columns]
+    df = anomalies_df.assign(window_start=anomalies_df['timestamp'].dt.floor(window))
+    grouped = df.groupby(['window_start', *keys], observed=True, dropna=False, sort=False)
+    incident_id = grouped.ngroup().to_numpy()
+
+    incidents = grouped.agg(
+        count=('anomaly_score', 'size'),
+        first_seen=('timestamp', 'min'),
+        last_seen=('timestamp', 'max'),
+        score_min=('anomaly_score', 'min'),
+        score_max=('anomaly_score', 'max'),
+        score_mean=('anomaly_score', 'mean'),
+    ).reset_index()
+    if 'remote_addr' in df.columns and 'remote_addr' not in keys:
+        incidents['remote_addrs'] = grouped['remote_addr'].nunique().to_numpy()
+
+    if 'anomaly_rule_mask' in incidents.columns:
+        masks = incidents['anomaly_rule_mask'].astype('int64')
+        labels = {mask: rule_labels(mask, rules) for mask in masks.unique()}
+        incidents['rules'] = masks.map(labels)
+    else:
+        incidents['rules'] = ''
+
+    # Примеры: первые записи каждого инцидента после сортировки по оценке
+    columns = [col for col in EXEMPLAR_COLUMNS if col in df.columns]
+    order = np.lexsort((df['anomaly_score'].to_numpy(), incident_id))
+    sorted_ids = incident_id[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_ids, sorted_ids)
+    picked = order[rank < exemplars]
+    exemplar_df = df.iloc[picked][columns].copy()
+    if 'timestamp' in exemplar_df.columns:
+        exemplar_df['timestamp'] = exemplar_df['timestamp'].astype(str)
+    for col in exemplar_df.columns:
+        if isinstance(exemplar_df[col].dtype, pd.CategoricalDtype):
+            exemplar_df[col] = exemplar_df[col].astype(object)
+    exemplar_df = exemplar_df.astype(object).where(exemplar_df.notna(), None)
+    records = exemplar_df.to_dict('records')
+    per_incident: List[list] = [[] for _ in range(len(incidents))]
+    for group, record in zip(incident_id[picked], records):
+        per_incident[group].append(record)
+    incidents['exemplars'] = per_incident
+
+    return incidents.sort_values(['window_start', 'count'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+
+def write_incidents(incidents: pd.DataFrame, path: str = '-', output_format: Optional[str] = None) -> None:
+    """
+    Записывает инциденты в NDJSON (по инциденту на строку) или CSV (примеры - JSON в столбце exemplars).
+
+    :param path: Путь к файлу или '-' для stdout.
+    :param output_format: 'ndjson' или 'csv'. По умолчанию - по расширению файла, для stdout - NDJSON.
+    """
+    if output_format is None:
+        output_format = 'csv' if path.endswith('.csv') else 'ndjson'
+
+    out = incidents.copy()
+    for col in ('window_start', 'first_seen', 'last_seen'):
+        if col in out.columns:
+            out[col] = out[col].astype(str)
+    if 'anomaly_rule_mask' in out.columns:
+        out['anomaly_rule_mask'] = out['anomaly_rule_mask'].astype('int64')
+
+    f = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='', buffering=WRITE_BUFFER_BYTES)
+    try:
+        if output_format == 'csv':
+            out['exemplars'] = [json.dumps(items, ensure_ascii=False, default=str) for items in out['exemplars']]
+            out.to_csv(f, index=False)
+        elif not out.empty:
+            out.to_json(f, orient='records', lines=True, force_ascii=False, default_handler=str)
+    finally:
+        if f is sys.stdout:
+            f.flush()
+        else:
+            f.close()
+    if path != '-':
+        logging.info(f"Инциденты ({len(incidents)}) сохранены в {path}")
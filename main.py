@@ -1,98 +1,639 @@
+import os
+import sys
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
 from model_utils import (
     train_anomaly_model,
     infer_anomalies,
     analyze_anomalies,
-    load_anomaly_model
+    load_anomaly_model,
+    train_anomaly_model_chunked,
+    save_anomaly_model,
+    stand_model_path,
+    update_anomaly_model,
+    score_anomalies,
+    scoring_model
 )
-from data_utils import collect_log_files, load_logs_to_dataframe
-from features import preprocess_logs, build_feature_matrix
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-from report_generator import generate_html_report
+from model_registry import register_model_file, active_model_version, load_model_metadata, model_version_path
+from data_utils import collect_log_files, collect_day_files, load_logs_to_dataframe, load_logs_cached, log_file_date
+from features import preprocess_logs, build_feature_matrix, compute_reference_stats, model_distinct_precision, SOURCE_COLUMNS, FEATURE_COLUMNS
+from metrics import PipelineMetrics
 
 from config import Settings
 settings = Settings()
 
 
 
-def main_train(base_dir: str, model_path: str = None):
+def load_window_index(log_files: List[str], window_features: str) -> Optional[Dict[str, Any]]:
+    """
+    Поминутный индекс файлов для оконных признаков по скользящим окнам
+    (Settings.WINDOW_FEATURES = 'sliding') или None для фиксированных интервалов.
+    """
+    if window_features != 'sliding':
+        return None
+    from minute_index import load_minute_index
+    return load_minute_index(log_files, settings.MINUTE_INDEX_DIR, settings.HLL_PRECISION, cache_dir=settings.PARSED_CACHE_DIR)
+
+def day_window_files(log_path: str) -> List[str]:
+    """
+    Файлы, по которым строится индекс для суток: сам файл и файл предыдущего дня,
+    чтобы окна первых минут суток учитывали конец предыдущих.
+    """
+    from minute_index import previous_day_file
+    previous = previous_day_file(log_path)
+    return [previous, log_path] if previous else [log_path]
+
+def model_window_features(reference_stats: Optional[Dict[str, Any]]) -> str:
+    """
+    Режим оконных признаков, с которым обучена модель. У моделей без этой отметки - фиксированные интервалы.
+    """
+    return (reference_stats or {}).get('window_features', 'buckets')
+
+def load_scoring_model(model_path: str):
+    """
+    Загружает модель и готовит её к оценке способом Settings.SCORING_ENGINE (см. model_utils.scoring_model).
+    """
+    model, scaler, reference_stats = load_anomaly_model(model_path)
+    return scoring_model(model, settings.SCORING_ENGINE, settings.COMPILED_SCORER_MAX_ROWS), scaler, reference_stats
+
+def training_window(files: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Первая и последняя дата логов, на которых обучалась модель (по именам файлов).
+    """
+    days = [day for day in map(log_file_date, files) if day is not None]
+    return {
+        'train_from': min(days).isoformat() if days else None,
+        'train_to': max(days).isoformat() if days else None,
+    }
+
+def main_train(
+    base_dir: str,
+    model_path: str = None,
+    workers: int = settings.INGEST_WORKERS,
+    registry_dir: Optional[str] = None,
+    metrics: Optional[PipelineMetrics] = None
+):
     """
     Основная функция для обучения модели на всех логах.
+    Если задан registry_dir, сохранённая модель регистрируется в реестре как новая активная версия.
+    Время, количество строк и пиковая память каждого этапа пишутся в metrics.
     """
+    if metrics is None:
+        metrics = PipelineMetrics('train')
+
     logging.info("Собираем список лог-файлов...")
-    files = collect_log_files(base_dir)
+    with metrics.stage('collect_log_files') as stage:
+        files = collect_log_files(base_dir)
+        stage['rows'] = len(files)
     logging.info(f"Найдено {len(files)} файлов с логами.")
 
     logging.info("Считываем логи в DataFrame...")
-    df = load_logs_to_dataframe(files)
+    with metrics.stage('load_logs') as stage:
+        if settings.PARSED_CACHE_DIR:
+            df = load_logs_cached(
+                files,
+                settings.PARSED_CACHE_DIR,
+                columns=SOURCE_COLUMNS,
+                workers=workers,
+                chunk_bytes=settings.INGEST_CHUNK_BYTES
+            )
+        else:
+            df = load_logs_to_dataframe(files, workers=workers, chunk_bytes=settings.INGEST_CHUNK_BYTES, fields=SOURCE_COLUMNS)
+        stage['rows'] = len(df)
     logging.info(f"Общее количество записей в логах: {len(df)}")
 
     logging.info("Предобрабатываем логи и создаём признаки...")
-    df_preproc = preprocess_logs(df)
+    with metrics.stage('load_window_index') as stage:
+        window_index = load_window_index(files, settings.WINDOW_FEATURES)
+        stage['rows'] = len(window_index['minutes']) if window_index is not None else 0
+
+    with metrics.stage('preprocess_logs') as stage:
+        df_preproc = preprocess_logs(df, minute_index=window_index, distinct_precision=settings.DISTINCT_COUNT_PRECISION)
+        stage['rows'] = len(df_preproc)
 
     logging.info("Формируем матрицу признаков для обучения...")
-    X = build_feature_matrix(df_preproc)
+    with metrics.stage('build_feature_matrix') as stage:
+        X = build_feature_matrix(df_preproc)
+        stage['rows'] = len(X)
+
+    with metrics.stage('compute_reference_stats') as stage:
+        reference_stats = compute_reference_stats(df_preproc)
+        reference_stats['window_features'] = settings.WINDOW_FEATURES
+        reference_stats['distinct_precision'] = settings.DISTINCT_COUNT_PRECISION
+        stage['rows'] = len(df_preproc)
 
     logging.info("Обучаем модель обнаружения аномалий...")
-    model = train_anomaly_model(X, model_path=model_path)
+    with metrics.stage('train_anomaly_model') as fit_stage:
+        model = train_anomaly_model(X, model_path=model_path, reference_stats=reference_stats)
+        fit_stage['rows'] = len(X)
+
+    if registry_dir and model_path:
+        register_model_file(registry_dir, model_path, {
+            'mode': 'full',
+            'parent': None,
+            **training_window(files),
+            'files': len(files),
+            'rows': len(X),
+            'new_rows': len(X),
+            'fit_seconds': round(fit_stage['seconds'], 3),
+            'n_estimators': len(model.estimators_),
+        })
 
     logging.info("Модель успешно обучена.")
+    metrics.log_summary()
+    return model
+
+def main_train_per_stand(
+    base_dir: str,
+    model_path: str,
+    workers: int = settings.INGEST_WORKERS,
+    metrics: Optional[PipelineMetrics] = None
+):
+    """
+    Обучает отдельную модель для каждого стенда (папки первого уровня в base_dir).
+    Модели сохраняются по путям stand_model_path(model_path, <стенд>).
+    Этапы обучения каждого стенда пишутся в metrics с префиксом "<стенд>/".
+    """
+    if metrics is None:
+        metrics = PipelineMetrics('train')
+
+    for stand in sorted(os.listdir(base_dir)):
+        stand_dir = os.path.join(base_dir, stand)
+        if not os.path.isdir(stand_dir):
+            continue
+        path = stand_model_path(model_path, stand)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        logging.info(f"Обучаем модель стенда {stand}...")
+        stand_metrics = PipelineMetrics(metrics.pipeline)
+        main_train(stand_dir, model_path=path, workers=workers, metrics=stand_metrics)
+        metrics.stages.extend({**stage, 'stage': f"{stand}/{stage['stage']}"} for stage in stand_metrics.stages)
+
+def main_train_chunked(
+    base_dir: str,
+    model_path: str = None,
+    registry_dir: Optional[str] = None,
+    metrics: Optional[PipelineMetrics] = None
+):
+    """
+    Обучение модели на истории, не помещающейся в память: логи читаются порциями,
+    признаки считаются инкрементально, модель обучается на ограниченной выборке.
+    Чтение порций и расчёт признаков идут внутри этапа train_anomaly_model_chunked.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics('train')
+
+    logging.info("Собираем список лог-файлов...")
+    with metrics.stage('collect_log_files') as stage:
+        files = collect_log_files(base_dir)
+        stage['rows'] = len(files)
+    logging.info(f"Найдено {len(files)} файлов с логами.")
+
+    from streaming import iter_feature_chunks, RunningReferenceStats
+
+    logging.info("Обучаем модель по порциям логов...")
+    running_stats = RunningReferenceStats()
+    with metrics.stage('train_anomaly_model_chunked') as fit_stage:
+        model, scaler = train_anomaly_model_chunked(
+            iter_feature_chunks(files, settings.TRAIN_CHUNK_ROWS, running_stats, distinct_precision=settings.DISTINCT_COUNT_PRECISION),
+            sample_rows=settings.TRAIN_SAMPLE_ROWS
+        )
+        fit_stage['rows'] = running_stats.total_rows
+    fit_seconds = round(fit_stage['seconds'], 3)
+    if model_path:
+        reference_stats = running_stats.to_reference_stats()
+        reference_stats['distinct_precision'] = settings.DISTINCT_COUNT_PRECISION
+        with metrics.stage('save_anomaly_model'):
+            save_anomaly_model(model, scaler, model_path, reference_stats)
+        if registry_dir:
+            register_model_file(registry_dir, model_path, {
+                'mode': 'chunked',
+                'parent': None,
+                **training_window(files),
+                'files': len(files),
+                'rows': running_stats.total_rows,
+                'new_rows': running_stats.total_rows,
+                'fit_seconds': fit_seconds,
+                'n_estimators': len(model.estimators_),
+            })
+
+    logging.info("Модель успешно обучена.")
+    metrics.log_summary()
+    return model
+
+def main_train_incremental(
+    base_dir: str,
+    model_path: str,
+    registry_dir: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    workers: int = settings.INGEST_WORKERS,
+    metrics: Optional[PipelineMetrics] = None
+):
+    """
+    Дообучает активную версию модели из реестра на новых сутках логов, не перечитывая историю.
+
+    Признаки новых суток считаются отдельно, со статистиками обучающей выборки активной версии
+    (редкие User-Agent'ы и z-оценки не пересчитываются). Лес обновляется через update_anomaly_model,
+    результат сохраняется в model_path и регистрируется как новая активная версия.
+
+    :param date_from: Первая дата новых логов. По умолчанию - следующий день после окна обучения активной версии.
+    :param date_to: Последняя дата новых логов. None - без ограничения.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics('train')
+
+    parent = active_model_version(registry_dir)
+    if parent is None:
+        logging.error("В реестре нет активной модели, сначала обучите модель полностью.")
+        return None
+    parent_meta = load_model_metadata(registry_dir, parent)
+    if date_from is None and parent_meta.get('train_to'):
+        date_from = date.fromisoformat(parent_meta['train_to']) + timedelta(days=1)
+
+    with metrics.stage('collect_log_files') as stage:
+        day_files = collect_day_files(base_dir, date_from, date_to)
+        stage['rows'] = len(day_files)
+    if not day_files:
+        logging.info(f"Новых суточных логов с {date_from} нет, дообучение не требуется.")
+        return None
+    files = [log_path for _, _, log_path in day_files]
+    logging.info(f"Дообучаем версию {parent} на {len(files)} новых файлах...")
+
+    with metrics.stage('load_anomaly_model'):
+        model, scaler, reference_stats = load_anomaly_model(model_version_path(registry_dir, parent))
+    with metrics.stage('load_logs') as stage:
+        df = load_logs_to_dataframe(files, workers=workers, chunk_bytes=settings.INGEST_CHUNK_BYTES, fields=SOURCE_COLUMNS)
+        stage['rows'] = len(df)
+    with metrics.stage('load_window_index') as stage:
+        window_index = load_window_index(files, model_window_features(reference_stats))
+        stage['rows'] = len(window_index['minutes']) if window_index is not None else 0
+    with metrics.stage('preprocess_logs') as stage:
+        df_preproc = preprocess_logs(df, reference_stats, minute_index=window_index,
+                                     distinct_precision=model_distinct_precision(reference_stats))
+        stage['rows'] = len(df_preproc)
+    with metrics.stage('build_feature_matrix') as stage:
+        X = build_feature_matrix(df_preproc)
+        stage['rows'] = len(X)
+
+    with metrics.stage('update_anomaly_model') as fit_stage:
+        model, scaler = update_anomaly_model(
+            model,
+            scaler,
+            X,
+            new_trees=settings.INCREMENTAL_NEW_TREES,
+            max_trees=settings.MODEL_MAX_TREES,
+            # Новое зерно на каждую версию, чтобы новые деревья не повторяли удалённые
+            random_state=int(parent[1:]) + 1
+        )
+        fit_stage['rows'] = len(X)
+    fit_seconds = round(fit_stage['seconds'], 3)
+    with metrics.stage('save_anomaly_model'):
+        save_anomaly_model(model, scaler, model_path, reference_stats)
+
+    window = training_window(files)
+    register_model_file(registry_dir, model_path, {
+        'mode': 'incremental',
+        'parent': parent,
+        'train_from': parent_meta.get('train_from') or window['train_from'],
+        'train_to': window['train_to'],
+        'files': parent_meta.get('files', 0) + len(files),
+        'rows': parent_meta.get('rows', 0) + len(X),
+        'new_rows': len(X),
+        'fit_seconds': fit_seconds,
+        'n_estimators': len(model.estimators_),
+    })
+
+    logging.info("Модель успешно дообучена.")
+    metrics.log_summary()
     return model
 
-def main_detect_one_day(model_path: str, one_day_log_path: str, html_report: bool = False):
+def main_detect_one_day(
+    model_path: str,
+    one_day_log_path: str,
+    html_report: bool = False,
+    workers: int = settings.INGEST_WORKERS,
+    infer_chunk_rows: int = settings.INFER_CHUNK_ROWS,
+    infer_workers: int = settings.INFER_WORKERS,
+    metrics: Optional[PipelineMetrics] = None,
+    report_path: str = settings.REPORT_PATH,
+    print_rows: bool = settings.PRINT_ANOMALY_ROWS,
+    incidents_output: Optional[str] = settings.INCIDENTS_OUTPUT,
+    incident_window: str = settings.INCIDENT_WINDOW,
+    incident_keys: List[str] = settings.INCIDENT_KEYS
+):
     """
     Функция для детекции аномалий в логах за один день.
+    Время, количество строк и пиковая память каждого этапа пишутся в metrics.
+
+    :param report_path: Путь к HTML-отчёту при html_report=True.
+    :param print_rows: Печатать каждую аномальную запись в консоль.
+    :param incidents_output: Куда записать аномалии, объединённые в инциденты (см. incidents.py):
+        .csv - CSV, '-' - NDJSON в stdout, иначе NDJSON в файл. None - не записывать.
+    :param incident_window: Интервал, в пределах которого аномалии объединяются в инцидент.
+    :param incident_keys: Столбцы, по которым аномалии интервала объединяются в инцидент.
     """
-    model, scaler = load_anomaly_model(model_path)
+    if metrics is None:
+        metrics = PipelineMetrics('detect')
+
+    with metrics.stage('load_anomaly_model'):
+        model, scaler, reference_stats = load_scoring_model(model_path)
 
     logging.info("Читаем логи за один день...")
-    daily_df = load_logs_to_dataframe([one_day_log_path])
+    with metrics.stage('load_logs') as stage:
+        daily_df = load_logs_to_dataframe([one_day_log_path], workers=workers, chunk_bytes=settings.INGEST_CHUNK_BYTES)
+        stage['rows'] = len(daily_df)
     if daily_df.empty:
         logging.info("Файл с логами пуст или нет корректных записей.")
         return
 
     logging.info("Предобрабатываем и вычисляем признаки для детекции...")
-    daily_df_preproc = preprocess_logs(daily_df)
+    with metrics.stage('load_window_index'):
+        window_index = load_window_index(day_window_files(one_day_log_path), model_window_features(reference_stats))
+
+    with metrics.stage('preprocess_logs') as stage:
+        daily_df_preproc = preprocess_logs(daily_df, reference_stats, minute_index=window_index,
+                                           distinct_precision=model_distinct_precision(reference_stats))
+        stage['rows'] = len(daily_df_preproc)
 
     logging.info("Делаем предсказание аномалий...")
-    result_df = infer_anomalies(daily_df_preproc, model, scaler)
+    with metrics.stage('infer_anomalies') as stage:
+        result_df = infer_anomalies(daily_df_preproc, model, scaler, chunk_rows=infer_chunk_rows, workers=infer_workers)
+        stage['rows'] = len(result_df)
 
     logging.info("Анализируем аномалии...")
-    anomalies_df = analyze_anomalies(result_df)
+    with metrics.stage('analyze_anomalies') as stage:
+        anomalies_df = analyze_anomalies(result_df)
+        stage['rows'] = len(anomalies_df)
     if html_report:
-        generate_html_report(anomalies_df, "my_anomalies_report.html")
+        from report_generator import generate_html_report
+        with metrics.stage('generate_html_report') as stage:
+            generate_html_report(anomalies_df, report_path, rows_per_page=settings.REPORT_ROWS_PER_PAGE)
+            stage['rows'] = len(anomalies_df)
 
     logging.info(f"Всего найдено аномалий: {len(anomalies_df)}")
-    for idx, row in anomalies_df.iterrows():
-        log_str = (
-            f"Время: {row.get('timestamp')} | "
-            f"Endpoint: {row.get('endpoint')} | "
-            f"Status: {row.get('response_status')} | "
-            f"remote_addr: {row.get('remote_addr')} | "
-            f"body_bytes_sent: {row.get('body_bytes_sent')} | "
-            f"request_time: {row.get('request_time')} | "
-            f"request: {row.get('request')} | "
-            f"request_method: {row.get('request_method')} | "
-            f"upstream_addr: {row.get('upstream_addr')} | "
-            f"http_x_real_ip: {row.get('http_x_real_ip')} | "
-            f"http_x_forwarded_for: {row.get('http_x_forwarded_for')} | "
-            f"http_referrer: {row.get('http_referrer')} | "
-            f"http_user_agent: {row.get('http_user_agent')} | "
-            f"http_version: {row.get('http_version')} | "
-            f"nginx_access: {row.get('nginx_access')} | "
-            f"requests_per_minute: {row.get('requests_per_minute')} | "
-            f"is_rare_ua: {row.get('is_rare_ua')} | "
-            f"endpoint_zscore: {row.get('endpoint_zscore'):.2f} | "
-            f"is_suspicious_endpoint: {row.get('is_suspicious_endpoint')} | "
-            f"is_redirect: {row.get('is_redirect')} | "
-            f"redirect_rate_5min: {row.get('redirect_rate_5min'):.2f} | "
-            f"error_rate_5min: {row.get('error_rate_5min')} | "
-            f"endpoint_variance_5min: {row.get('endpoint_variance_5min')} | "
-            f"std_rt: {row.get('std_rt')} | "
-            f"unique_ips_10min: {row.get('unique_ips_10min')} | "
-            f"anomaly: {row.get('anomaly')} | "
-            f"anomaly_score: {row.get('anomaly_score')} | "
-            f"Причина: {row.get('anomaly_reason')}"
-        )
-        print(log_str)
+    if incidents_output:
+        from incidents import aggregate_incidents, write_incidents
+        with metrics.stage('write_incidents') as stage:
+            incidents = aggregate_incidents(anomalies_df, window=incident_window, keys=incident_keys)
+            write_incidents(incidents, incidents_output)
+            stage['rows'] = len(incidents)
+        logging.info(f"Аномалии объединены в {len(incidents)} инцидентов.")
+    if print_rows:
+        with metrics.stage('print_anomalies') as stage:
+            print_anomaly_rows(anomalies_df)
+            stage['rows'] = len(anomalies_df)
+    metrics.log_summary()
+
+def load_day_features(
+    log_path: str,
+    reference_stats: Optional[Dict[str, Any]],
+    store_dir: str,
+    workers: int = settings.INGEST_WORKERS
+) -> Tuple[Any, Any, Dict[str, Any]]:
+    """
+    Матрица признаков суток, отображённая в память из store_dir (см. feature_store.py).
+    Если её нет, логи разбираются и признаки считаются один раз со статистиками модели и сохраняются.
+
+    :return: Матрица признаков, смещения строк записей в файле логов и описание хранилища.
+    """
+    from feature_store import reference_fingerprint, feature_store_path, save_feature_store, open_feature_store, remove_stale_feature_stores
+
+    base_path = feature_store_path(log_path, store_dir, reference_fingerprint(reference_stats))
+    stored = open_feature_store(base_path)
+    if stored is not None:
+        logging.info(f"Матрица признаков {log_path} прочитана из хранилища ({stored[2]['rows']} строк).")
+        return stored
+
+    logging.info(f"Матрицы признаков {log_path} нет в хранилище, считаем признаки...")
+    df = load_logs_to_dataframe([log_path], workers=workers, chunk_bytes=settings.INGEST_CHUNK_BYTES, offsets=True)
+    if df.empty:
+        X, offsets = np.empty((0, len(FEATURE_COLUMNS)), dtype=np.float32), np.empty(0, dtype=np.int64)
+    else:
+        window_index = load_window_index(day_window_files(log_path), model_window_features(reference_stats))
+        df_preproc = preprocess_logs(df, reference_stats, minute_index=window_index,
+                                     distinct_precision=model_distinct_precision(reference_stats))
+        X, offsets = build_feature_matrix(df_preproc).to_numpy(), df_preproc['line_offset'].to_numpy()
+    remove_stale_feature_stores(log_path, store_dir, base_path)
+    save_feature_store(base_path, X, offsets, {'log_file': log_path})
+    return open_feature_store(base_path)
+
+def main_rescore(
+    log_path: str,
+    model_paths: Dict[str, str],
+    thresholds: List[float],
+    store_dir: str = settings.FEATURE_STORE_DIR,
+    workers: int = settings.INGEST_WORKERS,
+    infer_chunk_rows: int = settings.INFER_CHUNK_ROWS,
+    infer_workers: int = settings.INFER_WORKERS,
+    incidents_output: Optional[str] = None,
+    metrics: Optional[PipelineMetrics] = None
+) -> List[Dict[str, Any]]:
+    """
+    Оценивает сутки логов несколькими моделями и порогами по сохранённой матрице признаков,
+    без повторного разбора логов и расчёта признаков (кроме первого запуска).
+    Исходные записи перечитываются из файла только для аномалий.
+
+    :param model_paths: Название модели -> путь к её файлу.
+    :param thresholds: Пороги decision_function, ниже которых запись - аномалия (0 - порог модели).
+    :param incidents_output: Файл инцидентов каждой пары модель/порог (см. incidents.write_incidents),
+        {model} и {threshold} заменяются на название модели и порог. None - не записывать.
+    :return: Сводка по каждой паре модель/порог.
+    """
+    from feature_store import explain_stored_anomalies
+
+    if metrics is None:
+        metrics = PipelineMetrics('rescore')
+
+    summaries = []
+    for name, model_path in model_paths.items():
+        with metrics.stage('load_anomaly_model'):
+            model, scaler, reference_stats = load_scoring_model(model_path)
+        with metrics.stage('load_day_features') as stage:
+            X, offsets, meta = load_day_features(log_path, reference_stats, store_dir, workers=workers)
+            stage['rows'] = len(X)
+        with metrics.stage('score_anomalies') as stage:
+            scores = score_anomalies(X, model, scaler, chunk_rows=infer_chunk_rows, workers=infer_workers)
+            stage['rows'] = len(X)
+
+        for threshold in thresholds:
+            with metrics.stage('explain_anomalies') as stage:
+                anomalies_df = explain_stored_anomalies(log_path, X, offsets, scores, threshold)
+                stage['rows'] = len(anomalies_df)
+            summaries.append({
+                'model': name,
+                'threshold': threshold,
+                'rows': len(X),
+                'below_threshold': int((scores < threshold).sum()),
+                'anomalies': len(anomalies_df),
+                'top_endpoints': anomalies_df['endpoint'].astype(object).value_counts().head(5).to_dict() if len(anomalies_df) else {},
+            })
+            if incidents_output:
+                from incidents import aggregate_incidents, write_incidents
+                path = incidents_output.replace('{model}', name).replace('{threshold}', f'{threshold:g}')
+                write_incidents(aggregate_incidents(anomalies_df, window=settings.INCIDENT_WINDOW, keys=settings.INCIDENT_KEYS), path)
+
+    print(f"{'Модель':<20} | {'Порог':>8} | {'Записей':>10} | {'Ниже порога':>11} | {'Аномалий':>9} | Частые endpoint'ы")
+    for summary in summaries:
+        top = ", ".join(f"{endpoint} ({count})" for endpoint, count in summary['top_endpoints'].items())
+        print(f"{summary['model']:<20} | {summary['threshold']:>8g} | {summary['rows']:>10} | "
+              f"{summary['below_threshold']:>11} | {summary['anomalies']:>9} | {top}")
+    metrics.log_summary()
+    return summaries
+
+load_scoring_model_cached = lru_cache(maxsize=8)(load_scoring_model)
+
+def detect_stand_day(stand: str, day: date, log_path: str, model_path: str, infer_chunk_rows: int = settings.INFER_CHUNK_ROWS) -> Dict[str, Any]:
+    """
+    Детекция аномалий в одном суточном файле стенда. Выполняется в процессе пула,
+    модели кэшируются внутри процесса, поэтому каждая загружается один раз.
+
+    :return: Сводка по файлу: стенд, дата, модель, число записей и аномалий, самые частые endpoint'ы.
+    """
+    model_file = stand_model_path(model_path, stand)
+    if not os.path.exists(model_file):
+        model_file = model_path
+    model, scaler, reference_stats = load_scoring_model_cached(model_file)
+
+    summary = {'stand': stand, 'date': day.isoformat(), 'file': log_path, 'model': model_file, 'rows': 0, 'anomalies': 0, 'top_endpoints': {}}
+    daily_df = load_logs_to_dataframe([log_path])
+    if daily_df.empty:
+        return summary
+
+    window_index = load_window_index(day_window_files(log_path), model_window_features(reference_stats))
+    daily_df_preproc = preprocess_logs(daily_df, reference_stats, minute_index=window_index,
+                                       distinct_precision=model_distinct_precision(reference_stats))
+    result_df = infer_anomalies(daily_df_preproc, model, scaler, chunk_rows=infer_chunk_rows)
+    anomalies_df = analyze_anomalies(result_df)
+    summary['rows'] = len(result_df)
+    summary['anomalies'] = len(anomalies_df)
+    summary['top_endpoints'] = anomalies_df['endpoint'].astype(object).value_counts().head(5).to_dict()
+    return summary
+
+def main_detect_batch(
+    base_dir: str,
+    model_path: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    workers: int = settings.DETECT_WORKERS
+) -> List[Dict[str, Any]]:
+    """
+    Детекция аномалий по всем стендам за диапазон дат в пуле процессов.
+    Для каждого стенда используется его модель (см. main_train_per_stand), а если её нет - общая.
+    """
+    day_files = collect_day_files(base_dir, date_from, date_to)
+    logging.info(f"Найдено {len(day_files)} суточных файлов для детекции.")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(detect_stand_day, stand, day, log_path, model_path) for stand, day, log_path in day_files]
+        summaries = [future.result() for future in futures]
+
+    print(f"{'Стенд':<20} | {'Дата':<10} | {'Записей':>10} | {'Аномалий':>9} | Частые endpoint'ы")
+    for summary in summaries:
+        top = ", ".join(f"{endpoint} ({count})" for endpoint, count in summary['top_endpoints'].items())
+        print(f"{summary['stand']:<20} | {summary['date']:<10} | {summary['rows']:>10} | {summary['anomalies']:>9} | {top}")
+    logging.info(
+        f"Всего: файлов {len(summaries)}, записей {sum(s['rows'] for s in summaries)}, "
+        f"аномалий {sum(s['anomalies'] for s in summaries)}"
+    )
+    return summaries
+
+def format_anomaly_row(row) -> str:
+    """
+    Формирует строку для вывода одной аномальной записи в консоль.
+    """
+    return (
+        f"Время: {row.get('timestamp')} | "
+        f"Endpoint: {row.get('endpoint')} | "
+        f"Status: {row.get('response_status')} | "
+        f"remote_addr: {row.get('remote_addr')} | "
+        f"body_bytes_sent: {row.get('body_bytes_sent')} | "
+        f"request_time: {row.get('request_time')} | "
+        f"request: {row.get('request')} | "
+        f"request_method: {row.get('request_method')} | "
+        f"upstream_addr: {row.get('upstream_addr')} | "
+        f"http_x_real_ip: {row.get('http_x_real_ip')} | "
+        f"http_x_forwarded_for: {row.get('http_x_forwarded_for')} | "
+        f"http_referrer: {row.get('http_referrer')} | "
+        f"http_user_agent: {row.get('http_user_agent')} | "
+        f"http_version: {row.get('http_version')} | "
+        f"nginx_access: {row.get('nginx_access')} | "
+        f"requests_per_minute: {row.get('requests_per_minute')} | "
+        f"is_rare_ua: {row.get('is_rare_ua')} | "
+        f"endpoint_zscore: {row.get('endpoint_zscore'):.2f} | "
+        f"is_suspicious_endpoint: {row.get('is_suspicious_endpoint')} | "
+        f"is_redirect: {row.get('is_redirect')} | "
+        f"redirect_rate_5min: {row.get('redirect_rate_5min'):.2f} | "
+        f"error_rate_5min: {row.get('error_rate_5min')} | "
+        f"endpoint_variance_5min: {row.get('endpoint_variance_5min')} | "
+        f"std_rt: {row.get('std_rt')} | "
+        f"unique_ips_10min: {row.get('unique_ips_10min')} | "
+        f"anomaly: {row.get('anomaly')} | "
+        f"anomaly_score: {row.get('anomaly_score')} | "
+        f"Причина: {row.get('anomaly_reason')}"
+    )
+
+def print_anomaly_rows(anomalies_df, chunk_rows: int = 10_000) -> None:
+    """
+    Печатает аномальные записи по строке на запись. Строки собираются порциями
+    и выводятся одной записью в stdout, а не отдельным print на каждую.
+    """
+    for start in range(0, len(anomalies_df), chunk_rows):
+        records = anomalies_df.iloc[start:start + chunk_rows].to_dict('records')
+        sys.stdout.write(''.join(format_anomaly_row(row) + '\n' for row in records))
+    sys.stdout.flush()
+
+def main_follow(model_path: str, log_path: str, from_start: bool = False):
+    """
+    Потоковая детекция: следит за дописываемым логом и оценивает новые записи микробатчами.
+    """
+    from streaming import stream_detect
+
+    model, scaler, reference_stats = load_scoring_model(model_path)
+
+    logging.info(f"Следим за файлом {log_path}...")
+    for anomalies_df in stream_detect(
+        log_path,
+        model,
+        scaler,
+        reference_stats,
+        batch_size=settings.STREAM_BATCH_SIZE,
+        batch_seconds=settings.STREAM_BATCH_SECONDS,
+        poll_interval=settings.STREAM_POLL_SECONDS,
+        from_start=from_start,
+        window_features=model_window_features(reference_stats),
+        hll_precision=settings.HLL_PRECISION
+    ):
+        for idx, row in anomalies_df.iterrows():
+            print(format_anomaly_row(row), flush=True)
+
+def main_serve(model_path: str, host: str = settings.SERVE_HOST, port: int = settings.SERVE_PORT):
+    """
+    Резидентный сервис оценки: модель загружается один раз, записи принимаются по HTTP (см. service.py).
+    """
+    from service import ScoringService, make_scoring_server
+
+    model, scaler, reference_stats = load_scoring_model(model_path)
+    service = ScoringService(
+        model,
+        scaler,
+        reference_stats,
+        max_batch_rows=settings.SERVE_MAX_BATCH_ROWS,
+        max_wait_seconds=settings.SERVE_MAX_WAIT_SECONDS,
+        max_pending=settings.SERVE_MAX_PENDING,
+        window_features=model_window_features(reference_stats),
+        hll_precision=settings.HLL_PRECISION
+    )
+    server = make_scoring_server(service, host, port, max_body_bytes=settings.SERVE_MAX_BODY_BYTES)
+    logging.info(f"Сервис оценки слушает http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,32 +1,233 @@
 import click
 import logging
+from datetime import datetime
 
-from main import main_train, main_detect_one_day
 from config import Settings
 
+# Тяжёлые модули (pandas, sklearn, генератор отчёта) импортируются внутри команд,
+# чтобы --help и лёгкие команды не платили за их загрузку
+
 
 settings = Settings()
 
 
-@click.command()
-@click.option('--train', default=False, help='Start train new model')
-@click.option('--test', default=False, help='Start test model')
-@click.option('--html', default=False, help='Generate HTML report')
-def model_pipeline(train: bool, test:bool, html:bool):
+def profile_options(func):
+    """
+    Общие опции профилирования и выгрузки метрик этапов.
+    """
+    func = click.option('--metrics-output', default=settings.METRICS_OUTPUT,
+                        help='Stage metrics file: .prom for Prometheus textfile, JSON otherwise; {pipeline} is replaced with the command name')(func)
+    func = click.option('--profile-output', default=None, help='Profile file (.prof for cprofile, .html for pyinstrument), stderr if not set')(func)
+    func = click.option('--profile', 'profiler', type=click.Choice(['cprofile', 'pyinstrument']), default=None, help='Profile the run')(func)
+    return func
+
+
+def run_profiled(profiler: str, profile_output: str, metrics_output: str, pipeline: str, run) -> None:
+    """
+    Выполняет run(metrics) под профилировщиком и сохраняет метрики этапов, если задан metrics_output.
+    """
+    from metrics import PipelineMetrics, profile
+
+    metrics = PipelineMetrics(pipeline)
+    with profile(profiler, profile_output):
+        run(metrics)
+    if metrics_output and metrics.stages:
+        metrics.export(metrics_output.replace('{pipeline}', metrics.pipeline))
+
+
+def resolve_model_path(model_version: str) -> str:
+    """
+    MODEL_PATH или путь к версии из реестра, если она задана.
+    """
+    if not model_version:
+        return settings.MODEL_PATH
+    from model_registry import model_version_path
+    return model_version_path(settings.MODEL_REGISTRY_DIR, model_version)
+
+
+@click.group()
+def cli():
     logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
-    
-    BASE_LOG_DIR = settings.BASE_LOG_DIR
-    MODEL_PATH = settings.MODEL_PATH
-    ONE_DAY_LOG_PATH = settings.ONE_DAY_LOG_PATH
-    
-    if train:
-        trained_model = main_train(settings.BASE_LOG_DIR, model_path=settings.MODEL_PATH)
-    
-    if test is True and html is True:
-        main_detect_one_day(settings.MODEL_PATH, settings.ONE_DAY_LOG_PATH, html_report=True)
-    else:
-        main_detect_one_day(settings.MODEL_PATH, settings.ONE_DAY_LOG_PATH, html_report=False)
+
+
+@cli.command()
+@click.option('--workers', default=settings.INGEST_WORKERS, help='Number of processes for log parsing')
+@click.option('--chunked', is_flag=True, help='Train out-of-core on log chunks with a bounded sample')
+@click.option('--per-stand', is_flag=True, help='Train a separate model for every stand')
+@click.option('--incremental', is_flag=True, help='Update the active registry model on new days instead of full training')
+@click.option('--date-from', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First day of the incremental training range')
+@click.option('--date-to', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day of the incremental training range')
+@profile_options
+def train(workers: int, chunked: bool, per_stand: bool, incremental: bool, date_from: datetime, date_to: datetime,
+          profiler: str, profile_output: str, metrics_output: str):
+    """Train a new model on all logs in BASE_LOG_DIR."""
+    from main import main_train, main_train_chunked, main_train_per_stand, main_train_incremental
+
+    def run(metrics):
+        if incremental:
+            main_train_incremental(
+                settings.BASE_LOG_DIR,
+                settings.MODEL_PATH,
+                settings.MODEL_REGISTRY_DIR,
+                date_from=date_from.date() if date_from else None,
+                date_to=date_to.date() if date_to else None,
+                workers=workers,
+                metrics=metrics
+            )
+        elif chunked:
+            main_train_chunked(settings.BASE_LOG_DIR, model_path=settings.MODEL_PATH, registry_dir=settings.MODEL_REGISTRY_DIR,
+                               metrics=metrics)
+        elif per_stand:
+            main_train_per_stand(settings.BASE_LOG_DIR, settings.MODEL_PATH, workers=workers, metrics=metrics)
+        else:
+            main_train(settings.BASE_LOG_DIR, model_path=settings.MODEL_PATH, workers=workers,
+                       registry_dir=settings.MODEL_REGISTRY_DIR, metrics=metrics)
+
+    run_profiled(profiler, profile_output, metrics_output, 'train', run)
+
+
+@cli.command()
+@click.option('--log-path', default=None,
+              help='Log file to check: one day (ONE_DAY_LOG_PATH if not set) or, with --follow, the live log (LIVE_LOG_PATH if not set)')
+@click.option('--html/--no-html', default=False, help='Also generate an HTML report')
+@click.option('--workers', default=settings.INGEST_WORKERS, help='Number of processes for log parsing')
+@click.option('--infer-chunk-rows', default=settings.INFER_CHUNK_ROWS, help='Rows per scoring chunk')
+@click.option('--infer-workers', default=settings.INFER_WORKERS, help='Number of threads for scoring')
+@click.option('--model-version', default=None, help='Detect with this registry version without activating it')
+@click.option('--incidents-output', default=settings.INCIDENTS_OUTPUT,
+              help="Where to write anomalies grouped into incidents: .csv for CSV, '-' for NDJSON to stdout, NDJSON file otherwise")
+@click.option('--no-incidents', is_flag=True, help='Do not write incidents')
+@click.option('--incident-window', default=settings.INCIDENT_WINDOW, help='Time window that groups anomalies into one incident')
+@click.option('--rows/--no-rows', default=settings.PRINT_ANOMALY_ROWS, help='Also print every anomalous row')
+@click.option('--follow', is_flag=True, help='Watch the live log and detect anomalies in real time')
+@click.option('--batch', is_flag=True, help='Detect anomalies in all stands for a date range')
+@click.option('--date-from', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First day of the batch range')
+@click.option('--date-to', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day of the batch range')
+@click.option('--detect-workers', default=settings.DETECT_WORKERS, help='Number of processes for batch detection')
+@profile_options
+def detect(log_path: str, html: bool, workers: int, infer_chunk_rows: int, infer_workers: int, model_version: str,
+           incidents_output: str, no_incidents: bool, incident_window: str, rows: bool,
+           follow: bool, batch: bool, date_from: datetime, date_to: datetime, detect_workers: int,
+           profiler: str, profile_output: str, metrics_output: str):
+    """Detect anomalies in one day of logs, in the live log or in all stands."""
+    model_path = resolve_model_path(model_version)
+
+    def run(metrics):
+        if follow:
+            from main import main_follow
+            main_follow(model_path, log_path or settings.LIVE_LOG_PATH)
+        elif batch:
+            from main import main_detect_batch
+            main_detect_batch(
+                settings.BASE_LOG_DIR,
+                model_path,
+                date_from=date_from.date() if date_from else None,
+                date_to=date_to.date() if date_to else None,
+                workers=detect_workers
+            )
+        else:
+            from main import main_detect_one_day
+            main_detect_one_day(model_path, log_path or settings.ONE_DAY_LOG_PATH, html_report=html, workers=workers,
+                                infer_chunk_rows=infer_chunk_rows, infer_workers=infer_workers, metrics=metrics,
+                                print_rows=rows, incidents_output=None if no_incidents else incidents_output,
+                                incident_window=incident_window)
+
+    run_profiled(profiler, profile_output, metrics_output, 'detect', run)
+
+
+@cli.command()
+@click.option('--log-path', default=settings.ONE_DAY_LOG_PATH, help='Log file of one day to check')
+@click.option('--output', default=settings.REPORT_PATH, help='HTML report path')
+@click.option('--workers', default=settings.INGEST_WORKERS, help='Number of processes for log parsing')
+@click.option('--model-version', default=None, help='Use this registry version without activating it')
+@profile_options
+def report(log_path: str, output: str, workers: int, model_version: str, profiler: str, profile_output: str, metrics_output: str):
+    """Detect anomalies in one day of logs and write only the HTML report."""
+    from main import main_detect_one_day
+
+    def run(metrics):
+        main_detect_one_day(resolve_model_path(model_version), log_path, html_report=True, workers=workers,
+                            report_path=output, print_rows=False, incidents_output=None, metrics=metrics)
+
+    run_profiled(profiler, profile_output, metrics_output, 'report', run)
+
+
+@cli.command()
+@click.option('--log-path', default=settings.ONE_DAY_LOG_PATH, help='Log file of one day to score')
+@click.option('--model-version', 'model_versions', multiple=True, help='Registry version to score with, can be repeated; MODEL_PATH if not set')
+@click.option('--threshold', 'thresholds', multiple=True, type=float, help='Score threshold below which a row is anomalous, can be repeated; 0 if not set')
+@click.option('--store-dir', default=settings.FEATURE_STORE_DIR, help='Directory of stored feature matrices')
+@click.option('--workers', default=settings.INGEST_WORKERS, help='Number of processes for log parsing when the matrix is not stored yet')
+@click.option('--infer-chunk-rows', default=settings.INFER_CHUNK_ROWS, help='Rows per scoring chunk')
+@click.option('--infer-workers', default=settings.INFER_WORKERS, help='Number of threads for scoring')
+@click.option('--incidents-output', default=None, help='Incidents file for every model and threshold; {model} and {threshold} are replaced')
+@profile_options
+def rescore(log_path: str, model_versions: tuple, thresholds: tuple, store_dir: str, workers: int, infer_chunk_rows: int,
+            infer_workers: int, incidents_output: str, profiler: str, profile_output: str, metrics_output: str):
+    """Score one day with several models and thresholds from the stored feature matrix."""
+    from main import main_rescore
+
+    from model_registry import normalize_version
+    model_paths = {normalize_version(version): resolve_model_path(version) for version in model_versions} or {'active': settings.MODEL_PATH}
+
+    def run(metrics):
+        main_rescore(log_path, model_paths, list(thresholds) or [0.0], store_dir=store_dir, workers=workers,
+                     infer_chunk_rows=infer_chunk_rows, infer_workers=infer_workers,
+                     incidents_output=incidents_output, metrics=metrics)
+
+    run_profiled(profiler, profile_output, metrics_output, 'rescore', run)
+
+
+@cli.command()
+@click.option('--host', default=settings.SERVE_HOST, help='Scoring service host')
+@click.option('--port', default=settings.SERVE_PORT, help='Scoring service port')
+@click.option('--model-version', default=None, help='Serve this registry version without activating it')
+def serve(host: str, port: int, model_version: str):
+    """Run the HTTP scoring service with the model preloaded."""
+    from main import main_serve
+    main_serve(resolve_model_path(model_version), host=host, port=port)
+
+
+@cli.group()
+def models():
+    """Manage model versions in the registry."""
+
+
+@models.command('list')
+def list_models():
+    """List model versions, the active one is marked with *."""
+    from model_registry import list_model_versions, active_model_version
+
+    active = active_model_version(settings.MODEL_REGISTRY_DIR)
+    for meta in list_model_versions(settings.MODEL_REGISTRY_DIR):
+        mark = '*' if meta['version'] == active else ' '
+        click.echo(
+            f"{mark} {meta['version']} | {meta['created_at']} | {meta['mode']:<11} | "
+            f"{meta.get('train_from')} - {meta.get('train_to')} | строк {meta['rows']} (новых {meta['new_rows']}) | "
+            f"обучение {meta['fit_seconds']} с | деревьев {meta['n_estimators']}"
+        )
+
+
+@models.command()
+@click.argument('version')
+def pin(version: str):
+    """Make VERSION active (copied to MODEL_PATH)."""
+    from model_registry import activate_model_version
+    try:
+        activate_model_version(settings.MODEL_REGISTRY_DIR, version, settings.MODEL_PATH)
+    except (FileNotFoundError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+
+@models.command()
+def rollback():
+    """Make the previous version active."""
+    from model_registry import rollback_model_version
+    try:
+        rollback_model_version(settings.MODEL_REGISTRY_DIR, settings.MODEL_PATH)
+    except ValueError as e:
+        raise click.ClickException(str(e))
 
 
 if __name__ == '__main__':
-    model_pipeline()
+    cli()
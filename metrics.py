@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Интервал опроса RSS процесса во время этапа, в секундах
+MEMORY_SAMPLE_SECONDS = 0.05
+
+
+def current_rss_bytes() -> Optional[int]:
+    """
+    Текущий RSS процесса в байтах (по /proc/self/statm) или None, если /proc недоступен.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_bytes() -> Optional[int]:
+    """
+    Пиковый RSS процесса за всё время работы в байтах.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux ru_maxrss в килобайтах, в macOS - в байтах
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class MemorySampler:
+    """
+    Фоновый поток, который опрашивает RSS процесса и запоминает максимум.
+    Там, где /proc недоступен, возвращает пиковый RSS процесса по getrusage.
+    """
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = current_rss_bytes()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def __enter__(self) -> 'MemorySampler':
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            rss = current_rss_bytes()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+        else:
+            self.peak = max_rss_bytes()
+
+
+class PipelineMetrics:
+    """
+    Метрики одного запуска пайплайна: время, количество строк и пиковая память по этапам.
+
+    Пример:
+        metrics = PipelineMetrics('train')
+        with metrics.stage('preprocess_logs') as stage:
+            df = preprocess_logs(df)
+            stage['rows'] = len(df)
+        metrics.export('metrics.prom')
+    """
+
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+        self.stages: List[Dict[str, Any]] = []
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        """
+        Замеряет этап. В возвращаемый словарь можно записать 'rows' - количество обработанных строк.
+        """
+        record: Dict[str, Any] = {'stage': name, 'rows': None}
+        started = time.perf_counter()
+        with MemorySampler() as sampler:
+            yield record
+        record['seconds'] = round(time.perf_counter() - started, 6)
+        record['peak_rss_bytes'] = sampler.peak
+        self.stages.append(record)
+        logging.debug(f"Этап {name}: {record['seconds']} с, строк {record['rows']}, пиковый RSS {sampler.peak}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'pipeline': self.pipeline,
+            'started_at': self.started_at,
+            'seconds': round(time.perf_counter() - self._started, 6),
+            'peak_rss_bytes': max_rss_bytes(),
+            'stages': self.stages,
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Метрики в текстовом формате Prometheus (для textfile collector node-exporter).
+        """
+        data = self.to_dict()
+        labels = f'pipeline="{self.pipeline}"'
+        lines = [
+            '# HELP ald_stage_duration_seconds Duration of a pipeline stage.',
+            '# TYPE ald_stage_duration_seconds gauge',
+            *(f'ald_stage_duration_seconds{{{labels},stage="{s["stage"]}"}} {s["seconds"]}' for s in self.stages),
+            '# HELP ald_stage_rows Rows processed by a pipeline stage.',
+            '# TYPE ald_stage_rows gauge',
+            *(f'ald_stage_rows{{{labels},stage="{s["stage"]}"}} {s["rows"]}' for s in self.stages if s['rows'] is not None),
+            '# HELP ald_stage_peak_rss_bytes Peak resident memory during a pipeline stage.',
+            '# TYPE ald_stage_peak_rss_bytes gauge',
+            *(f'ald_stage_peak_rss_bytes{{{labels},stage="{s["stage"]}"}} {s["peak_rss_bytes"]}' for s in self.stages if s['peak_rss_bytes'] is not None),
+            '# HELP ald_pipeline_duration_seconds Duration of the whole pipeline run.',
+            '# TYPE ald_pipeline_duration_seconds gauge',
+            f'ald_pipeline_duration_seconds{{{labels}}} {data["seconds"]}',
+            '# HELP ald_pipeline_last_run_timestamp_seconds Start time of the last pipeline run.',
+            '# TYPE ald_pipeline_last_run_timestamp_seconds gauge',
+            f'ald_pipeline_last_run_timestamp_seconds{{{labels}}} {data["started_at"]}',
+        ]
+        if data['peak_rss_bytes'] is not None:
+            lines += [
+                '# HELP ald_pipeline_peak_rss_bytes Peak resident memory of the pipeline process.',
+                '# TYPE ald_pipeline_peak_rss_bytes gauge',
+                f'ald_pipeline_peak_rss_bytes{{{labels}}} {data["peak_rss_bytes"]}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path: str) -> None:
+        """
+        Записывает метрики в файл: Prometheus для расширения .prom, иначе JSON.
+        Файл заменяется атомарно, чтобы node-exporter не прочитал его частично.
+        """
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        logging.info(f"Метрики сохранены в {path}")
+
+    def log_summary(self) -> None:
+        """
+        Пишет в лог сводку по этапам.
+        """
+        for s in self.stages:
+            peak = f"{s['peak_rss_bytes'] / 2 ** 20:.0f} МБ" if s['peak_rss_bytes'] is not None else '-'
+            logging.info(f"{s['stage']:<24} {s['seconds']:>10.3f} с | строк {s['rows'] if s['rows'] is not None else '-'} | пик RSS {peak}")
+
+
+@contextmanager
+def profile(profiler: Optional[str], output_path: Optional[str] = None) -> Iterator[None]:
+    """
+    Профилирует блок кода cProfile или pyinstrument (если установлен).
+
+    :param profiler: 'cprofile', 'pyinstrument' или None - без профилирования.
+    :param output_path: Куда сохранить результат: .prof для cProfile (pstats, открывается snakeviz),
+        .html для pyinstrument. Если не задан, сводка печатается в stderr.
+    """
+    if not profiler:
+        yield
+        return
+
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler_obj = Profiler()
+        profiler_obj.start()
+        try:
+            yield
+        finally:
+            profiler_obj.stop()
+            if output_path:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    f.write(profiler_obj.output_html())
+            else:
+                print(profiler_obj.output_text(), file=sys.stderr)
+        return
+
+    import cProfile
+    import pstats
+    profiler_obj = cProfile.Profile()
+    profiler_obj.enable()
+    try:
+        yield
+    finally:
+        profiler_obj.disable()
+        if output_path:
+            profiler_obj.dump_stats(output_path)
+        else:
+            pstats.Stats(profiler_obj, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+    if output_path:
+        logging.info(f"Профиль сохранён в {output_path}")
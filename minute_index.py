@@ -0,0 +1,235 @@
+import os
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from data_utils import cache_file_path, load_logs_cached, load_logs_to_dataframe, log_file_date
+from features import prepare_base_columns
+from sketches import DEFAULT_HLL_PRECISION, hash_column, hll_estimate, hll_merge, hll_registers
+
+# Столбцы сырых логов, нужные для построения индекса
+INDEX_SOURCE_COLUMNS = ['timestamp', 'remote_addr', 'request', 'response_status', 'request_time', 'body_bytes_sent']
+
+# Поминутные агрегаты индекса: количество запросов, ошибок и редиректов
+INDEX_COUNT_COLUMNS = ['count', 'errors', 'redirects']
+
+
+def minute_keys(timestamps: pd.Series) -> np.ndarray:
+    """
+    Начало минуты каждой записи как datetime64[ns] в UTC (для времени с часовым поясом).
+    """
+    minute = timestamps.dt.floor('1min')
+    if minute.dt.tz is not None:
+        minute = minute.dt.tz_convert('UTC').dt.tz_localize(None)
+    return minute.to_numpy(dtype='datetime64[ns]')
+
+
+def build_minute_index(df: pd.DataFrame, precision: int = DEFAULT_HLL_PRECISION) -> Dict[str, Any]:
+    """
+    Строит поминутный индекс по подготовленным логам (см. features.prepare_base_columns).
+
+    Для каждой минуты, в которой есть записи, хранятся количество запросов, ошибок (status >= 400)
+    и редиректов (3xx), а также скетчи HyperLogLog различных remote_addr и endpoint'ов.
+    Записи без времени в индекс не попадают.
+
+    :return: Словарь с массивами 'minutes' (datetime64[ns] в UTC, по возрастанию), 'count', 'errors',
+        'redirects', 'ip_registers', 'endpoint_registers' и точностью 'precision'.
+    """
+    df = df[df['timestamp'].notna()]
+    codes, minutes = pd.factorize(minute_keys(df['timestamp']), sort=True)
+    n = len(minutes)
+    status = df['response_status'].to_numpy()
+    remote_addr = df['remote_addr'] if 'remote_addr' in df.columns else pd.Series(np.nan, index=df.index)
+    return {
+        'minutes': minutes.astype('datetime64[ns]'),
+        'count': np.bincount(codes, minlength=n).astype(np.int64),
+        'errors': np.bincount(codes, weights=status >= 400, minlength=n).astype(np.int64),
+        'redirects': np.bincount(codes, weights=(status >= 300) & (status < 400), minlength=n).astype(np.int64),
+        'ip_registers': hll_registers(codes, n, hash_column(remote_addr), precision),
+        'endpoint_registers': hll_registers(codes, n, hash_column(df['endpoint']), precision),
+        'precision': precision,
+    }
+
+
+def empty_minute_index(precision: int = DEFAULT_HLL_PRECISION) -> Dict[str, Any]:
+    """
+    Индекс без минут (для пустых файлов).
+    """
+    return {
+        'minutes': np.empty(0, dtype='datetime64[ns]'),
+        **{col: np.empty(0, dtype=np.int64) for col in INDEX_COUNT_COLUMNS},
+        'ip_registers': np.empty((0, 1 << precision), dtype=np.uint8),
+        'endpoint_registers': np.empty((0, 1 << precision), dtype=np.uint8),
+        'precision': precision,
+    }
+
+
+def merge_minute_indexes(indexes: List[Dict[str, Any]], precision: int = DEFAULT_HLL_PRECISION) -> Dict[str, Any]:
+    """
+    Объединяет индексы нескольких файлов. Минуты, которые встречаются в нескольких файлах
+    (например, на границе ротации), складываются: счётчики суммируются, скетчи объединяются.
+    """
+    indexes = [index for index in indexes if len(index['minutes'])]
+    if not indexes:
+        return empty_minute_index(precision)
+    if len(indexes) == 1:
+        return indexes[0]
+    precision = indexes[0]['precision']
+    if any(index['precision'] != precision for index in indexes):
+        raise ValueError("Нельзя объединить индексы с разной точностью HyperLogLog")
+
+    all_minutes = np.concatenate([index['minutes'] for index in indexes])
+    minutes, positions = np.unique(all_minutes, return_inverse=True)
+    merged = {'minutes': minutes, 'precision': precision}
+    for col in INDEX_COUNT_COLUMNS:
+        merged[col] = np.bincount(positions, weights=np.concatenate([index[col] for index in indexes]), minlength=len(minutes)).astype(np.int64)
+    for col in ('ip_registers', 'endpoint_registers'):
+        registers = np.zeros((len(minutes), 1 << precision), dtype=np.uint8)
+        np.maximum.at(registers, positions, np.concatenate([index[col] for index in indexes]))
+        merged[col] = registers
+    return merged
+
+
+def rolling_registers(minutes: np.ndarray, registers: np.ndarray, window_minutes: int) -> np.ndarray:
+    """
+    Для каждой минуты объединяет скетчи всех минут скользящего окна [минута - window_minutes + 1, минута].
+    """
+    starts = np.searchsorted(minutes, minutes - np.timedelta64(window_minutes - 1, 'm'))
+    positions = np.arange(len(minutes))
+    result = registers.copy()
+    # Минуты в индексе различны, поэтому в окне не больше window_minutes строк индекса
+    for k in range(1, window_minutes):
+        valid = positions - k >= starts
+        if not valid.any():
+            break
+        result[valid] = hll_merge(result[valid], registers[positions[valid] - k])
+    return result
+
+
+def rolling_sum(minutes: np.ndarray, values: np.ndarray, window_minutes: int) -> np.ndarray:
+    """
+    Сумма значений по скользящему окну [минута - window_minutes + 1, минута] для каждой минуты индекса.
+    """
+    cumulative = np.concatenate([[0], np.cumsum(values)])
+    starts = np.searchsorted(minutes, minutes - np.timedelta64(window_minutes - 1, 'm'))
+    return cumulative[1:] - cumulative[starts]
+
+
+def minute_window_features(index: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Оконные признаки preprocess_logs для каждой минуты индекса по скользящим окнам,
+    заканчивающимся этой минутой: 1 минута для requests_per_minute, 5 минут для
+    error_rate_5min, redirect_rate_5min и endpoint_variance_5min, 10 минут для unique_ips_10min.
+    Используется только индекс, сырые записи не нужны.
+    """
+    minutes = index['minutes']
+    count_5min = rolling_sum(minutes, index['count'], 5)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        error_rate = np.where(count_5min > 0, rolling_sum(minutes, index['errors'], 5) / count_5min, 0.0)
+        redirect_rate = np.where(count_5min > 0, rolling_sum(minutes, index['redirects'], 5) / count_5min, 0.0)
+    return pd.DataFrame({
+        'requests_per_minute': index['count'].astype('int32'),
+        'error_rate_5min': error_rate,
+        'endpoint_variance_5min': np.rint(hll_estimate(rolling_registers(minutes, index['endpoint_registers'], 5))).astype('int32'),
+        'redirect_rate_5min': redirect_rate,
+        'unique_ips_10min': np.rint(hll_estimate(rolling_registers(minutes, index['ip_registers'], 10))).astype('int32'),
+    }, index=pd.DatetimeIndex(minutes, name='minute'))
+
+
+def apply_minute_index(df: pd.DataFrame, index: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Записывает в df оконные признаки из индекса по минуте каждой записи.
+    Записи, минуты которых нет в индексе, и записи без времени получают нули.
+    """
+    features = minute_window_features(index)
+    positions = features.index.get_indexer(minute_keys(df['timestamp']))
+    found = positions >= 0
+    for col in features.columns:
+        values = np.zeros(len(df), dtype=features[col].dtype)
+        values[found] = features[col].to_numpy()[positions[found]]
+        df[col] = values
+    return df
+
+
+def minute_index_path(log_file: str, index_dir: str, precision: int) -> str:
+    """
+    Путь к индексу файла. Как и кэш логов, инвалидируется при изменении размера или времени модификации файла.
+    """
+    return cache_file_path(log_file, index_dir, extension=f'.minutes{precision}.npz')
+
+
+def save_minute_index(index: Dict[str, Any], path: str) -> None:
+    """
+    Сохраняет индекс в сжатый .npz (пустые регистры хорошо сжимаются).
+    """
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, **index)
+    os.replace(tmp_path, path)
+
+
+def read_minute_index(path: str) -> Dict[str, Any]:
+    """
+    Загружает индекс, сохранённый save_minute_index.
+    """
+    with np.load(path) as data:
+        index = {key: data[key] for key in data.files}
+    index['precision'] = int(index['precision'])
+    return index
+
+
+def load_minute_index(
+    log_files: List[str],
+    index_dir: str,
+    precision: int = DEFAULT_HLL_PRECISION,
+    cache_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Возвращает объединённый поминутный индекс файлов. Индекс каждого файла строится один раз
+    и сохраняется в index_dir, повторные запуски по неизменившимся файлам читают только индекс.
+
+    :param log_files: Список путей к лог-файлам.
+    :param index_dir: Директория для индексов.
+    :param precision: Точность скетчей HyperLogLog.
+    :param cache_dir: Кэш распарсенных логов (см. data_utils.load_logs_cached), из которого
+        читаются записи для построения индекса. None - файлы парсятся заново.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    indexes = []
+    built = 0
+    for log_file in log_files:
+        path = minute_index_path(log_file, index_dir, precision)
+        if os.path.exists(path):
+            indexes.append(read_minute_index(path))
+            continue
+        if cache_dir:
+            df = load_logs_cached([log_file], cache_dir, columns=INDEX_SOURCE_COLUMNS)
+        else:
+            df = load_logs_to_dataframe([log_file], fields=INDEX_SOURCE_COLUMNS)
+        index = build_minute_index(prepare_base_columns(df), precision) if not df.empty else empty_minute_index(precision)
+        stale_prefix = os.path.basename(path).split('_')[0] + '_'
+        for name in os.listdir(index_dir):
+            if name.startswith(stale_prefix) and name.endswith(f'.minutes{precision}.npz'):
+                os.remove(os.path.join(index_dir, name))
+        save_minute_index(index, path)
+        indexes.append(index)
+        built += 1
+    logging.info(f"Поминутный индекс: построено {built} файлов, прочитано {len(log_files) - built}.")
+    return merge_minute_indexes(indexes, precision)
+
+
+def previous_day_file(log_file: str) -> Optional[str]:
+    """
+    Файл того же стенда за предыдущий день (по дате в имени), если он есть.
+    Нужен, чтобы окна первых минут суток учитывали конец предыдущих.
+    """
+    day = log_file_date(log_file)
+    if day is None:
+        return None
+    directory = os.path.dirname(log_file)
+    for name in sorted(os.listdir(directory)):
+        if log_file_date(name) == day - timedelta(days=1):
+            return os.path.join(directory, name)
+    return None
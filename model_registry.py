@@ -0,0 +1,132 @@
+import os
+import json
+import shutil
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Структура реестра:
+#   <registry_dir>/v0001/model.pkl      - артефакт модели (как в save_anomaly_model)
+#   <registry_dir>/v0001/metadata.json  - окно обучения, количество строк, время обучения и т.п.
+#   <registry_dir>/ACTIVE               - имя активной версии, её копия лежит в MODEL_PATH
+MODEL_FILE_NAME = 'model.pkl'
+METADATA_FILE_NAME = 'metadata.json'
+ACTIVE_FILE_NAME = 'ACTIVE'
+
+
+def normalize_version(version: Any) -> str:
+    """
+    Приводит номер версии к имени папки реестра: 3, '3' и 'v3' -> 'v0003'.
+    """
+    return f"v{int(str(version).lstrip('v')):04d}"
+
+
+def model_version_path(registry_dir: str, version: Any) -> str:
+    """
+    Путь к артефакту модели версии.
+    """
+    return os.path.join(registry_dir, normalize_version(version), MODEL_FILE_NAME)
+
+
+def list_model_versions(registry_dir: str) -> List[Dict[str, Any]]:
+    """
+    Возвращает метаданные всех версий реестра по возрастанию номера версии.
+    """
+    if not os.path.isdir(registry_dir):
+        return []
+    versions = []
+    for name in sorted(os.listdir(registry_dir)):
+        metadata_path = os.path.join(registry_dir, name, METADATA_FILE_NAME)
+        if name.startswith('v') and os.path.exists(metadata_path):
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                versions.append(json.load(f))
+    return versions
+
+
+def load_model_metadata(registry_dir: str, version: Any) -> Dict[str, Any]:
+    """
+    Загружает метаданные версии.
+    """
+    with open(os.path.join(registry_dir, normalize_version(version), METADATA_FILE_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def active_model_version(registry_dir: str) -> Optional[str]:
+    """
+    Имя активной версии или None, если реестр пуст.
+    """
+    try:
+        with open(os.path.join(registry_dir, ACTIVE_FILE_NAME), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def register_model_file(registry_dir: str, model_file: str, metadata: Dict[str, Any], activate: bool = True) -> str:
+    """
+    Добавляет в реестр новую версию: копию артефакта model_file и его метаданные.
+
+    :param registry_dir: Папка реестра.
+    :param model_file: Сохранённый артефакт модели (см. save_anomaly_model).
+    :param metadata: Метаданные обучения (окно дат, количество строк, время обучения и т.п.).
+    :param activate: Отметить версию активной. Артефакт при этом не копируется
+        в MODEL_PATH: предполагается, что model_file и есть MODEL_PATH.
+    :return: Имя новой версии.
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    versions = list_model_versions(registry_dir)
+    version = normalize_version(int(versions[-1]['version'][1:]) + 1 if versions else 1)
+    version_dir = os.path.join(registry_dir, version)
+    os.makedirs(version_dir)
+    shutil.copy2(model_file, os.path.join(version_dir, MODEL_FILE_NAME))
+
+    metadata = {'version': version, 'created_at': datetime.now().isoformat(timespec='seconds'), **metadata}
+    with open(os.path.join(version_dir, METADATA_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2, default=str)
+
+    if activate:
+        write_active_version(registry_dir, version)
+    logging.info(f"Модель зарегистрирована как версия {version}")
+    return version
+
+
+def write_active_version(registry_dir: str, version: str) -> None:
+    """
+    Записывает имя активной версии.
+    """
+    tmp_path = os.path.join(registry_dir, ACTIVE_FILE_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(registry_dir, ACTIVE_FILE_NAME))
+
+
+def activate_model_version(registry_dir: str, version: Any, model_path: str) -> str:
+    """
+    Делает версию активной: копирует её артефакт в model_path (атомарно, через os.replace),
+    так что детекция по MODEL_PATH сразу использует эту версию без переобучения.
+
+    :return: Имя активированной версии.
+    """
+    version = normalize_version(version)
+    source = model_version_path(registry_dir, version)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"В реестре {registry_dir} нет версии {version}")
+    tmp_path = model_path + '.tmp'
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, model_path)
+    write_active_version(registry_dir, version)
+    logging.info(f"Активна версия модели {version}")
+    return version
+
+
+def rollback_model_version(registry_dir: str, model_path: str) -> str:
+    """
+    Откатывает активную модель на предыдущую версию реестра.
+
+    :return: Имя активированной версии.
+    """
+    versions = [meta['version'] for meta in list_model_versions(registry_dir)]
+    active = active_model_version(registry_dir)
+    if active not in versions or versions.index(active) == 0:
+        raise ValueError(f"Нет версии для отката (активна {active})")
+    return activate_model_version(registry_dir, versions[versions.index(active) - 1], model_path)
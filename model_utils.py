@@ -1,107 +1,566 @@
+import os
+import pickle
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
 import joblib
 import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 
-from features import build_feature_matrix
+from features import build_feature_matrix, FEATURE_COLUMNS
+
+# Заголовок файла модели. После него идут два pickle: метаданные артефакта и (модель, scaler, статистики).
+# Файлы без заголовка - прежний формат joblib, они читаются через joblib.load.
+MODEL_ARTIFACT_MAGIC = b'ALDMODEL'
+MODEL_ARTIFACT_FORMAT = 2
 
-def train_anomaly_model(X: pd.DataFrame, model_path: str = None) -> IsolationForest:
+def train_anomaly_model(X: pd.DataFrame, model_path: str = None, reference_stats: Optional[Dict[str, Any]] = None) -> IsolationForest:
     """
-    Обучает модель IsolationForest на признаках X. При необходимости сохраняет.
+    Обучает модель IsolationForest на признаках X. При необходимости сохраняет
+    вместе со статистиками обучающей выборки (см. features.compute_reference_stats).
     """
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(X)
 
-    model = IsolationForest(
+    model = make_isolation_forest()
+    model.fit(X_scaled)
+
+    if model_path:
+        save_anomaly_model(model, scaler, model_path, reference_stats)
+    return model
+
+def save_anomaly_model(
+    model: IsolationForest,
+    scaler: StandardScaler,
+    model_path: str,
+    reference_stats: Optional[Dict[str, Any]] = None
+) -> None:
+    """
+    Сохраняет модель, scaler и статистики обучающей выборки в один файл.
+
+    Файл начинается с MODEL_ARTIFACT_MAGIC и небольшого pickle с метаданными (порядок столбцов
+    признаков, версии sklearn и numpy), которые load_anomaly_model проверяет до загрузки леса.
+    Сама модель сохраняется обычным pickle (протокол 5): его читает C-реализация unpickler,
+    а joblib.load разбирает поток на Python и загружает лес из 500 деревьев в несколько раз дольше.
+    """
+    metadata = {
+        'format': MODEL_ARTIFACT_FORMAT,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'feature_columns': list(FEATURE_COLUMNS),
+        'sklearn_version': sklearn.__version__,
+        'numpy_version': np.__version__,
+        'n_estimators': len(model.estimators_),
+    }
+    tmp_path = model_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MODEL_ARTIFACT_MAGIC)
+        pickle.dump(metadata, f, protocol=5)
+        pickle.dump((model, scaler, reference_stats), f, protocol=5)
+    os.replace(tmp_path, model_path)
+    print(f"Модель сохранена в {model_path}")
+
+def make_isolation_forest() -> IsolationForest:
+    """
+    Создаёт необученную модель IsolationForest с параметрами проекта.
+    """
+    return IsolationForest(
         n_estimators=500,
         max_samples='auto',
         contamination=0.01,
         random_state=42
     )
+
+def train_anomaly_model_chunked(
+    feature_chunks: Iterable[pd.DataFrame],
+    sample_rows: int = 1_000_000,
+    random_state: int = 42
+) -> Tuple[IsolationForest, StandardScaler]:
+    """
+    Обучает IsolationForest на потоке порций матрицы признаков, не держа её в памяти целиком.
+
+    StandardScaler дообучается на каждой порции через partial_fit, а для модели
+    поддерживается равномерная reservoir-выборка из не более чем sample_rows строк,
+    поэтому пиковая память не зависит от длины истории.
+
+    :param feature_chunks: Порции матрицы признаков (как из build_feature_matrix).
+    :param sample_rows: Размер выборки, на которой обучается IsolationForest.
+    :param random_state: Зерно для reservoir-выборки.
+    """
+    rng = np.random.default_rng(random_state)
+    scaler = StandardScaler()
+    sample = None
+    seen = 0
+
+    for X in feature_chunks:
+        if X.empty:
+            continue
+        X = X.to_numpy(dtype=np.float32)
+        scaler.partial_fit(X)
+
+        if sample is None:
+            sample = np.empty((sample_rows, X.shape[1]), dtype=np.float32)
+        # Первые строки заполняют выборку целиком
+        fill = min(max(sample_rows - seen, 0), len(X))
+        sample[seen:seen + fill] = X[:fill]
+        # Остальные замещают случайные элементы выборки (алгоритм R)
+        rest = X[fill:]
+        if len(rest):
+            positions = rng.integers(0, seen + fill + np.arange(len(rest)) + 1)
+            keep = positions < sample_rows
+            sample[positions[keep]] = rest[keep]
+        seen += len(X)
+        logging.info(f"Обработано строк для обучения: {seen}")
+
+    if sample is None:
+        raise ValueError("Нет данных для обучения модели.")
+    sample = sample[:min(seen, sample_rows)]
+
+    model = make_isolation_forest()
+    model.fit(scaler.transform(sample))
+    return model, scaler
+
+def update_anomaly_model(
+    model: IsolationForest,
+    scaler: StandardScaler,
+    X: pd.DataFrame,
+    new_trees: int = 50,
+    max_trees: int = 500,
+    random_state: Optional[int] = None
+) -> Tuple[IsolationForest, StandardScaler]:
+    """
+    Дообучает модель на новых данных без переобучения на всей истории.
+
+    Scaler обновляется через partial_fit, к лесу через warm_start добавляются
+    new_trees деревьев, обученных только на X, после чего самые старые деревья
+    удаляются, чтобы их было не больше max_trees. Вместе с деревьями удаляются их
+    зерна (_seeds) и массивы по деревьям, так что estimators_samples_ соответствует estimators_.
+
+    Порог offset_ пересчитывается итоговым лесом только по новым данным X (перцентиль
+    contamination их оценок), история в нём не учитывается: он отражает долю аномалий
+    в последних сутках, а не во всей обучающей выборке.
+
+    Старые деревья обучены на данных, масштабированных предыдущей версией scaler.
+    Scaler накапливает статистики всей истории, поэтому сдвиг за один день мал,
+    а устаревшие деревья со временем вытесняются новыми.
+
+    :param model: Обученная модель.
+    :param scaler: Обученный scaler.
+    :param X: Матрица признаков новых данных.
+    :param new_trees: Сколько деревьев добавить.
+    :param max_trees: Максимальный размер леса после удаления старых деревьев.
+    :param random_state: Зерно для новых деревьев. Должно отличаться от прошлых обновлений,
+        иначе новые деревья получат те же зерна, что и удалённые.
+    """
+    if X.empty:
+        raise ValueError("Нет данных для дообучения модели.")
+    if not hasattr(scaler, 'feature_names_in_'):
+        # Scaler из train_anomaly_model_chunked обучен на массиве без имён столбцов
+        X = X.to_numpy(dtype=np.float32)
+    scaler.partial_fit(X)
+    X_scaled = scaler.transform(X)
+
+    if random_state is not None:
+        model.random_state = random_state
+    # warm_start оставляет в _seeds только зерна новых деревьев, зерна прежних дописываем сами
+    old_seeds = getattr(model, '_seeds', np.empty(0, dtype=np.int64))
+    model.warm_start = True
+    model.n_estimators = len(model.estimators_) + new_trees
     model.fit(X_scaled)
+    model.warm_start = False
+    model._seeds = np.concatenate([old_seeds, model._seeds])
 
-    if model_path:
-        joblib.dump((model, scaler), model_path)
-        print(f"Модель сохранена в {model_path}")
-    return model
+    retire = max(len(model.estimators_) - max_trees, 0)
+    if retire:
+        model.estimators_ = model.estimators_[retire:]
+        model.estimators_features_ = model.estimators_features_[retire:]
+        for attr in ('_seeds', '_average_path_length_per_tree', '_decision_path_lengths'):
+            if hasattr(model, attr):
+                setattr(model, attr, getattr(model, attr)[retire:])
+        model.n_estimators = len(model.estimators_)
+        if model.contamination != 'auto':
+            model.offset_ = np.percentile(model.score_samples(X_scaled), 100.0 * model.contamination)
+    logging.info(f"Добавлено деревьев: {new_trees}, удалено старых: {retire}, всего: {len(model.estimators_)}")
+    return model, scaler
+
+def stand_model_path(model_path: str, stand: str) -> str:
+    """
+    Путь к модели отдельного стенда: <папка MODEL_PATH>/<стенд>/<имя файла MODEL_PATH>.
+    """
+    return os.path.join(os.path.dirname(model_path), stand, os.path.basename(model_path))
+
+def read_model_metadata(model_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Читает метаданные артефакта модели, не загружая саму модель.
+    Для файлов прежнего формата (joblib) возвращает None.
+    """
+    with open(model_path, 'rb') as f:
+        if f.read(len(MODEL_ARTIFACT_MAGIC)) != MODEL_ARTIFACT_MAGIC:
+            return None
+        return pickle.load(f)
+
+def validate_model_metadata(metadata: Dict[str, Any], model_path: str) -> None:
+    """
+    Проверяет, что модель можно применять в текущем окружении: признаки в том же порядке,
+    что строит build_feature_matrix, и та же мажорная/минорная версия sklearn.
+    Иначе сразу бросает ValueError, а не ошибку или неверные оценки посреди детекции.
+    """
+    if metadata.get('format') != MODEL_ARTIFACT_FORMAT:
+        raise ValueError(f"{model_path}: неподдерживаемый формат артефакта {metadata.get('format')}")
+    if metadata['feature_columns'] != FEATURE_COLUMNS:
+        raise ValueError(
+            f"{model_path}: модель обучена на признаках {metadata['feature_columns']}, "
+            f"а build_feature_matrix строит {FEATURE_COLUMNS}. Переобучите модель."
+        )
+    trained, current = metadata['sklearn_version'].split('.')[:2], sklearn.__version__.split('.')[:2]
+    if trained != current:
+        raise ValueError(
+            f"{model_path}: модель сохранена sklearn {metadata['sklearn_version']}, "
+            f"установлен {sklearn.__version__}. Переобучите модель или установите ту же версию."
+        )
 
 def load_anomaly_model(model_path: str):
     """
-    Загружает модель IsolationForest и scaler из файла.
+    Загружает модель IsolationForest, scaler и статистики обучающей выборки из файла.
+    Метаданные артефакта проверяются до загрузки модели (см. validate_model_metadata).
+    Файлы прежнего формата читаются через joblib; для файлов без статистик вместо них возвращается None.
     """
-    model, scaler = joblib.load(model_path)
-    return model, scaler
+    with open(model_path, 'rb') as f:
+        if f.read(len(MODEL_ARTIFACT_MAGIC)) == MODEL_ARTIFACT_MAGIC:
+            validate_model_metadata(pickle.load(f), model_path)
+            return pickle.load(f)
+
+    artifact = joblib.load(model_path)
+    model, scaler = artifact[:2]
+    if getattr(scaler, 'n_features_in_', len(FEATURE_COLUMNS)) != len(FEATURE_COLUMNS):
+        raise ValueError(
+            f"{model_path}: модель обучена на {scaler.n_features_in_} признаках, "
+            f"а build_feature_matrix строит {len(FEATURE_COLUMNS)}. Переобучите модель."
+        )
+    reference_stats = artifact[2] if len(artifact) > 2 else None
+    return model, scaler, reference_stats
 
-def infer_anomalies(df: pd.DataFrame, model: IsolationForest, scaler: StandardScaler) -> pd.DataFrame:
+def average_path_length(n_samples: np.ndarray) -> np.ndarray:
     """
-    Прогоняет инференс на новом DataFrame, возвращает исходный df с отметками аномалий.
+    Средняя длина пути неудачного поиска в дереве из n_samples записей - поправка
+    IsolationForest на записи, оставшиеся в листе (как sklearn.ensemble._iforest._average_path_length).
     """
-    X = build_feature_matrix(df)
-    X_scaled = scaler.transform(X)
+    n = np.asarray(n_samples, dtype=np.float64)
+    result = np.where(n == 2, 1.0, 0.0)
+    many = n > 2
+    result[many] = 2.0 * (np.log(n[many] - 1.0) + np.euler_gamma) - 2.0 * (n[many] - 1.0) / n[many]
+    return result
 
-    preds = model.predict(X_scaled)
-    scores = model.decision_function(X_scaled)
+class CompiledForest:
+    """
+    Обученный IsolationForest, упакованный в плоские массивы numpy для векторной оценки.
 
-    df['anomaly'] = preds
-    df['anomaly_score'] = scores
-    return df
+    Каждое дерево дополняется до полного бинарного дерева глубины depth: узел уровня k с номером i
+    имеет потомков 2i+1 и 2i+2, поэтому массивы потомков не нужны. Внутренние узлы хранятся
+    в feature/threshold (деревья x 2^depth-1), а в листьях (деревья x 2^depth) - сразу вклад
+    в длину пути: глубина листа плюс поправка average_path_length на число записей в нём.
+    Лист, который в исходном дереве выше depth, дополняется узлами с порогом +inf
+    (запись всегда уходит влево), а его вклад записывается в самый левый лист поддерева.
+
+    Оценка идёт блоками строк: на каждом уровне один проход выбирает признак, сравнивает
+    значение с порогом и спускается сразу во всех деревьях для всех строк блока. Блок
+    подбирается так, чтобы массивы блок x деревья помещались в кэш процессора.
 
-def analyze_anomalies(df: pd.DataFrame) -> pd.DataFrame:
+    Совместим с интерфейсом модели, который использует score_anomalies: score_samples и decision_function
+    совпадают с IsolationForest с точностью до порядка суммирования float64.
+
+    Выигрыш - на маленьких батчах, где sklearn тратит десятки миллисекунд на диспетчеризацию
+    обхода 500 деревьев: одна запись оценивается в сотни раз быстрее. На тысячах строк
+    циклы sklearn на Cython быстрее проходов numpy, поэтому батчи больше fallback_rows строк
+    (если задано) оцениваются самим IsolationForest.
     """
-    Постобработка результатов: анализ аномалий, генерация причины.
+
+    # Элементов (строки блока x деревья) в рабочих массивах одного блока
+    BLOCK_ELEMENTS = 1 << 16
+    # Глубина, выше которой дополнение деревьев до полных занимает слишком много памяти
+    MAX_DEPTH = 16
+
+    def __init__(self, model: IsolationForest, fallback_rows: Optional[int] = None):
+        self.model = model if fallback_rows else None
+        self.fallback_rows = fallback_rows
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        self.n_trees = len(trees)
+        self.depth = max(tree.max_depth for tree in trees)
+        if self.depth > self.MAX_DEPTH:
+            raise ValueError(f"Глубина деревьев {self.depth} больше {self.MAX_DEPTH}, используйте оценку sklearn")
+        self.n_features_in_ = model.n_features_in_
+        self.offset_ = model.offset_
+        n_internal = (1 << self.depth) - 1
+        self.feature = np.zeros((self.n_trees, n_internal), dtype=np.intp)
+        self.threshold = np.full((self.n_trees, n_internal), np.inf)
+        self.leaf_value = np.zeros((self.n_trees, 1 << self.depth))
+
+        for t, (tree, features) in enumerate(zip(trees, model.estimators_features_)):
+            # Номер каждого узла в полном дереве и его глубина, по уровням от корня
+            slot = np.zeros(tree.node_count, dtype=np.int64)
+            depth = np.zeros(tree.node_count, dtype=np.int64)
+            level = np.array([0])
+            while len(level):
+                internal = level[tree.children_left[level] >= 0]
+                left, right = tree.children_left[internal], tree.children_right[internal]
+                slot[left], slot[right] = 2 * slot[internal] + 1, 2 * slot[internal] + 2
+                depth[left] = depth[right] = depth[internal] + 1
+                level = np.concatenate([left, right])
+
+            is_leaf = tree.children_left < 0
+            internal = ~is_leaf
+            self.feature[t, slot[internal]] = np.asarray(features)[tree.feature[internal]]
+            self.threshold[t, slot[internal]] = tree.threshold[internal]
+            leaf_slot = (slot[is_leaf] + 1) * (1 << (self.depth - depth[is_leaf])) - 1
+            self.leaf_value[t, leaf_slot - n_internal] = depth[is_leaf] + average_path_length(tree.n_node_samples[is_leaf])
+
+        max_samples = getattr(model, '_max_samples', model.max_samples_)
+        self.denominator = self.n_trees * average_path_length(np.array([max_samples]))[0]
+        self._feature_flat = self.feature.ravel()
+        self._threshold_flat = self.threshold.ravel()
+        self._leaf_flat = self.leaf_value.ravel()
+        self._tree_base = np.arange(self.n_trees, dtype=np.intp) * n_internal
+        self._leaf_base = np.arange(self.n_trees, dtype=np.intp) * (1 << self.depth) - n_internal
+
+    def path_lengths(self, X: np.ndarray) -> np.ndarray:
+        """
+        Сумма длин путей каждой строки X по всем деревьям.
+        """
+        # Как и sklearn, деревья сравнивают значения признаков во float32
+        X = np.asarray(X, dtype=np.float32)
+        block_rows = max(1, self.BLOCK_ELEMENTS // self.n_trees)
+        result = np.empty(len(X))
+        for start in range(0, len(X), block_rows):
+            block = X[start:start + block_rows]
+            node = np.zeros((len(block), self.n_trees), dtype=np.intp)
+            for _ in range(self.depth):
+                flat = self._tree_base + node
+                values = np.take_along_axis(block, self._feature_flat[flat], axis=1)
+                node = 2 * node + 1 + (values > self._threshold_flat[flat])
+            result[start:start + len(block)] = self._leaf_flat[self._leaf_base + node].sum(axis=1)
+        return result
+
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        """
+        То же, что IsolationForest.score_samples: чем меньше, тем аномальнее.
+        """
+        if self.model is not None and len(X) > self.fallback_rows:
+            return self.model.score_samples(X)
+        if self.denominator == 0:
+            return -np.ones(len(X))
+        return -(2.0 ** (-self.path_lengths(X) / self.denominator))
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """
+        То же, что IsolationForest.decision_function: отрицательные значения - аномалии.
+        """
+        return self.score_samples(X) - self.offset_
+
+def scoring_model(model: IsolationForest, engine: str = 'auto', fallback_rows: int = 1000):
+    """
+    Модель для score_anomalies:
+        'sklearn'  - сам IsolationForest;
+        'compiled' - упакованный CompiledForest для батчей любого размера;
+        'auto'     - CompiledForest для батчей до fallback_rows строк, IsolationForest для больших.
+                     Если лес нельзя упаковать (деревья глубже CompiledForest.MAX_DEPTH), - сам IsolationForest.
+
+    :raises ValueError: Для 'compiled', если лес нельзя упаковать.
     """
-    anomalies_df = df[df['anomaly'] == -1].copy()
+    if engine == 'sklearn':
+        return model
+    if engine == 'compiled':
+        return CompiledForest(model)
+    if engine == 'auto':
+        try:
+            return CompiledForest(model, fallback_rows=fallback_rows)
+        except ValueError as e:
+            logging.warning(f"Лес не упакован в CompiledForest: {e}")
+            return model
+    raise ValueError(f"Неизвестный способ оценки {engine}, ожидается 'sklearn', 'compiled' или 'auto'")
 
-    mean_requests_per_minute = np.percentile(df['requests_per_minute'].dropna(), 98)
-    mean_error_rate_5min = np.percentile(df['error_rate_5min'].dropna(), 98)
+def score_anomalies(
+    X: Union[pd.DataFrame, np.ndarray],
+    model: Union[IsolationForest, 'CompiledForest'],
+    scaler: StandardScaler,
+    chunk_rows: int = 100_000,
+    workers: int = 1
+) -> np.ndarray:
+    """
+    Считает decision_function модели по матрице признаков порциями по chunk_rows строк.
 
-    p98_request_time = np.percentile(df['request_time'].dropna(), 98)
+    Каждая порция масштабируется и оценивается отдельно, поэтому в памяти одновременно
+    находятся только масштабированные копии обрабатываемых порций. При workers > 1
+    порции оцениваются в пуле потоков (обход деревьев sklearn отпускает GIL).
 
-    reasons = []
-    for idx, row in anomalies_df.iterrows():
-        detail = []
+    X может быть и массивом numpy, в том числе отображённым в память (см. feature_store.py):
+    тогда с диска читаются только страницы оцениваемой порции.
+    """
+    def score_chunk(start: int) -> np.ndarray:
+        if isinstance(X, np.ndarray):
+            chunk = X[start:start + chunk_rows]
+            if hasattr(scaler, 'feature_names_in_'):
+                chunk = pd.DataFrame(chunk, columns=scaler.feature_names_in_, copy=False)
+        else:
+            chunk = X.iloc[start:start + chunk_rows]
+        return model.decision_function(scaler.transform(chunk))
 
-        if row['request_time'] > p98_request_time:
-            detail.append(
-                f"Слишком долгое время ответа (request_time={row['request_time']:.3f} > p98={p98_request_time:.3f})"
-            )
+    starts = range(0, len(X), chunk_rows)
+    if workers > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(score_chunk, starts))
+    else:
+        parts = [score_chunk(start) for start in starts]
+    return np.concatenate(parts) if parts else np.empty(0)
 
-        if row['requests_per_minute'] > mean_requests_per_minute:
-            detail.append(
-                f"Частота запросов выше p98 (requests_per_minute={row['requests_per_minute']:.2f} > {mean_requests_per_minute:.2f})"
-            )
+def infer_anomalies(
+    df: pd.DataFrame,
+    model: IsolationForest,
+    scaler: StandardScaler,
+    chunk_rows: int = 100_000,
+    workers: int = 1
+) -> pd.DataFrame:
+    """
+    Прогоняет инференс на новом DataFrame, возвращает исходный df с отметками аномалий.
 
-        if row['response_status'] >= 400 and row['error_rate_5min'] > mean_error_rate_5min:
-            detail.append(
-                f"Слишком много ошибочных ответов (error_rate_5min={row['error_rate_5min']:.2f} > {mean_error_rate_5min:.2f})"
-            )
+    Оценка считается один раз, метка выводится из неё так же, как в IsolationForest.predict
+    (decision_function < 0 - аномалия), без повторного обхода деревьев.
 
-        if row.get('is_rare_ua', 0) == 1:
-            detail.append("Редкий User-Agent (is_rare_ua=1)")
+    :param chunk_rows: Размер порции строк при оценке.
+    :param workers: Количество потоков для оценки порций.
+    """
+    X = build_feature_matrix(df)
+    scores = score_anomalies(X, model, scaler, chunk_rows=chunk_rows, workers=workers)
+
+    df['anomaly'] = np.where(scores < 0, -1, 1)
+    df['anomaly_score'] = scores
+    return df
 
-        if abs(row.get('endpoint_zscore', 0)) > 2:
-            detail.append(f"Аномальный Z-score (endpoint_zscore={row['endpoint_zscore']:.2f})")
+# Правила объяснения аномалий. Каждое правило - условие над столбцом и шаблон текста причины.
+# threshold - число или 'pNN' (NN-й перцентиль столбца по всем строкам df),
+# when - дополнительное условие (столбец, операция, порог), которое должно выполняться одновременно.
+# В шаблоне доступны {value} - значение строки и {threshold} - вычисленный порог.
+ANOMALY_RULES = [
+    {
+        'column': 'request_time', 'op': '>', 'threshold': 'p98',
+        'text': "Слишком долгое время ответа (request_time={value:.3f} > p98={threshold:.3f})",
+    },
+    {
+        'column': 'requests_per_minute', 'op': '>', 'threshold': 'p98',
+        'text': "Частота запросов выше p98 (requests_per_minute={value:.2f} > {threshold:.2f})",
+    },
+    {
+        'column': 'error_rate_5min', 'op': '>', 'threshold': 'p98', 'when': ('response_status', '>=', 400),
+        'text': "Слишком много ошибочных ответов (error_rate_5min={value:.2f} > {threshold:.2f})",
+    },
+    {
+        'column': 'is_rare_ua', 'op': '==', 'threshold': 1,
+        'text': "Редкий User-Agent (is_rare_ua=1)",
+    },
+    {
+        'column': 'endpoint_zscore', 'op': 'abs>', 'threshold': 2,
+        'text': "Аномальный Z-score (endpoint_zscore={value:.2f})",
+    },
+    {
+        'column': 'is_suspicious_endpoint', 'op': '==', 'threshold': 1,
+        'text': "Подозрительный Endpoint (is_suspicious_endpoint=1)",
+    },
+    {
+        'column': 'is_redirect', 'op': '==', 'threshold': 1,
+        'text': "Редирект (is_redirect=1)",
+    },
+    {
+        'column': 'redirect_rate_5min', 'op': '>', 'threshold': 0.3,
+        'text': "Высокая частота редиректов (redirect_rate_5min={value:.2f})",
+    },
+    {
+        'column': 'unique_ips_10min', 'op': '>', 'threshold': 10,
+        'text': "Слишком много уникальных IP (unique_ips_10min={value})",
+    },
+]
 
-        if row.get('is_suspicious_endpoint', 0) == 1:
-            detail.append("Подозрительный Endpoint (is_suspicious_endpoint=1)")
+RULE_OPERATIONS = {
+    '>': lambda values, threshold: values > threshold,
+    '>=': lambda values, threshold: values >= threshold,
+    '==': lambda values, threshold: values == threshold,
+    'abs>': lambda values, threshold: np.abs(values) > threshold,
+}
 
-        if row.get('is_redirect', 0) == 1:
-            detail.append("Редирект (is_redirect=1)")
+def resolve_rule_threshold(df: pd.DataFrame, column: str, threshold) -> float:
+    """
+    Возвращает числовой порог правила: число как есть, 'pNN' - перцентиль столбца
+    (NaN для столбца без значений - такое правило не срабатывает).
+    """
+    if isinstance(threshold, str) and threshold.startswith('p'):
+        values = df[column].dropna()
+        if values.empty:
+            return np.nan
+        return np.percentile(values, float(threshold[1:]))
+    return threshold
 
-        if row.get('redirect_rate_5min', 0) > 0.3:
-            detail.append(f"Высокая частота редиректов (redirect_rate_5min={row['redirect_rate_5min']:.2f})")
+def evaluate_anomaly_rules(df: pd.DataFrame, anomalies_df: pd.DataFrame, rules: list = ANOMALY_RULES):
+    """
+    Проверяет правила для строк anomalies_df векторно.
 
-        if row.get('unique_ips_10min', 0) > 10:
-            detail.append(f"Слишком много уникальных IP (unique_ips_10min={row['unique_ips_10min']})")
+    :param df: Все строки, по которым считаются перцентильные пороги.
+    :param anomalies_df: Строки, для которых проверяются правила.
+    :return: Битовая маска сработавших правил для каждой строки (бит i - правило i) и список порогов.
+    """
+    mask = np.zeros(len(anomalies_df), dtype=np.int64)
+    thresholds = []
+    for i, rule in enumerate(rules):
+        column = rule['column']
+        if column not in anomalies_df.columns:
+            thresholds.append(None)
+            continue
+        threshold = resolve_rule_threshold(df, column, rule['threshold'])
+        thresholds.append(threshold)
+        hit = RULE_OPERATIONS[rule['op']](anomalies_df[column].to_numpy(dtype=np.float64, na_value=np.nan), threshold)
+        if 'when' in rule:
+            when_column, when_op, when_threshold = rule['when']
+            if when_column not in anomalies_df.columns:
+                continue
+            hit &= RULE_OPERATIONS[when_op](anomalies_df[when_column].to_numpy(dtype=np.float64, na_value=np.nan), when_threshold)
+        mask |= hit.astype(np.int64) << i
+    return mask, thresholds
 
-        if not detail:
-            detail.append("Аномальное отклонение без явных конкретных метрик")
+def format_anomaly_reasons(anomalies_df: pd.DataFrame, mask: np.ndarray, thresholds: list, rules: list = ANOMALY_RULES) -> pd.Series:
+    """
+    Собирает текст причин для строк по битовой маске правил.
+    Текст форматируется только для строк, где правило сработало.
+    """
+    reasons = pd.Series('', index=anomalies_df.index, dtype=object)
+    for i, rule in enumerate(rules):
+        hit = (mask >> i) & 1 == 1
+        if not hit.any():
+            continue
+        text = rule['text']
+        if '{' in text:
+            parts = anomalies_df.loc[hit, rule['column']].map(
+                lambda value: text.format(value=value, threshold=thresholds[i])
+            )
+        else:
+            parts = text
+        reasons[hit] = reasons[hit] + '; ' + parts
+    return reasons.str[2:]
 
-        reasons.append("; ".join(detail))
+def analyze_anomalies(df: pd.DataFrame, rules: list = ANOMALY_RULES) -> pd.DataFrame:
+    """
+    Постобработка результатов: анализ аномалий, генерация причины.
 
-    anomalies_df['anomaly_reason'] = reasons
+    Правила из rules проверяются векторно, битовая маска сработавших правил
+    сохраняется в столбец anomaly_rule_mask. Аномалии, для которых не сработало
+    ни одно правило, отбрасываются.
+    """
+    anomalies_df = df[df['anomaly'] == -1]
 
-    anomalies_df = anomalies_df[anomalies_df['anomaly_reason'] != 'Аномальное отклонение без явных конкретных метрик']
+    mask, thresholds = evaluate_anomaly_rules(df, anomalies_df, rules)
+    explained = mask != 0
+    anomalies_df = anomalies_df[explained].copy()
+    anomalies_df['anomaly_rule_mask'] = mask[explained]
+    anomalies_df['anomaly_reason'] = format_anomaly_reasons(anomalies_df, mask[explained], thresholds, rules)
 
-    return anomalies_df
\ No newline at end of file
+    return anomalies_df
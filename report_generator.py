@@ -1,8 +1,105 @@
-import pandas as pd
 import os
+import re
+import html
+import math
 from datetime import datetime
 
-def generate_html_report(anomalies_df: pd.DataFrame, output_path: str = "anomalies_report.html"):
+import numpy as np
+import pandas as pd
+
+DESIRED_COLUMNS = [
+    "timestamp", "endpoint", "response_status", "remote_addr", "body_bytes_sent",
+    "request_time", "request", "request_method", "upstream_addr", "http_x_real_ip",
+    "http_x_forwarded_for", "http_referrer", "http_user_agent", "http_version",
+    "nginx_access", "requests_per_minute", "is_rare_ua", "endpoint_zscore",
+    "is_suspicious_endpoint", "is_redirect", "redirect_rate_5min",
+    "error_rate_5min", "endpoint_variance_5min", "std_rt", "unique_ips_10min",
+    "anomaly", "anomaly_score", "anomaly_reason"
+]
+
+REPORT_STYLE = """    <style>
+        body {
+            font-family: Arial, sans-serif;
+            margin: 20px;
+            background: #f7f7f7;
+        }
+        .header {
+            margin-bottom: 20px;
+            padding: 20px;
+            background-color: #ececec;
+            border-radius: 5px;
+        }
+        .header h1 {
+            margin: 0;
+            font-size: 24px;
+            color: #333333;
+        }
+        .header p {
+            margin: 5px 0 0;
+            color: #666666;
+        }
+        table {
+            border-collapse: collapse;
+            width: 100%;
+            margin-top: 20px;
+            background: #ffffff;
+            border-radius: 5px;
+            overflow: hidden;
+        }
+        table, th, td {
+            border: 1px solid #ddd;
+        }
+        th, td {
+            padding: 12px;
+            text-align: left;
+            vertical-align: top;
+        }
+        th {
+            background-color: #fafafa;
+            color: #333333;
+        }
+        tr:nth-child(even) {
+            background-color: #fcfcfc;
+        }
+        tr:hover {
+            background-color: #f5f5f5;
+        }
+        .summary {
+            margin-top: 20px;
+            font-weight: bold;
+            color: #333333;
+        }
+        .anomaly-row {
+            background-color: #ffeded;
+        }
+        .highlight {
+            color: #d9534f; /* bootstrap's danger color */
+            font-weight: bold;
+        }
+        .no-anomalies {
+            color: #2E86C1;
+            font-size: 18px;
+            font-weight: bold;
+        }
+        .nav {
+            margin-top: 20px;
+        }
+        .footer {
+            margin-top: 30px;
+            text-align: center;
+            font-size: 12px;
+            color: #999999;
+        }
+    </style>
+"""
+
+SUMMARY_TOP = 50
+
+# Как выводятся пропущенные значения (NaN, None, NaT) в ячейках таблицы
+MISSING_CELL = "—"
+
+
+def generate_html_report(anomalies_df: pd.DataFrame, output_path: str = "anomalies_report.html", rows_per_page: int = 5000):
     """
     Генерирует HTML-отчет по аномалиям и сохраняет его в файл output_path.
 
@@ -37,175 +134,173 @@ def generate_html_report(anomalies_df: pd.DataFrame, output_path: str = "anomali
       - anomaly_reason
 
     Если каких-то столбцов в DataFrame нет, они автоматически пропускаются в таблице.
-    """
 
-    desired_columns = [
-        "timestamp", "endpoint", "response_status", "remote_addr", "body_bytes_sent",
-        "request_time", "request", "request_method", "upstream_addr", "http_x_real_ip",
-        "http_x_forwarded_for", "http_referrer", "http_user_agent", "http_version",
-        "nginx_access", "requests_per_minute", "is_rare_ua", "endpoint_zscore",
-        "is_suspicious_endpoint", "is_redirect", "redirect_rate_5min",
-        "error_rate_5min", "endpoint_variance_5min", "std_rt", "unique_ips_10min",
-        "anomaly", "anomaly_score", "anomaly_reason"
-    ]
+    Таблица разбивается на страницы по rows_per_page строк, которые пишутся на диск
+    по одной: <имя>_page_0001.html и т.д. рядом с output_path. Сам output_path содержит
+    сводку по endpoint'ам и причинам и ссылки на страницы; если страница одна,
+    таблица выводится прямо в нём. Страницы прежнего отчёта с тем же output_path
+    удаляются, чтобы из более длинного прошлого отчёта не оставалось лишних страниц.
+    """
 
-    existing_columns = [col for col in desired_columns if col in anomalies_df.columns]
+    remove_report_pages(output_path)
+    existing_columns = [col for col in DESIRED_COLUMNS if col in anomalies_df.columns]
+    generated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     if anomalies_df.empty or not existing_columns:
-        html_content = f"""
-        <html>
-        <head>
-            <meta charset="utf-8"/>
-            <title>Отчет по аномалиям</title>
-            <style>
-                body {{
-                    font-family: Arial, sans-serif;
-                    margin: 20px;
-                }}
-                .header {{
-                    margin-bottom: 20px;
-                }}
-                .no-anomalies {{
-                    color: #2E86C1;
-                    font-size: 18px;
-                    font-weight: bold;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>Отчет по аномалиям</h1>
-                <p>Дата генерации: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>
-            </div>
-            <div class="no-anomalies">Аномалий не обнаружено или отсутствуют необходимые поля.</div>
-        </body>
-        </html>
-        """
-    else:
-        table_html = anomalies_df[existing_columns].to_html(
-            index=False,
-            justify="left",
-            border=0
-        )
-
-        html_content = f"""
-<html>
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(page_header("Отчет по аномалиям", generated_at))
+            f.write('    <div class="no-anomalies">Аномалий не обнаружено или отсутствуют необходимые поля.</div>\n')
+            f.write(page_footer())
+        print(f"HTML-отчет сохранён в: {os.path.abspath(output_path)}")
+        return
+
+    total = len(anomalies_df)
+    pages = math.ceil(total / rows_per_page)
+    base, ext = os.path.splitext(output_path)
+    page_paths = [f"{base}_page_{page:04d}{ext or '.html'}" for page in range(1, pages + 1)]
+    index_name = os.path.basename(output_path)
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(page_header("Отчет по аномалиям", generated_at))
+        f.write(f'    <div class="summary">Всего аномалий: {total}</div>\n')
+        write_summaries(f, anomalies_df)
+        if pages == 1:
+            write_table(f, anomalies_df, existing_columns)
+        else:
+            f.write("    <h2>Страницы</h2>\n    <ul>\n")
+            for page, path in enumerate(page_paths, start=1):
+                first = (page - 1) * rows_per_page + 1
+                last = min(page * rows_per_page, total)
+                f.write(f'        <li><a href="{html.escape(os.path.basename(path))}">Страница {page}</a> (строки {first}-{last})</li>\n')
+            f.write("    </ul>\n")
+        f.write(page_footer())
+
+    if pages > 1:
+        for page, path in enumerate(page_paths, start=1):
+            chunk = anomalies_df.iloc[(page - 1) * rows_per_page:page * rows_per_page]
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(page_header(f"Отчет по аномалиям: страница {page} из {pages}", generated_at))
+                f.write(page_navigation(page, page_paths, index_name))
+                write_table(f, chunk, existing_columns)
+                f.write(page_navigation(page, page_paths, index_name))
+                f.write(page_footer())
+
+    print(f"HTML-отчет сохранён в: {os.path.abspath(output_path)}")
+
+
+def remove_report_pages(output_path: str) -> None:
+    """
+    Удаляет страницы <имя>_page_NNNN.html, оставшиеся от прежнего отчёта с тем же output_path.
+    """
+    base, ext = os.path.splitext(output_path)
+    directory = os.path.dirname(os.path.abspath(output_path))
+    pattern = re.compile(re.escape(os.path.basename(base)) + r"_page_\d{4,}" + re.escape(ext or ".html") + "$")
+    for name in os.listdir(directory):
+        if pattern.match(name):
+            os.remove(os.path.join(directory, name))
+
+
+def page_header(title: str, generated_at: str) -> str:
+    return f"""<html>
 <head>
     <meta charset="utf-8"/>
-    <title>Отчет по аномалиям</title>
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            margin: 20px;
-            background: #f7f7f7;
-        }}
-        .header {{
-            margin-bottom: 20px;
-            padding: 20px;
-            background-color: #ececec;
-            border-radius: 5px;
-        }}
-        .header h1 {{
-            margin: 0;
-            font-size: 24px;
-            color: #333333;
-        }}
-        .header p {{
-            margin: 5px 0 0;
-            color: #666666;
-        }}
-        table {{
-            border-collapse: collapse;
-            width: 100%;
-            margin-top: 20px;
-            background: #ffffff;
-            border-radius: 5px;
-            overflow: hidden;
-        }}
-        table, th, td {{
-            border: 1px solid #ddd;
-        }}
-        th, td {{
-            padding: 12px;
-            text-align: left;
-            vertical-align: top;
-        }}
-        th {{
-            background-color: #fafafa;
-            color: #333333;
-        }}
-        tr:nth-child(even) {{
-            background-color: #fcfcfc;
-        }}
-        tr:hover {{
-            background-color: #f5f5f5;
-        }}
-        .summary {{
-            margin-top: 20px;
-            font-weight: bold;
-            color: #333333;
-        }}
-        .anomaly-row {{
-            background-color: #ffeded;
-        }}
-        .highlight {{
-            color: #d9534f; /* bootstrap's danger color */
-            font-weight: bold;
-        }}
-        .footer {{
-            margin-top: 30px;
-            text-align: center;
-            font-size: 12px;
-            color: #999999;
-        }}
-    </style>
-</head>
+    <title>{html.escape(title)}</title>
+{REPORT_STYLE}</head>
 <body>
     <div class="header">
-        <h1>Отчет по аномалиям</h1>
-        <p>Дата генерации: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>
+        <h1>{html.escape(title)}</h1>
+        <p>Дата генерации: {generated_at}</p>
     </div>
-    <table>
-        <thead>
-            <tr>
-                {"".join(f"<th>{col}</th>" for col in existing_columns)}
-            </tr>
-        </thead>
-        <tbody>
-            {"".join(build_table_rows(anomalies_df, existing_columns))}
-        </tbody>
-    </table>
-    <div class="summary">
-        Всего аномалий: {len(anomalies_df)}
-    </div>
-    <div class="footer">
+"""
+
+
+def page_footer() -> str:
+    return """    <div class="footer">
         &copy; ALD 2025
     </div>
 </body>
 </html>
 """
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html_content)
 
-    print(f"HTML-отчет сохранён в: {os.path.abspath(output_path)}")
+def page_navigation(page: int, page_paths: list[str], index_name: str) -> str:
+    links = [f'<a href="{html.escape(index_name)}">Сводка</a>']
+    if page > 1:
+        links.append(f'<a href="{html.escape(os.path.basename(page_paths[page - 2]))}">&larr; Предыдущая</a>')
+    if page < len(page_paths):
+        links.append(f'<a href="{html.escape(os.path.basename(page_paths[page]))}">Следующая &rarr;</a>')
+    return f'    <div class="nav">{" | ".join(links)}</div>\n'
+
+
+def write_summaries(f, anomalies_df: pd.DataFrame) -> None:
+    """
+    Пишет сводные таблицы: число аномалий по endpoint'ам и по причинам (первые SUMMARY_TOP).
+    """
+    if "endpoint" in anomalies_df.columns:
+        counts = anomalies_df["endpoint"].astype(object).value_counts().head(SUMMARY_TOP)
+        write_summary_table(f, "Аномалии по endpoint'ам", "endpoint", counts)
+
+    if "anomaly_reason" in anomalies_df.columns:
+        # Причины без конкретных значений в скобках, чтобы одинаковые правила группировались
+        reasons = anomalies_df["anomaly_reason"].dropna().astype(str).str.split("; ").explode()
+        counts = reasons.str.split(" (", n=1, regex=False).str[0].value_counts().head(SUMMARY_TOP)
+        write_summary_table(f, "Аномалии по причинам", "Причина", counts)
+
+
+def write_summary_table(f, title: str, label: str, counts: pd.Series) -> None:
+    f.write(f"    <h2>{html.escape(title)}</h2>\n    <table>\n")
+    f.write(f"        <thead><tr><th>{html.escape(label)}</th><th>Количество</th></tr></thead>\n        <tbody>\n")
+    rows = "<tr><td>" + escape_cells(counts.index.to_series()) + "</td><td>" + counts.astype(str).to_numpy() + "</td></tr>"
+    f.write("\n".join(rows))
+    f.write("\n        </tbody>\n    </table>\n")
+
+
+def write_table(f, df: pd.DataFrame, columns: list[str], chunk_rows: int = 1000) -> None:
+    """
+    Пишет таблицу аномалий в открытый файл порциями по chunk_rows строк.
+    """
+    f.write("    <table>\n        <thead>\n            <tr>\n                ")
+    f.write("".join(f"<th>{html.escape(col)}</th>" for col in columns))
+    f.write("\n            </tr>\n        </thead>\n        <tbody>\n")
+    for start in range(0, len(df), chunk_rows):
+        f.write("\n".join(build_table_rows(df.iloc[start:start + chunk_rows], columns)))
+        f.write("\n")
+    f.write("        </tbody>\n    </table>\n")
+
+
+def escape_cells(values: pd.Series) -> pd.Series:
+    """
+    Приводит значения столбца к строкам и экранирует HTML-спецсимволы.
+    Пропущенные значения выводятся как MISSING_CELL, а не 'nan' или 'NaT'.
+
+    Числа и даты не содержат спецсимволов и только приводятся к строкам, а строковые
+    столбцы экранируются по уникальным значениям, которые затем раскладываются по строкам.
+    """
+    missing = values.isna().to_numpy()
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values):
+        cells = values.astype(str).astype(object)
+    else:
+        codes, uniques = pd.factorize(values.astype(object))
+        # Код -1 (пропуск) указывает на добавленный в конец MISSING_CELL
+        escaped = pd.Index(uniques).map(lambda value: html.escape(str(value))).to_numpy(dtype=object)
+        cells = pd.Series(np.append(escaped, MISSING_CELL)[codes], index=values.index, dtype=object)
+    if missing.any():
+        cells = cells.where(~missing, MISSING_CELL)
+    return cells
 
 
 def build_table_rows(df: pd.DataFrame, columns: list[str]) -> list[str]:
-    rows_html = []
-    for _, row in df.iterrows():
-        anomaly_class = ""
-        if "anomaly" in df.columns and row["anomaly"]:
-            anomaly_class = " anomaly-row"
-
-        cells = []
-        for col in columns:
-            cell_value = row[col]
-            if col in ["anomaly", "anomaly_reason"] and cell_value:
-                cells.append(f"<td><span class='highlight'>{cell_value}</span></td>")
-            else:
-                cells.append(f"<td>{cell_value}</td>")
-
-        row_html = f"<tr class='{anomaly_class}'>" + "".join(cells) + "</tr>"
-        rows_html.append(row_html)
-    return rows_html
\ No newline at end of file
+    rows = pd.Series("", index=df.index, dtype=object)
+    for col in columns:
+        cells = escape_cells(df[col])
+        if col in ["anomaly", "anomaly_reason"]:
+            highlight = df[col].astype(bool).to_numpy() & df[col].notna().to_numpy()
+            cells = cells.where(~highlight, "<span class='highlight'>" + cells + "</span>")
+        rows = rows + "<td>" + cells + "</td>"
+
+    if "anomaly" in df.columns:
+        anomaly = df["anomaly"].astype(bool).to_numpy() & df["anomaly"].notna().to_numpy()
+        row_open = pd.Series("<tr class=''>", index=df.index).where(~anomaly, "<tr class=' anomaly-row'>")
+    else:
+        row_open = "<tr class=''>"
+    return (row_open + rows + "</tr>").tolist()
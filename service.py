@@ -0,0 +1,275 @@
+import json
+import queue
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from data_utils import parse_log_bytes
+from model_utils import infer_anomalies, evaluate_anomaly_rules, format_anomaly_reasons
+from features import model_distinct_precision, SOURCE_COLUMNS
+from streaming import SlidingWindowState
+from sketches import DEFAULT_HLL_PRECISION
+
+# Строковые поля, по которым считаются признаки: значения должны быть строками или числами
+SCALAR_COLUMNS = ['remote_addr', 'request', 'http_user_agent']
+
+
+class InvalidRecordsError(ValueError):
+    """
+    Записи запроса нельзя оценить (HTTP 400).
+    """
+
+
+def normalize_records(records: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Проверяет записи одного запроса и приводит их к общему виду до объединения в батч,
+    чтобы ошибка в записях одного клиента не приводила к ошибке оценки всего батча.
+
+    Время приводится к UTC (записи с разными часовыми поясами иначе дают столбец object),
+    неразбираемое время - NaT. Недостающие поля SOURCE_COLUMNS добавляются пропусками,
+    числовые поля приводятся к числам (неразбираемые - NaN, дальше 0, как в prepare_base_columns).
+
+    :raises InvalidRecordsError: Если строковое поле содержит объект или список.
+    """
+    df = pd.DataFrame(records)
+    for col in SOURCE_COLUMNS:
+        if col not in df.columns:
+            df[col] = np.nan
+    for col in SCALAR_COLUMNS:
+        nested = df[col].map(lambda value: isinstance(value, (dict, list))).to_numpy(dtype=bool)
+        if nested.any():
+            raise InvalidRecordsError(f"поле {col} записи {int(np.flatnonzero(nested)[0])} должно быть строкой или числом")
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce', utc=True)
+    for col in ('request_time', 'body_bytes_sent', 'response_status'):
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+class ScoreRequest:
+    """
+    Записи одного HTTP-запроса, ожидающие оценки в общем батче.
+    """
+
+    def __init__(self, records: pd.DataFrame):
+        self.records = records
+        self.results: Optional[List[Dict[str, Any]]] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class ScoringService:
+    """
+    Резидентная модель: загружается один раз и оценивает записи из HTTP-запросов.
+
+    Запросы складываются в очередь, единственный поток оценки забирает их и объединяет
+    в батч до max_batch_rows записей, ожидая попутные запросы не дольше max_wait_seconds,
+    чтобы лес оценивал записи векторно, а не по одному запросу. Оконные признаки
+    поддерживаются SlidingWindowState так же, как в потоковой детекции (в режиме window_features,
+    с которым обучена модель), поэтому не зависят от того, как запросы разбились на батчи. Пороги правил вида 'pNN' считаются по батчу.
+
+    Записи каждого запроса проверяются и нормализуются до постановки в очередь (normalize_records),
+    некорректный запрос получает отказ (HTTP 400), не попадая в батч. Если оценка объединённого
+    батча всё же падает, окна откатываются и запросы батча оцениваются по отдельности,
+    так что ошибку получает только запрос, на котором она возникает.
+
+    Одновременно в очереди может быть не больше max_pending запросов, остальные
+    получают отказ (HTTP 503), чтобы при перегрузке не расти очередь без ограничений.
+    """
+
+    def __init__(
+        self,
+        model: IsolationForest,
+        scaler: StandardScaler,
+        reference_stats: Optional[Dict[str, Any]] = None,
+        max_batch_rows: int = 5000,
+        max_wait_seconds: float = 0.01,
+        max_pending: int = 64,
+        window_features: str = 'buckets',
+        hll_precision: int = DEFAULT_HLL_PRECISION
+    ):
+        self.model = model
+        self.scaler = scaler
+        self.state = SlidingWindowState(
+            reference_stats,
+            distinct_precision=model_distinct_precision(reference_stats),
+            window_features=window_features,
+            hll_precision=hll_precision
+        )
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_seconds = max_wait_seconds
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.requests: 'queue.Queue[ScoreRequest]' = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name='scoring', daemon=True)
+        self.worker.start()
+
+    def submit(self, records: List[Dict[str, Any]], timeout: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+        """
+        Оценивает записи и возвращает результат по каждой в исходном порядке.
+        Возвращает None, если очередь заполнена.
+
+        :raises InvalidRecordsError: Если записи не прошли проверку (см. normalize_records).
+        """
+        if not records:
+            return []
+        frame = normalize_records(records)
+        if not self.pending.acquire(blocking=False):
+            return None
+        try:
+            request = ScoreRequest(frame)
+            self.requests.put(request)
+            if not request.done.wait(timeout):
+                raise TimeoutError("Превышено время ожидания оценки")
+            if request.error is not None:
+                raise request.error
+            return request.results
+        finally:
+            self.pending.release()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.requests.get()]
+            rows = len(batch[0].records)
+            deadline = time.monotonic() + self.max_wait_seconds
+            while rows < self.max_batch_rows:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                rows += len(request.records)
+
+            snapshot = self.state.snapshot()
+            try:
+                results = self.score(pd.concat([request.records for request in batch], ignore_index=True))
+                offset = 0
+                for request in batch:
+                    request.results = results[offset:offset + len(request.records)]
+                    offset += len(request.records)
+            except Exception:
+                logging.exception("Ошибка оценки батча, оцениваем запросы по отдельности")
+                self.state.restore(snapshot)
+                for request in batch:
+                    self._score_request(request)
+            for request in batch:
+                request.done.set()
+
+    def _score_request(self, request: ScoreRequest) -> None:
+        """
+        Оценивает запрос отдельно от батча. При ошибке окна возвращаются к состоянию до запроса.
+        """
+        snapshot = self.state.snapshot()
+        try:
+            request.results = self.score(request.records)
+        except Exception as e:
+            logging.exception("Ошибка оценки запроса")
+            self.state.restore(snapshot)
+            request.error = e
+
+    def score(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """
+        Оценивает записи (результат normalize_records) одним батчем.
+
+        :return: Для каждой записи флаг аномалии, оценка decision_function и причина.
+        """
+        if df.empty:
+            return []
+        df = df.copy()
+        df['_row'] = np.arange(len(df))
+        # update сортирует записи по времени, исходный порядок восстанавливается по _row
+        df = infer_anomalies(self.state.update(df), self.model, self.scaler)
+        df = df.sort_values('_row')
+
+        anomalies_df = df[df['anomaly'] == -1]
+        mask, thresholds = evaluate_anomaly_rules(df, anomalies_df)
+        reasons = pd.Series('', index=df.index, dtype=object)
+        reasons[anomalies_df.index] = format_anomaly_reasons(anomalies_df, mask, thresholds)
+
+        return [
+            {'anomaly': bool(anomaly == -1), 'score': float(score), 'reason': reason}
+            for anomaly, score, reason in zip(df['anomaly'], df['anomaly_score'], reasons)
+        ]
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API сервиса:
+        GET  /health - проверка готовности.
+        POST /score  - тело из строк лога или NDJSON (по записи на строку), ответ -
+                       {"results": [{"line", "anomaly", "score", "reason"}], "rejected": [номера строк]}.
+    """
+    service: ScoringService
+    max_body_bytes: int = 16 * 1024 * 1024
+    request_timeout: float = 60.0
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': 'not found'})
+            return
+        self.send_json(200, {'status': 'ok', 'pending_requests': self.service.requests.qsize()})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self.send_json(404, {'error': 'not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.max_body_bytes:
+            self.send_json(413, {'error': f'body is larger than {self.max_body_bytes} bytes'})
+            return
+
+        records, lines, rejected = [], [], []
+        for number, line in enumerate(self.rfile.read(length).splitlines()):
+            if not line.strip():
+                continue
+            data = parse_log_bytes(line)
+            if data:
+                records.append(data)
+                lines.append(number)
+            else:
+                rejected.append(number)
+
+        try:
+            results = self.service.submit(records, timeout=self.request_timeout)
+        except InvalidRecordsError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except TimeoutError as e:
+            self.send_json(504, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        if results is None:
+            self.send_json(503, {'error': 'too many pending requests'})
+            return
+
+        for number, result in zip(lines, results):
+            result['line'] = number
+        self.send_json(200, {'results': results, 'rejected': rejected})
+
+    def send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def make_scoring_server(service: ScoringService, host: str, port: int, max_body_bytes: int = 16 * 1024 * 1024) -> ThreadingHTTPServer:
+    """
+    Создаёт HTTP-сервер для сервиса оценки.
+    """
+    handler = type('Handler', (ScoringRequestHandler,), {'service': service, 'max_body_bytes': max_body_bytes})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -0,0 +1,139 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# HyperLogLog: оценка количества различных значений по 2^precision однобайтовым регистрам.
+# Регистры разных порций данных объединяются поэлементным максимумом, поэтому скетчи
+# можно считать независимо по файлам, порциям и процессам и складывать в любом порядке.
+DEFAULT_HLL_PRECISION = 12
+
+
+def hash_column(values) -> np.ndarray:
+    """
+    64-битные хэши значений столбца. У категориальных столбцов хэшируются только категории,
+    а хэши строк берутся по кодам. Пропуски получают общий хэш и считаются одним значением,
+    как в nunique(dropna=False).
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        category_hashes = pd.util.hash_array(np.append(series.cat.categories.to_numpy(dtype=object), None), categorize=False)
+        # Код -1 (пропуск) указывает на последний элемент - хэш None
+        return category_hashes[series.cat.codes.to_numpy()]
+    return pd.util.hash_array(series.to_numpy(dtype=object).astype(str), categorize=True)
+
+
+def hll_positions(hashes: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Номер регистра (старшие precision бит хэша) и ранг: позиция первой единицы
+    в оставшихся битах, считая со старшего (1 + количество ведущих нулей).
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    rest_bits = 64 - precision
+    index = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+    rest = hashes & np.uint64((1 << rest_bits) - 1)
+
+    # Длина значения в битах: через log2 и поправка на ошибки округления float64
+    bit_length = np.zeros(len(rest), dtype=np.int64)
+    nonzero = rest > 0
+    bit_length[nonzero] = np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64) + 1
+    too_long = nonzero & (np.left_shift(np.uint64(1), (bit_length - 1).clip(0).astype(np.uint64)) > rest)
+    bit_length[too_long] -= 1
+    rank = (rest_bits - bit_length + 1).astype(np.uint8)
+    return index, rank
+
+
+def hll_registers(group_codes: np.ndarray, n_groups: int, hashes: np.ndarray, precision: int = DEFAULT_HLL_PRECISION) -> np.ndarray:
+    """
+    Строит скетчи HyperLogLog сразу для всех групп.
+
+    :param group_codes: Номер группы (0..n_groups-1) для каждого хэша.
+    :param n_groups: Количество групп.
+    :param hashes: 64-битные хэши значений (см. hash_column).
+    :param precision: Количество бит номера регистра, от 4 до 16.
+    :return: Матрица регистров uint8 размера n_groups x 2^precision.
+    """
+    if not 4 <= precision <= 16:
+        raise ValueError(f"Точность HyperLogLog должна быть от 4 до 16, получено {precision}")
+    m = 1 << precision
+    registers = np.zeros(n_groups * m, dtype=np.uint8)
+    if len(hashes):
+        index, rank = hll_positions(hashes, precision)
+        np.maximum.at(registers, np.asarray(group_codes, dtype=np.int64) * m + index, rank)
+    return registers.reshape(n_groups, m)
+
+
+def hll_group_counts(group_codes: np.ndarray, n_groups: int, hashes: np.ndarray, precision: int = DEFAULT_HLL_PRECISION) -> np.ndarray:
+    """
+    Приближённое количество различных значений в каждой группе, округлённое до целого.
+    Память - n_groups * 2^precision байт независимо от количества значений.
+    """
+    return np.rint(hll_estimate(hll_registers(group_codes, n_groups, hashes, precision))).astype(np.int64)
+
+
+def hll_merge(*registers: np.ndarray) -> np.ndarray:
+    """
+    Объединяет скетчи (множество значений объединения) поэлементным максимумом регистров.
+    """
+    return np.maximum.reduce(registers)
+
+
+def _hll_sigma(x: np.ndarray) -> np.ndarray:
+    """
+    Функция sigma улучшенной оценки Ertl: x + sum(x^(2^k) * 2^(k-1)), k >= 1.
+    """
+    x = x.astype(np.float64)
+    result = x.copy()
+    y = 1.0
+    for _ in range(64):
+        x = x * x
+        result += x * y
+        y += y
+    return np.where(x == 1, np.inf, result)
+
+
+def _hll_tau(x: np.ndarray) -> np.ndarray:
+    """
+    Функция tau улучшенной оценки Ertl: (1 - x - sum((1 - x^(2^-k))^2 * 2^-k)) / 3, k >= 1.
+    """
+    x = x.astype(np.float64)
+    edge = (x == 0) | (x == 1)
+    result = 1 - x
+    y = 1.0
+    for _ in range(64):
+        x = np.sqrt(x)
+        y *= 0.5
+        result -= (1 - x) ** 2 * y
+    return np.where(edge, 0.0, result / 3)
+
+
+def hll_estimate(registers: np.ndarray) -> np.ndarray:
+    """
+    Оценка количества различных значений для каждой строки матрицы регистров.
+
+    Используется улучшенная оценка Ertl (2017) по гистограмме регистров: она не требует
+    таблиц поправок HyperLogLog++ и несмещена во всём диапазоне, от единиц значений
+    до миллиардов. Относительная стандартная ошибка - около 1.04 / sqrt(m), m = 2^precision:
+    1.6% при precision=12, 0.8% при precision=14. Для количеств намного меньше m оценка почти точна.
+    """
+    registers = np.atleast_2d(registers)
+    n, m = registers.shape
+    q = 64 - (m.bit_length() - 1)
+    # Гистограмма значений регистров по каждой строке: counts[i, k] - число регистров со значением k
+    counts = np.bincount(
+        (np.arange(n)[:, None] * (q + 2) + registers).ravel(),
+        minlength=n * (q + 2)
+    ).reshape(n, q + 2).astype(np.float64)
+
+    z = m * _hll_tau(1 - counts[:, q + 1] / m)
+    for k in range(q, 0, -1):
+        z = 0.5 * (z + counts[:, k])
+    z = z + m * _hll_sigma(counts[:, 0] / m)
+    return m * m / (2 * np.log(2)) / z
+
+
+def hll_error_bound(precision: int) -> float:
+    """
+    Относительная стандартная ошибка оценки HyperLogLog для заданной точности.
+    """
+    return 1.04 / np.sqrt(1 << precision)
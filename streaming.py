@@ -0,0 +1,422 @@
+import os
+import time
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from data_utils import parse_log_line, iter_log_chunks
+from features import (
+    prepare_base_columns,
+    build_feature_matrix,
+    apply_reference_stats,
+    model_distinct_precision,
+    SOURCE_COLUMNS,
+    SUSPICIOUS_ENDPOINTS
+)
+from minute_index import build_minute_index, empty_minute_index, merge_minute_indexes, apply_minute_index
+from model_utils import infer_anomalies, analyze_anomalies
+from sketches import DEFAULT_HLL_PRECISION, hash_column, hll_registers, hll_merge, hll_estimate
+
+
+def follow_log_file(log_path: str, poll_interval: float = 0.5, from_start: bool = False) -> Iterator[Optional[str]]:
+    """
+    Построчно читает дописываемый лог-файл, аналогично `tail -F`.
+
+    Ротация определяется по смене inode (logrotate с переименованием) или
+    уменьшению размера (copytruncate), после чего файл открывается заново с начала.
+    Если новых строк нет, генератор возвращает None, чтобы вызывающий код
+    мог сбросить накопленный батч по таймауту.
+
+    :param log_path: Путь к лог-файлу.
+    :param poll_interval: Пауза между проверками файла при отсутствии новых строк, в секундах.
+    :param from_start: Читать файл с начала, а не только новые строки.
+    """
+    f = None
+    inode = None
+    pending = ''
+    try:
+        while True:
+            if f is None:
+                try:
+                    f = open(log_path, 'r', encoding='utf-8')
+                except FileNotFoundError:
+                    yield None
+                    time.sleep(poll_interval)
+                    continue
+                inode = os.fstat(f.fileno()).st_ino
+                if not from_start:
+                    f.seek(0, os.SEEK_END)
+                # Новый файл после ротации читаем целиком
+                from_start = True
+
+            line = f.readline()
+            if line:
+                pending += line
+                if pending.endswith('\n'):
+                    yield pending
+                    pending = ''
+                continue
+
+            try:
+                stat = os.stat(log_path)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and (stat.st_ino != inode or stat.st_size < f.tell()):
+                f.close()
+                f = None
+                pending = ''
+                continue
+
+            yield None
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
+
+
+def iter_micro_batches(lines: Iterator[Optional[str]], batch_size: int, batch_seconds: float) -> Iterator[pd.DataFrame]:
+    """
+    Группирует строки лога в микробатчи: батч отдаётся при накоплении
+    batch_size записей или по истечении batch_seconds с первой записи батча.
+    """
+    rows = []
+    started = None
+    for line in lines:
+        if line is not None:
+            data = parse_log_line(line)
+            if data:
+                rows.append(data)
+                if started is None:
+                    started = time.monotonic()
+        if rows and (len(rows) >= batch_size or time.monotonic() - started >= batch_seconds):
+            yield pd.DataFrame(rows)
+            rows = []
+            started = None
+
+
+class RunningReferenceStats:
+    """
+    Накапливает частоты User-Agent и среднее/дисперсию времени ответа по endpoint'ам
+    по мере поступления данных. Используется, когда сохранённых статистик обучения нет,
+    а также для их расчёта при обучении по порциям.
+    """
+
+    def __init__(self):
+        self.ua_counts: Dict[str, int] = {}
+        self.total_rows = 0
+        # endpoint -> [количество, среднее, сумма квадратов отклонений]
+        self.endpoint_rt: Dict[str, List[float]] = {}
+
+    def update(self, df: pd.DataFrame) -> None:
+        """
+        Добавляет порцию данных в накопленные статистики.
+        """
+        for ua, count in df['http_user_agent'].value_counts().items():
+            if count == 0:
+                continue
+            self.ua_counts[ua] = self.ua_counts.get(ua, 0) + count
+        self.total_rows += len(df)
+
+        # Объединяем статистики порции с накопленными параллельной формулой Чана
+        batch = df.groupby('endpoint', observed=True)['request_time'].agg(['count', 'mean', 'var'])
+        for endpoint, (count, mean, var) in batch.iterrows():
+            m2 = 0.0 if count < 2 else var * (count - 1)
+            prev = self.endpoint_rt.get(endpoint)
+            if prev is None:
+                self.endpoint_rt[endpoint] = [count, mean, m2]
+                continue
+            n = prev[0] + count
+            delta = mean - prev[1]
+            prev[1] += delta * count / n
+            prev[2] += m2 + delta ** 2 * prev[0] * count / n
+            prev[0] = n
+
+    def copy(self) -> 'RunningReferenceStats':
+        """
+        Независимая копия накопленных статистик.
+        """
+        result = RunningReferenceStats()
+        result.ua_counts = dict(self.ua_counts)
+        result.total_rows = self.total_rows
+        result.endpoint_rt = {endpoint: list(stats) for endpoint, stats in self.endpoint_rt.items()}
+        return result
+
+    def to_reference_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистики в формате features.compute_reference_stats.
+        """
+        threshold_freq = 0.005 * self.total_rows
+        return {
+            'frequent_user_agents': {ua for ua, count in self.ua_counts.items() if count >= threshold_freq},
+            'endpoint_mean_rt': {k: v[1] for k, v in self.endpoint_rt.items()},
+            'endpoint_std_rt': {k: float(np.sqrt(v[2] / (v[0] - 1))) if v[0] > 1 else 0.0 for k, v in self.endpoint_rt.items()},
+        }
+
+
+class SlidingWindowState:
+    """
+    Инкрементально поддерживает оконные признаки preprocess_logs
+    (requests_per_minute, error_rate_5min, endpoint_variance_5min,
+    redirect_rate_5min, unique_ips_10min) для потоковой детекции.
+
+    Окна выровнены так же, как pd.Grouper в preprocess_logs. Хранятся только
+    текущее и предыдущее окно каждого размера, поэтому память ограничена.
+
+    Признаки записи считаются по той части её окна, которая уже прочитана к концу
+    микробатча, - записи не ждут закрытия окна. С preprocess_logs по тому же файлу они
+    совпадают только для окон, закрывшихся внутри микробатча: в ещё открытом окне
+    количества меньше итоговых, а доли посчитаны по первым записям окна.
+
+    Редкие User-Agent'ы и z-оценки считаются по сохранённым статистикам обучения,
+    а если их нет - по RunningReferenceStats, накопленным за время работы.
+
+    Различные endpoint'ы и IP окна хранятся множеством, а если задан distinct_precision -
+    скетчем HyperLogLog фиксированного размера (2^distinct_precision байт на окно),
+    который не растёт при флуде запросов с сотен тысяч адресов.
+
+    Для моделей, обученных со скользящими окнами (window_features='sliding'), вместо
+    фиксированных интервалов хранится поминутный индекс последних 10 минут (см. minute_index.py)
+    со скетчами точности hll_precision, и признаки записи считаются, как при обучении,
+    по окнам, заканчивающимся её минутой. Такие окна не ждут следующих минут, поэтому
+    неполной бывает только текущая минута записи.
+    """
+
+    # Сколько последних минут хранится в режиме скользящих окон: самое длинное окно - unique_ips_10min
+    SLIDING_WINDOW_MINUTES = 10
+
+    def __init__(
+        self,
+        reference_stats: Optional[Dict[str, Any]] = None,
+        running_stats: Optional[RunningReferenceStats] = None,
+        distinct_precision: Optional[int] = None,
+        window_features: str = 'buckets',
+        hll_precision: int = DEFAULT_HLL_PRECISION
+    ):
+        if window_features not in ('buckets', 'sliding'):
+            raise ValueError(f"Неизвестный режим оконных признаков {window_features}, ожидается 'buckets' или 'sliding'")
+        self.minute_counts: Dict[pd.Timestamp, int] = {}
+        self.five_min: Dict[pd.Timestamp, list] = {}
+        self.ten_min_ips: Dict[pd.Timestamp, Any] = {}
+        self.window_features = window_features
+        self.hll_precision = hll_precision
+        self.minute_index = empty_minute_index(hll_precision)
+        self.reference_stats = reference_stats
+        self.running_stats = running_stats if running_stats is not None else RunningReferenceStats()
+        self.distinct_precision = distinct_precision
+
+    def update(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Добавляет микробатч в окна и возвращает его с рассчитанными признаками.
+        """
+        df = prepare_base_columns(df).sort_values(by='timestamp').reset_index(drop=True)
+        if 'remote_addr' not in df.columns:
+            df['remote_addr'] = np.nan
+        if 'http_user_agent' not in df.columns:
+            df['http_user_agent'] = 'unknown'
+
+        df['is_redirect'] = df['response_status'].between(300, 400, inclusive='left').astype('int8')
+        if self.window_features == 'sliding':
+            self._update_minutes(df)
+        else:
+            self._update_buckets(df)
+
+        if self.reference_stats is not None:
+            apply_reference_stats(df, self.reference_stats)
+        else:
+            self.running_stats.update(df)
+            apply_reference_stats(df, self.running_stats.to_reference_stats())
+
+        df['is_suspicious_endpoint'] = df['endpoint'].str.lower().isin(SUSPICIOUS_ENDPOINTS).astype('int8')
+
+        self._evict()
+        return df
+
+    def _update_buckets(self, df: pd.DataFrame) -> None:
+        """
+        Добавляет записи в фиксированные окна и записывает в df их оконные признаки.
+        """
+        is_error = (df['response_status'] >= 400).astype('int8')
+
+        minute = df['timestamp'].dt.floor('1min')
+        five_min = df['timestamp'].dt.floor('5min')
+        ten_min = df['timestamp'].dt.floor('10min')
+
+        for bucket, count in df.groupby(minute)['remote_addr'].count().items():
+            self.minute_counts[bucket] = self.minute_counts.get(bucket, 0) + count
+        df['requests_per_minute'] = minute.map(self.minute_counts)
+
+        grouped = pd.DataFrame({'is_error': is_error, 'is_redirect': df['is_redirect'], 'endpoint': df['endpoint']}).groupby(five_min)
+        for bucket, group in grouped:
+            agg = self.five_min.setdefault(bucket, [0, 0, 0, self._new_distinct()])
+            agg[0] += len(group)
+            agg[1] += int(group['is_error'].sum())
+            agg[2] += int(group['is_redirect'].sum())
+            agg[3] = self._add_distinct(agg[3], group['endpoint'])
+        df['error_rate_5min'] = five_min.map({k: v[1] / v[0] for k, v in self.five_min.items()})
+        df['endpoint_variance_5min'] = five_min.map({k: self._count_distinct(v[3]) for k, v in self.five_min.items()})
+        df['redirect_rate_5min'] = five_min.map({k: v[2] / v[0] for k, v in self.five_min.items()})
+
+        for bucket, ips in df.groupby(ten_min)['remote_addr']:
+            self.ten_min_ips[bucket] = self._add_distinct(self.ten_min_ips.get(bucket, self._new_distinct()), ips)
+        df['unique_ips_10min'] = ten_min.map({k: self._count_distinct(v) for k, v in self.ten_min_ips.items()})
+
+    def _update_minutes(self, df: pd.DataFrame) -> None:
+        """
+        Добавляет записи в поминутный индекс и записывает в df оконные признаки
+        по скользящим окнам, заканчивающимся минутой каждой записи.
+        """
+        batch_index = build_minute_index(df, self.hll_precision)
+        self.minute_index = merge_minute_indexes([self.minute_index, batch_index], self.hll_precision)
+        apply_minute_index(df, self.minute_index)
+
+    def snapshot(self) -> tuple:
+        """
+        Копия окон (и накопленных статистик, если сохранённых нет), к которой можно
+        вернуться через restore, если обработка батча прервалась на середине.
+        Копируются только текущее и предыдущее окна, поэтому снимок дешёвый.
+        Массивы поминутного индекса не изменяются на месте, а заменяются, их можно не копировать.
+        """
+        return (
+            dict(self.minute_counts),
+            {bucket: agg[:3] + [agg[3].copy()] for bucket, agg in self.five_min.items()},
+            {bucket: distinct.copy() for bucket, distinct in self.ten_min_ips.items()},
+            self.minute_index,
+            self.running_stats.copy() if self.reference_stats is None else self.running_stats,
+        )
+
+    def restore(self, snapshot: tuple) -> None:
+        """
+        Возвращает окна к снимку snapshot().
+        """
+        self.minute_counts, self.five_min, self.ten_min_ips, self.minute_index, self.running_stats = snapshot
+
+    def _new_distinct(self) -> Any:
+        if self.distinct_precision is None:
+            return set()
+        return np.zeros(1 << self.distinct_precision, dtype=np.uint8)
+
+    def _add_distinct(self, distinct: Any, values: pd.Series) -> Any:
+        """
+        Добавляет значения в множество или скетч окна и возвращает его.
+        """
+        if self.distinct_precision is None:
+            distinct.update(values.unique())
+            return distinct
+        registers = hll_registers(np.zeros(len(values), dtype=np.int64), 1, hash_column(values), self.distinct_precision)
+        return hll_merge(distinct, registers[0])
+
+    def _count_distinct(self, distinct: Any) -> int:
+        if self.distinct_precision is None:
+            return len(distinct)
+        return int(np.rint(hll_estimate(distinct)[0]))
+
+    def _evict(self) -> None:
+        """
+        Удаляет окна старше предыдущего для каждого размера окна
+        и минуты индекса старше SLIDING_WINDOW_MINUTES последних.
+        """
+        minutes = self.minute_index['minutes']
+        if len(minutes):
+            keep = minutes > minutes[-1] - np.timedelta64(self.SLIDING_WINDOW_MINUTES, 'm')
+            if not keep.all():
+                self.minute_index = {
+                    key: value[keep] if isinstance(value, np.ndarray) else value
+                    for key, value in self.minute_index.items()
+                }
+        for windows, freq in ((self.minute_counts, '1min'), (self.five_min, '5min'), (self.ten_min_ips, '10min')):
+            if not windows:
+                continue
+            oldest = max(windows) - pd.Timedelta(freq)
+            for bucket in [b for b in windows if b < oldest]:
+                del windows[bucket]
+
+
+def stream_detect(
+    log_path: str,
+    model: IsolationForest,
+    scaler: StandardScaler,
+    reference_stats: Optional[Dict[str, Any]] = None,
+    batch_size: int = 1000,
+    batch_seconds: float = 2.0,
+    poll_interval: float = 0.5,
+    from_start: bool = False,
+    window_features: str = 'buckets',
+    hll_precision: int = DEFAULT_HLL_PRECISION
+) -> Iterator[pd.DataFrame]:
+    """
+    Следит за лог-файлом и оценивает новые записи микробатчами.
+    Причины аномалий определяются analyze_anomalies, как при пакетной детекции,
+    но перцентильные пороги правил считаются по записям микробатча.
+
+    :param window_features: Режим оконных признаков, с которым обучена модель ('buckets' или 'sliding').
+    :param hll_precision: Точность скетчей поминутного индекса в режиме 'sliding'.
+    :return: Генератор DataFrame'ов с объяснёнными аномалиями каждого микробатча
+        (со столбцами anomaly_rule_mask и anomaly_reason).
+    """
+    state = SlidingWindowState(
+        reference_stats,
+        distinct_precision=model_distinct_precision(reference_stats),
+        window_features=window_features,
+        hll_precision=hll_precision
+    )
+    lines = follow_log_file(log_path, poll_interval=poll_interval, from_start=from_start)
+    for batch in iter_micro_batches(lines, batch_size, batch_seconds):
+        scored = infer_anomalies(state.update(batch), model, scaler)
+        anomalies = analyze_anomalies(scored)
+        logging.debug(f"Микробатч: {len(scored)} записей, аномалий: {int((scored['anomaly'] == -1).sum())}, объяснённых: {len(anomalies)}")
+        if not anomalies.empty:
+            yield anomalies
+
+
+# Поля логов, нужные для статистик обучающей выборки (см. RunningReferenceStats)
+REFERENCE_SOURCE_COLUMNS = ['request', 'request_time', 'body_bytes_sent', 'response_status', 'http_user_agent']
+
+
+def accumulate_reference_stats(log_files: List[str], chunk_rows: int, running_stats: RunningReferenceStats) -> RunningReferenceStats:
+    """
+    Быстрый проход по логам порциями: только частоты User-Agent и среднее/дисперсия
+    времени ответа по endpoint'ам, без оконных признаков.
+    """
+    for chunk in iter_log_chunks(log_files, chunk_rows, fields=REFERENCE_SOURCE_COLUMNS):
+        for col in REFERENCE_SOURCE_COLUMNS:
+            if col not in chunk.columns:
+                chunk[col] = 'unknown' if col == 'http_user_agent' else np.nan
+        running_stats.update(prepare_base_columns(chunk))
+    return running_stats
+
+
+def iter_feature_chunks(
+    log_files: List[str],
+    chunk_rows: int,
+    running_stats: Optional[RunningReferenceStats] = None,
+    distinct_precision: Optional[int] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Отдаёт матрицу признаков по историческим логам порциями не более chunk_rows строк.
+
+    Логи читаются дважды. Первый проход (accumulate_reference_stats) накапливает в running_stats
+    частоты User-Agent и статистики endpoint'ов по всей истории всех стендов. Второй считает
+    признаки с этими итоговыми статистиками - теми же, что сохраняются с моделью и применяются
+    при детекции, - как preprocess_logs по всей истории сразу.
+
+    Файлы каждого стенда (директории) читаются в порядке имён, то есть по датам,
+    с отдельным SlidingWindowState, так что окна переходят через границы порций и файлов.
+    """
+    if running_stats is None:
+        running_stats = RunningReferenceStats()
+    stands: Dict[str, List[str]] = {}
+    for log_file in sorted(log_files):
+        stands.setdefault(os.path.dirname(log_file), []).append(log_file)
+
+    logging.info("Считаем частоты User-Agent и статистики endpoint'ов по всей истории...")
+    reference_stats = accumulate_reference_stats(sorted(log_files), chunk_rows, running_stats).to_reference_stats()
+
+    for stand, files in stands.items():
+        logging.info(f"Стенд {stand}: {len(files)} файлов")
+        state = SlidingWindowState(reference_stats, distinct_precision=distinct_precision)
+        for chunk in iter_log_chunks(files, chunk_rows, fields=SOURCE_COLUMNS):
+            yield build_feature_matrix(state.update(chunk))
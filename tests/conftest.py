@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, 'tests', 'data')
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture
+def log_file() -> str:
+    """
+    Небольшой лог за полчаса на границе суток: ошибки, редиректы, редкие User-Agent'ы,
+    подозрительные endpoint'ы и записи с пропусками (без запроса, без времени, с битыми числами).
+    """
+    return os.path.join(DATA_DIR, 'api-gateway2025-01-24.log')
@@ -0,0 +1,32 @@
+import json
+
+from data_utils import load_logs_to_dataframe, load_logs_cached
+
+
+def test_cache_of_mixed_type_log_matches_uncached(log_file, tmp_path):
+    mixed_file = str(tmp_path / 'api-gateway-mixed.log')
+    record = {
+        'timestamp': '2025-01-24T23:45:00+03:00',
+        'remote_addr': 167772161,
+        'request': 'GET /api/v1/users HTTP/1.1',
+        'request_time': 0.05,
+        'body_bytes_sent': '1200',
+        'response_status': 200,
+        'http_user_agent': 'curl/8.5.0',
+    }
+    with open(log_file, encoding='utf-8') as src, open(mixed_file, 'w', encoding='utf-8') as dst:
+        dst.write(src.read())
+        dst.write(f"Jan 24 23:45:00 api-gateway nginx: {json.dumps(record)}\n")
+
+    expected = load_logs_to_dataframe([mixed_file])
+    assert expected['remote_addr'].map(type).nunique() > 1
+    result = load_logs_cached([mixed_file], str(tmp_path / 'cache'))
+    # Повторный запуск читает уже записанный кэш
+    repeated = load_logs_cached([mixed_file], str(tmp_path / 'cache'))
+
+    assert list(result.columns) == list(expected.columns)
+    for col in expected.columns:
+        values = expected[col].where(expected[col].isna(), expected[col].astype(str))
+        for frame in (result, repeated):
+            assert frame[col].astype(object).where(frame[col].notna(), None).tolist() == \
+                values.astype(object).where(values.notna(), None).tolist(), col
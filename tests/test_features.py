@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+from data_utils import load_logs_to_dataframe
+from features import preprocess_logs, compute_reference_stats, FEATURE_COLUMNS
+
+
+def original_preprocess_logs(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Исходная построчная реализация preprocess_logs, с которой сверяется векторная.
+    """
+    if 'timestamp' in df.columns:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    else:
+        df['timestamp'] = pd.NaT
+
+    def extract_endpoint(request: str) -> str:
+        try:
+            parts = request.split()
+            return parts[1] if len(parts) > 1 else 'unknown'
+        except:
+            return 'unknown'
+
+    if 'request' in df.columns:
+        df['endpoint'] = df['request'].apply(extract_endpoint)
+    else:
+        df['endpoint'] = 'unknown'
+
+    df['request_time'] = pd.to_numeric(df['request_time'], errors='coerce')
+    df['body_bytes_sent'] = pd.to_numeric(df['body_bytes_sent'], errors='coerce')
+    df['response_status'] = pd.to_numeric(df['response_status'], errors='coerce')
+    df.fillna({'request_time': 0, 'body_bytes_sent': 0, 'response_status': 0}, inplace=True)
+
+    df = df.sort_values(by='timestamp').set_index('timestamp')
+
+    df['requests_per_minute'] = (
+        df.groupby(pd.Grouper(freq='1min'))['remote_addr']
+          .transform('count')
+    )
+
+    df['is_error'] = df['response_status'].apply(lambda x: 1 if x >= 400 else 0)
+    df['error_rate_5min'] = (
+        df.groupby(pd.Grouper(freq='5min'))['is_error']
+          .transform('mean')
+    )
+
+    df['endpoint_variance_5min'] = (
+        df.groupby(pd.Grouper(freq='5min'))['endpoint']
+          .transform(lambda x: len(set(x)))
+    )
+
+    if 'http_user_agent' not in df.columns:
+        df['http_user_agent'] = 'unknown'
+    ua_counts = df['http_user_agent'].value_counts()
+    total_ua = len(df)
+    threshold_freq = 0.005 * total_ua
+    rare_ua_set = set(ua_counts[ua_counts < threshold_freq].index)
+    df['is_rare_ua'] = df['http_user_agent'].apply(lambda ua: 1 if ua in rare_ua_set else 0)
+
+    endpoint_stats = df.groupby('endpoint')['request_time'].agg(['mean','std']).rename(columns={'mean':'mean_rt','std':'std_rt'})
+    endpoint_stats.fillna(0, inplace=True)
+    df = df.reset_index().merge(endpoint_stats, how='left', on='endpoint').set_index('timestamp')
+
+    def zscore(row):
+        std_rt = row['std_rt']
+        mean_rt = row['mean_rt']
+        if std_rt == 0:
+            return 0
+        return (row['request_time'] - mean_rt) / std_rt
+
+    df['endpoint_zscore'] = df.apply(zscore, axis=1)
+
+    SUSPICIOUS_ENDPOINTS = {'/phpmyadmin','/admin','/shell','/wp-login.php'}
+    df['is_suspicious_endpoint'] = df['endpoint'].apply(lambda ep: 1 if ep.lower() in SUSPICIOUS_ENDPOINTS else 0)
+
+    df['is_redirect'] = df['response_status'].apply(lambda x: 1 if 300 <= x < 400 else 0)
+    df['redirect_rate_5min'] = (
+        df.groupby(pd.Grouper(freq='5min'))['is_redirect']
+          .transform('mean')
+    )
+
+    df['unique_ips_10min'] = (
+        df.groupby(pd.Grouper(freq='10min'))['remote_addr']
+          .transform(lambda x: len(set(x)))
+    )
+
+    df = df.reset_index()
+    df.drop(columns=['is_error'], inplace=True, errors='ignore')
+
+    return df
+
+
+def test_preprocess_logs_matches_original(log_file):
+    df = load_logs_to_dataframe([log_file])
+    # Исходная реализация падает на записи без времени (transform по pd.Grouper с NaT), сверяем без неё
+    df = df[df['timestamp'].notna()].reset_index(drop=True)
+    expected = original_preprocess_logs(df.copy())
+    result = preprocess_logs(df.copy())
+
+    pd.testing.assert_series_equal(result['timestamp'], expected['timestamp'])
+    assert result['endpoint'].astype(object).tolist() == expected['endpoint'].tolist()
+    for col in ['mean_rt', 'std_rt', *FEATURE_COLUMNS]:
+        np.testing.assert_array_equal(
+            result[col].to_numpy(dtype=np.float64),
+            expected[col].to_numpy(dtype=np.float64),
+            err_msg=col
+        )
+
+
+def test_preprocess_logs_keeps_rows_without_timestamp(log_file):
+    df = load_logs_to_dataframe([log_file])
+    result = preprocess_logs(df)
+
+    assert len(result) == len(df)
+    untimed = result[result['timestamp'].isna()]
+    assert untimed['endpoint'].astype(object).tolist() == ['/admin']
+    # Запись без времени не попадает ни в одно окно
+    assert untimed[['requests_per_minute', 'endpoint_variance_5min', 'unique_ips_10min']].eq(0).all(axis=None)
+    assert untimed[['error_rate_5min', 'redirect_rate_5min']].isna().all(axis=None)
+    assert untimed['is_suspicious_endpoint'].tolist() == [1]
+
+
+def test_reference_stats_mark_unseen_user_agent_rare(log_file):
+    train = preprocess_logs(load_logs_to_dataframe([log_file]))
+    reference_stats = compute_reference_stats(train)
+
+    df = pd.DataFrame({
+        'timestamp': ['2025-01-25T00:00:00+03:00'] * 3,
+        'remote_addr': ['10.0.0.1'] * 3,
+        'request': ['GET /api/v1/users HTTP/1.1'] * 3,
+        'request_time': ['0.01'] * 3,
+        'body_bytes_sent': ['100'] * 3,
+        'response_status': ['200'] * 3,
+        'http_user_agent': ['Mozilla/5.0 (X11; Linux x86_64)', 'never-seen-scanner/1.0', 'sqlmap/1.7'],
+    })
+    result = preprocess_logs(df, reference_stats)
+    assert result.set_index('http_user_agent')['is_rare_ua'].to_dict() == {
+        'Mozilla/5.0 (X11; Linux x86_64)': 0,
+        'never-seen-scanner/1.0': 1,
+        'sqlmap/1.7': 1,
+    }
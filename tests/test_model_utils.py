@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from features import FEATURE_COLUMNS
+from model_utils import CompiledForest, scoring_model, update_anomaly_model
+
+
+def make_features(rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.normal(size=(rows, len(FEATURE_COLUMNS))), columns=FEATURE_COLUMNS)
+
+
+def plain_forest():
+    return IsolationForest(n_estimators=50, contamination=0.01, random_state=42).fit(make_features(2000, 0).to_numpy())
+
+
+def updated_forest():
+    X = make_features(2000, 0)
+    scaler = StandardScaler().fit(X)
+    model = IsolationForest(n_estimators=50, contamination=0.01, random_state=42).fit(scaler.transform(X))
+    model, scaler = update_anomaly_model(model, scaler, make_features(1000, 1) + 0.5, new_trees=20, max_trees=50, random_state=43)
+    # Из 70 деревьев 20 самых старых удалены
+    assert len(model.estimators_) == len(model._seeds) == 50
+    return model
+
+
+def subspace_forest():
+    return IsolationForest(n_estimators=50, max_features=0.5, contamination=0.01, random_state=42).fit(make_features(2000, 0).to_numpy())
+
+
+@pytest.mark.parametrize('make_forest', [plain_forest, updated_forest, subspace_forest])
+def test_compiled_forest_matches_sklearn(make_forest):
+    model = make_forest()
+    compiled = CompiledForest(model)
+    # Выбросы и строки, которых больше одного блока CompiledForest
+    X = make_features(3000, 3).to_numpy() * 2.0
+
+    np.testing.assert_allclose(compiled.score_samples(X), model.score_samples(X), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(compiled.decision_function(X), model.decision_function(X), rtol=0, atol=1e-9)
+
+
+def test_auto_scoring_falls_back_to_sklearn_for_deep_forest():
+    X = np.random.default_rng(0).normal(size=(200_000, 2))
+    model = IsolationForest(n_estimators=3, max_samples=len(X), random_state=42).fit(X)
+    assert max(estimator.tree_.max_depth for estimator in model.estimators_) > CompiledForest.MAX_DEPTH
+
+    assert scoring_model(model, 'auto') is model
+    with pytest.raises(ValueError):
+        scoring_model(model, 'compiled')
@@ -0,0 +1,61 @@
+import os
+import shutil
+
+import pytest
+
+from data_utils import load_logs_to_dataframe, read_log_rows
+from features import preprocess_logs, build_feature_matrix, compute_reference_stats
+from model_utils import train_anomaly_model
+from main import main_rescore
+
+
+@pytest.fixture
+def model_path(log_file, tmp_path):
+    df = preprocess_logs(load_logs_to_dataframe([log_file]))
+    path = str(tmp_path / 'model.pkl')
+    train_anomaly_model(build_feature_matrix(df), path, compute_reference_stats(df))
+    return path
+
+
+def test_read_log_rows_from_zst(log_file, tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    zst_file = str(tmp_path / (os.path.basename(log_file) + '.zst'))
+    with open(log_file, 'rb') as src, open(zst_file, 'wb') as dst:
+        dst.write(zstandard.ZstdCompressor().compress(src.read()))
+
+    offsets = load_logs_to_dataframe([log_file], offsets=True)['line_offset'].to_numpy()[[3, 150, 299]]
+    expected = read_log_rows(log_file, offsets)
+    result = read_log_rows(zst_file, offsets)
+    assert result.to_dict('records') == expected.to_dict('records')
+
+
+def test_rescore_zst_matches_plain_log(log_file, model_path, tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    plain_dir, zst_dir = tmp_path / 'plain', tmp_path / 'zst'
+    plain_dir.mkdir()
+    zst_dir.mkdir()
+    plain_file = str(plain_dir / os.path.basename(log_file))
+    shutil.copy(log_file, plain_file)
+    zst_file = str(zst_dir / (os.path.basename(log_file) + '.zst'))
+    with open(log_file, 'rb') as src, open(zst_file, 'wb') as dst:
+        dst.write(zstandard.ZstdCompressor().compress(src.read()))
+
+    # Порог выше нуля, чтобы аномалий хватило на перечитывание записей из файла
+    thresholds = [0.0, 0.05]
+    expected = main_rescore(plain_file, {'m': model_path}, thresholds, store_dir=str(tmp_path / 'store_plain'), workers=1)
+    result = main_rescore(zst_file, {'m': model_path}, thresholds, store_dir=str(tmp_path / 'store_zst'), workers=1)
+    # Второй запуск читает матрицу из хранилища, а записи аномалий - из сжатого файла
+    repeated = main_rescore(zst_file, {'m': model_path}, thresholds, store_dir=str(tmp_path / 'store_zst'), workers=1)
+
+    assert result == expected == repeated
+    assert result[-1]['anomalies'] > 0
+
+
+def test_rescore_day_without_parseable_rows(model_path, tmp_path):
+    log_file = str(tmp_path / 'api-gateway2025-01-25.log')
+    with open(log_file, 'w', encoding='utf-8') as f:
+        f.write("Jan 25 00:00:01 api-gateway nginx: upstream timed out (110: Connection timed out)\n")
+
+    result = main_rescore(log_file, {'m': model_path}, [0.0, 0.05], store_dir=str(tmp_path / 'store'), workers=1)
+
+    assert [(summary['rows'], summary['anomalies']) for summary in result] == [(0, 0), (0, 0)]
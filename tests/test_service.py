@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from data_utils import load_logs_to_dataframe
+from features import preprocess_logs, build_feature_matrix, compute_reference_stats
+from model_utils import train_anomaly_model, load_anomaly_model
+from service import ScoringService, InvalidRecordsError
+
+RECORD = {
+    'timestamp': '2025-01-24T23:50:00+03:00',
+    'remote_addr': '10.0.0.1',
+    'request': 'GET /api/v1/users HTTP/1.1',
+    'request_time': '0.05',
+    'body_bytes_sent': '1200',
+    'response_status': '200',
+    'http_user_agent': 'Mozilla/5.0 (X11; Linux x86_64)',
+}
+
+
+@pytest.fixture
+def service(log_file, tmp_path):
+    df = preprocess_logs(load_logs_to_dataframe([log_file]))
+    model_path = str(tmp_path / 'model.pkl')
+    train_anomaly_model(build_feature_matrix(df), model_path, compute_reference_stats(df))
+    model, scaler, reference_stats = load_anomaly_model(model_path)
+    # Долгое ожидание попутных запросов, чтобы одновременные запросы попали в один батч
+    return ScoringService(model, scaler, reference_stats, max_wait_seconds=0.5)
+
+
+def submit_concurrently(service, requests):
+    results = {}
+
+    def run(name, records):
+        try:
+            results[name] = service.submit(records, timeout=30)
+        except Exception as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=run, args=item) for item in requests.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_irregular_records_do_not_fail_the_batch(service):
+    results = submit_concurrently(service, {
+        'good': [RECORD],
+        'mixed_offsets': [RECORD, {**RECORD, 'timestamp': '2025-01-24T20:50:01Z'}],
+        'no_request_time': [{k: v for k, v in RECORD.items() if k != 'request_time'}],
+        'nested': [{**RECORD, 'remote_addr': {'ip': '10.0.0.1'}}],
+    })
+
+    assert isinstance(results['nested'], InvalidRecordsError)
+    for name in ('good', 'mixed_offsets', 'no_request_time'):
+        assert isinstance(results[name], list), results[name]
+    assert len(results['mixed_offsets']) == 2
+
+
+def test_failing_request_is_rescored_alone(service):
+    score = service.score
+
+    def failing_score(df):
+        if (df['remote_addr'] == 'broken').any():
+            raise RuntimeError('scoring failed')
+        return score(df)
+
+    service.score = failing_score
+    results = submit_concurrently(service, {
+        'good': [RECORD],
+        'broken': [{**RECORD, 'remote_addr': 'broken'}],
+    })
+
+    assert isinstance(results['broken'], RuntimeError)
+    assert isinstance(results['good'], list) and len(results['good']) == 1
+    # Окна не учитывают ни отменённый объединённый батч, ни упавший запрос
+    assert sum(service.state.minute_counts.values()) == 1